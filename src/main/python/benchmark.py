@@ -0,0 +1,412 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from multiprocessing import Process, Pipe, connection
+
+import cv2
+import numpy as np
+
+from classes.Rendering import draw_shapes, fit_size
+from classes.Shape import Shape, ShapeType
+from classes.Tiles import configure as configure_tiles
+from classes.VideoStream import reader
+
+logger = logging.getLogger('Benchmark')
+
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+CODECS = {
+    'mjpg': ('MJPG', '.avi'),
+    'mp4v': ('mp4v', '.mp4'),
+    'xvid': ('XVID', '.avi'),
+}
+
+
+def summarize(samples):
+    samples = np.array(samples, dtype=np.float64) * 1000
+    return {
+        'count': int(samples.size),
+        'mean_ms': float(samples.mean()),
+        'median_ms': float(np.median(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'max_ms': float(samples.max()),
+    }
+
+
+def synthetic_frame(index, width, height):
+    # deterministic content: a moving gradient, a bouncing box and the frame number
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:, :, 0] = ((x[None, :] + index * 4) % 256).astype(np.uint8)
+    frame[:, :, 1] = ((y[:, None] + index * 2) % 256).astype(np.uint8)
+    frame[:, :, 2] = ((x[None, :] // 4 + y[:, None] // 4 + index) % 256).astype(np.uint8)
+    size = max(height // 6, 8)
+    bx = (index * 7) % max(width - size, 1)
+    by = (index * 5) % max(height - size, 1)
+    cv2.rectangle(frame, (bx, by), (bx + size, by + size), (255, 255, 255), -1)
+    cv2.putText(frame, str(index), (10, height - 20), cv2.FONT_HERSHEY_DUPLEX, height / 360, (0, 0, 0), 2)
+    return frame
+
+
+def generate_video(path, width, height, frames, fps, codec, gop):
+    fourcc, _ = CODECS[codec]
+    # honoured by the FFmpeg backend of recent OpenCV builds, ignored elsewhere (MJPG is intra-only anyway)
+    os.environ['OPENCV_FFMPEG_WRITER_OPTIONS'] = f'g;{gop}'
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    if not writer.isOpened():
+        return False
+    for i in range(frames):
+        writer.write(synthetic_frame(i, width, height))
+    writer.release()
+    del os.environ['OPENCV_FFMPEG_WRITER_OPTIONS']
+    return True
+
+
+def bench_open(path, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        video = cv2.VideoCapture(path)
+        video.get(cv2.CAP_PROP_FPS)
+        video.get(cv2.CAP_PROP_FRAME_WIDTH)
+        video.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        video.get(cv2.CAP_PROP_FRAME_COUNT)
+        video.read()
+        samples.append(time.perf_counter() - start)
+        video.release()
+    return summarize(samples)
+
+
+def bench_decode(path):
+    video = cv2.VideoCapture(path)
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        check, frame = video.read()
+        if not check:
+            break
+        frames += 1
+    elapsed = time.perf_counter() - start
+    video.release()
+    return {'frames': frames, 'seconds': elapsed, 'fps': frames / elapsed if elapsed > 0 else 0}
+
+
+def bench_seek(path, total_frames, samples, seed):
+    rng = random.Random(seed)
+    video = cv2.VideoCapture(path)
+    times = []
+    for _ in range(samples):
+        index = rng.randrange(total_frames)
+        start = time.perf_counter()
+        video.set(cv2.CAP_PROP_POS_FRAMES, index)
+        video.read()
+        times.append(time.perf_counter() - start)
+    video.release()
+    return summarize(times)
+
+
+def bench_resize(width, height, container_width, container_height, repeat):
+    frame = synthetic_frame(0, width, height)
+    w, h = fit_size(width, height, container_width, container_height)
+    resize = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cv2.resize(frame, (w, h), interpolation=cv2.INTER_CUBIC)
+        resize.append(time.perf_counter() - start)
+    return {'target': [w, h], 'resize': summarize(resize)}
+
+
+def bench_tiles(width, height, container_width, container_height, repeat, workers):
+    # the operations of the reader on one large frame, in bands on `workers` threads (1: a single OpenCV call)
+    tiles = configure_tiles(workers)
+    frame = synthetic_frame(0, width, height)
+    size = fit_size(width, height, container_width, container_height)
+    pointer = Shape('pointer', ShapeType.pointer)
+    pointer.set_points([(width // 2, height // 2)])
+    rectangle = Shape('rectangle', ShapeType.rectangle)
+    rectangle.set_points([(width // 4, height // 4), (width // 2, height // 2)])
+    rectangle.message = 'benchmark'
+    operations = {
+        'resize': lambda: tiles.resize(frame, size, interpolation=cv2.INTER_CUBIC),
+        'cvt_color': lambda: tiles.cvt_color(frame, cv2.COLOR_BGR2YCrCb),
+        'masks': lambda: draw_shapes(frame.copy(), [pointer, rectangle], width, height),
+    }
+    result = {'workers': tiles.workers, 'target': list(size)}
+    for name, operation in operations.items():
+        operation()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            operation()
+            times.append(time.perf_counter() - start)
+        result[name] = summarize(times)
+    configure_tiles(1)
+    return result
+
+
+def pipe_sender(conn: connection.Connection, width, height, count):
+    frame = synthetic_frame(0, width, height)
+    for i in range(count):
+        conn.send({'action': 'frame', 'frame': frame, 'index': i})
+    conn.send({'action': 'ENDED'})
+    conn.close()
+
+
+def bench_pipe(width, height, count):
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=pipe_sender, args=(sender, width, height, count))
+    process.start()
+    received = 0
+    start = time.perf_counter()
+    while True:
+        action = receiver.recv()
+        if action['action'] == 'ENDED':
+            break
+        received += 1
+    elapsed = time.perf_counter() - start
+    process.join()
+    frame_bytes = width * height * 3
+    return {
+        'frames': received,
+        'frame_bytes': frame_bytes,
+        'fps': received / elapsed if elapsed > 0 else 0,
+        'mb_per_second': received * frame_bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0,
+    }
+
+
+def make_shapes(shape_count, width, height, seed):
+    rng = random.Random(seed)
+    shapes = []
+    types = [ShapeType.rectangle, ShapeType.ellipse, ShapeType.polygon, ShapeType.line]
+    for i in range(shape_count):
+        shape_type = types[i % len(types)]
+        shape = Shape(f'benchmark_{i}', shape_type)
+        points = 2 if shape_type in (ShapeType.rectangle, ShapeType.ellipse) else 5
+        for _ in range(points):
+            shape.add_point(rng.randrange(width), rng.randrange(height))
+        shape.message = f'shape {i}'
+        shapes.append(shape)
+    return shapes
+
+
+def bench_overlay(path, width, height, container_width, container_height, shape_count, frames, seed):
+    player_to_reader, reader_to_player = Pipe()
+    process = Process(target=reader, args=(reader_to_player, 10))
+    process.start()
+
+    # queued before the reader decodes its first frame
+    shapes = make_shapes(shape_count, width, height, seed)
+    player_to_reader.send({
+        'action': 'open',
+        'generation': 1,
+        'filename': path,
+        'width': container_width,
+        'height': container_height,
+        'index': 0,
+    })
+    player_to_reader.send({
+        'action': 'shapes_snapshot',
+        'seq': 1,
+        'shapes': [(i, shape) for i in range(frames + 1) for shape in shapes],
+        'drawing_shapes': [],
+    })
+    while player_to_reader.recv()['action'] != 'metadata':
+        pass
+
+    received = 0
+    start = None
+    while received < frames:
+        action = player_to_reader.recv()
+        if action['action'] == 'frame':
+            if start is None:
+                # the first frame also pays for opening the video and applying the snapshot
+                start = time.perf_counter()
+            else:
+                received += 1
+            player_to_reader.send({'action': 'gc', 'index': action['index']})
+    elapsed = time.perf_counter() - start
+
+    player_to_reader.send({'action': 'END'})
+    while player_to_reader.recv()['action'] != 'ENDED':
+        pass
+    process.join()
+    return {
+        'shapes': shape_count,
+        'frames': received,
+        'fps': received / elapsed if elapsed > 0 else 0,
+        'ms_per_frame': elapsed * 1000 / received if received > 0 else 0,
+    }
+
+
+def open_and_wait(conns, worker, generation, path, container_width, container_height, index=0):
+    start = time.perf_counter()
+    for i, conn in enumerate(conns):
+        if i != worker:
+            conn.send({'action': 'suspend'})
+    conns[worker].send({
+        'action': 'open',
+        'generation': generation,
+        'filename': path,
+        'width': container_width,
+        'height': container_height,
+        'index': index,
+    })
+    while True:
+        for conn in conns:
+            while conn.poll():
+                action = conn.recv()
+                if action['action'] == 'frame' and action['generation'] == generation:
+                    return time.perf_counter() - start
+
+
+def bench_switch(paths, container_width, container_height):
+    start = time.perf_counter()
+    conns, processes = [], []
+    for _ in range(2):
+        player_to_reader, reader_to_player = Pipe()
+        process = Process(target=reader, args=(reader_to_player, 10))
+        process.start()
+        conns.append(player_to_reader)
+        processes.append(process)
+    spawn = time.perf_counter() - start
+
+    result = {
+        'spawn_ms': spawn * 1000,
+        'cold_open_ms': open_and_wait(conns, 0, 1, paths[0], container_width, container_height) * 1000,
+        'warm_worker_new_file_ms': open_and_wait(conns, 1, 2, paths[1], container_width, container_height) * 1000,
+        'warm_worker_same_file_ms': open_and_wait(conns, 0, 3, paths[0], container_width, container_height) * 1000,
+    }
+
+    for conn in conns:
+        conn.send({'action': 'END'})
+    for conn in conns:
+        while conn.recv()['action'] != 'ENDED':
+            pass
+    for process in processes:
+        process.join()
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    switch = []
+    with tempfile.TemporaryDirectory() as directory:
+        for resolution in args.resolutions:
+            width, height = RESOLUTIONS[resolution]
+            paths = []
+            for codec in args.codecs:
+                for gop in args.gops:
+                    _, extension = CODECS[codec]
+                    path = os.path.join(directory, f'{resolution}_{codec}_{gop}{extension}')
+                    logger.info(f'Generating {resolution} {codec} (gop {gop}, {args.frames} frames)')
+                    if not generate_video(path, width, height, args.frames, args.fps, codec, gop):
+                        logger.warning(f'Codec {codec} not available, skipping')
+                        continue
+
+                    result = {
+                        'resolution': resolution,
+                        'width': width,
+                        'height': height,
+                        'codec': codec,
+                        'gop': gop,
+                        'frames': args.frames,
+                        'file_bytes': os.path.getsize(path),
+                    }
+                    logger.info(f'Benchmarking {resolution} {codec} (gop {gop})')
+                    result['open'] = bench_open(path, args.repeat)
+                    result['decode'] = bench_decode(path)
+                    result['seek'] = bench_seek(path, args.frames, args.seeks, args.seed)
+                    result['resize'] = bench_resize(width, height, args.container_width, args.container_height,
+                                                    args.repeat)
+                    result['overlay'] = [bench_overlay(path, width, height, args.container_width,
+                                                       args.container_height, shape_count,
+                                                       min(args.frames, args.overlay_frames) - 1, args.seed)
+                                         for shape_count in args.shape_counts]
+                    results.append(result)
+                    paths.append(path)
+            if len(paths) >= 2:
+                logger.info(f'Benchmarking {resolution} video switching')
+                switch.append(dict(resolution=resolution, **bench_switch(paths, args.container_width,
+                                                                         args.container_height)))
+
+    pipe = [dict(resolution=resolution, **bench_pipe(*RESOLUTIONS[resolution], args.pipe_frames))
+            for resolution in args.resolutions]
+
+    tiles = []
+    for resolution in args.tile_resolutions:
+        logger.info(f'Benchmarking {resolution} tiles')
+        for workers in args.tile_workers:
+            tiles.append(dict(resolution=resolution, **bench_tiles(*RESOLUTIONS[resolution], args.container_width,
+                                                                   args.container_height, args.repeat, workers)))
+
+    return {
+        'environment': {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'arguments': vars(args),
+        'videos': results,
+        'switch': switch,
+        'pipe': pipe,
+        'tiles': tiles,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark decode, seek, overlay and IPC on synthetic videos.')
+    parser.add_argument('--resolutions', nargs='+', default=['480p', '1080p'], choices=list(RESOLUTIONS))
+    parser.add_argument('--codecs', nargs='+', default=['mjpg', 'mp4v'], choices=list(CODECS))
+    parser.add_argument('--gops', nargs='+', type=int, default=[1, 30])
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seeks', type=int, default=30)
+    parser.add_argument('--shape-counts', nargs='+', type=int, default=[0, 10, 100])
+    parser.add_argument('--overlay-frames', type=int, default=30)
+    parser.add_argument('--pipe-frames', type=int, default=200)
+    parser.add_argument('--tile-resolutions', nargs='+', default=['4k', '8k'], choices=list(RESOLUTIONS))
+    parser.add_argument('--tile-workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--container-width', type=int, default=1280)
+    parser.add_argument('--container-height', type=int, default=720)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON output file (default: stdout)')
+    args = parser.parse_args()
+
+    report = run(args)
+    j = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(j)
+    else:
+        print(j)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,195 @@
+import glob
+import hashlib
+import logging
+import os
+from queue import Queue, Full
+from threading import Thread, Lock
+
+import numpy as np
+
+logger = logging.getLogger('DiskCache')
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.video-annotation', 'frames')
+
+
+def fingerprint(filename, sample=1024 * 1024):
+    # content based, so the cache survives renames and moves of the video
+    if os.path.isdir(filename):
+        # an image sequence: the names and sizes of its images, and the first one
+        h = hashlib.sha1()
+        names = sorted(os.listdir(filename))
+        for name in names:
+            h.update(f'{name}:{os.path.getsize(os.path.join(filename, name))}'.encode())
+        if len(names) > 0:
+            h.update(fingerprint(os.path.join(filename, names[0]), sample).encode())
+        return h.hexdigest()
+    size = os.path.getsize(filename)
+    h = hashlib.sha1(str(size).encode())
+    with open(filename, 'rb') as f:
+        h.update(f.read(sample))
+        if size > sample:
+            f.seek(max(size - sample, sample))
+            h.update(f.read(sample))
+    return h.hexdigest()
+
+
+class DiskFrameCache:
+    def __init__(self, directory=None, budget_bytes=10 * 1024 * 1024 * 1024):
+        directory = directory or DEFAULT_DIRECTORY
+        self.__directory = directory
+        self.__budget_bytes = budget_bytes
+        self.__lock = Lock()
+        self.__key = None
+        self.__frames = None
+        self.__filled = None
+        self.__frame_bytes = 0
+        self.__filled_count = 0
+        self.__others_bytes = 0
+        self.__hits = 0
+        self.__writes = 0
+        self.__queue = Queue(maxsize=64)
+        self.__writer = Thread(target=self.__write_loop, daemon=True)
+        self.__writer.start()
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, key, extension):
+        return os.path.join(self.__directory, key + extension)
+
+    def __usage(self, key, width, height):
+        # the frames file is sparse, the blocks it has allocated are the frames written to it; the index is only
+        # read where the file system does not report blocks
+        stat = os.stat(self.__path(key, '.frames'))
+        if hasattr(stat, 'st_blocks'):
+            return min(stat.st_blocks * 512, stat.st_size)
+        return int(np.count_nonzero(np.fromfile(self.__path(key, '.index'), dtype=np.uint8))) * width * height * 3
+
+    def __entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.__directory, '*.index')):
+            key = os.path.basename(path)[:-len('.index')]
+            try:
+                _, size, _ = key.split('_')
+                width, height = (int(v) for v in size.split('x'))
+                entries.append((os.path.getmtime(path), key, self.__usage(key, width, height)))
+            except (ValueError, OSError):
+                continue
+        return sorted(entries)
+
+    def __remove(self, key):
+        for extension in ('.index', '.frames'):
+            try:
+                os.remove(self.__path(key, extension))
+            except OSError:
+                pass
+
+    def open(self, video_fingerprint, total_frames, width, height):
+        self.close()
+        key = f'{video_fingerprint}_{width}x{height}_{total_frames}'
+        frames_path = self.__path(key, '.frames')
+        index_path = self.__path(key, '.index')
+        frame_bytes = width * height * 3
+        if total_frames * frame_bytes > self.__budget_bytes:
+            # the frames file has the size of the whole video, and is not sparse on every file system
+            logger.info(f'Disk cache skipped, {total_frames} frames of {width}x{height} exceed its budget')
+            return
+
+        entries = []
+        for entry in self.__entries():
+            if entry[1] == key:
+                continue
+            if entry[2] == 0:
+                # left behind by a size that was only shown briefly (e.g. while resizing the window)
+                self.__remove(entry[1])
+            else:
+                entries.append(entry)
+
+        # least recently used videos go first when the budget is exceeded
+        others_bytes = sum(entry[2] for entry in entries)
+        while len(entries) > 0 and others_bytes + frame_bytes * total_frames > self.__budget_bytes:
+            _, evicted, evicted_bytes = entries.pop(0)
+            logger.info(f'Evicting {evicted} ({evicted_bytes / 1024 / 1024:.0f}MB)')
+            self.__remove(evicted)
+            others_bytes -= evicted_bytes
+
+        try:
+            if not os.path.exists(frames_path) or not os.path.exists(index_path):
+                # sparse files: disk space is only used by the frames actually written
+                with open(frames_path, 'wb') as f:
+                    f.truncate(total_frames * frame_bytes)
+                with open(index_path, 'wb') as f:
+                    f.truncate(total_frames)
+            os.utime(index_path)
+            frames = np.memmap(frames_path, dtype=np.uint8, mode='r+', shape=(total_frames, height, width, 3))
+            filled = np.memmap(index_path, dtype=np.uint8, mode='r+', shape=(total_frames,))
+        except (OSError, ValueError) as e:
+            logger.warning(f'Disk cache unavailable: {e}')
+            self.__remove(key)
+            return
+
+        with self.__lock:
+            self.__key = key
+            self.__frames = frames
+            self.__filled = filled
+            self.__frame_bytes = frame_bytes
+            self.__filled_count = int(np.count_nonzero(filled))
+            self.__others_bytes = others_bytes
+            self.__hits = 0
+            self.__writes = 0
+
+    def close(self):
+        with self.__lock:
+            if self.__frames is not None:
+                self.__frames.flush()
+                self.__filled.flush()
+            self.__key = None
+            self.__frames = None
+            self.__filled = None
+
+    def shutdown(self):
+        self.close()
+        self.__queue.put(None)
+
+    def get(self, index):
+        # a read-only view into the mapped file, nothing is decoded or copied
+        with self.__lock:
+            if self.__filled is None or not 0 <= index < len(self.__filled) or not self.__filled[index]:
+                return None
+            self.__hits += 1
+            return np.asarray(self.__frames[index])
+
+    def put(self, index, frame: np.ndarray):
+        with self.__lock:
+            if self.__filled is None or not 0 <= index < len(self.__filled) or self.__filled[index]:
+                return
+            if self.__others_bytes + (self.__filled_count + 1) * self.__frame_bytes > self.__budget_bytes:
+                return
+            key = self.__key
+        try:
+            self.__queue.put_nowait((key, index, frame))
+        except Full:
+            pass
+
+    def __write_loop(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            key, index, frame = item
+            with self.__lock:
+                if key != self.__key or self.__filled[index] or frame.shape != self.__frames.shape[1:]:
+                    continue
+                self.__frames[index] = frame
+                self.__filled[index] = 1
+                self.__filled_count += 1
+                self.__writes += 1
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'key': self.__key,
+                'frames': self.__filled_count,
+                'bytes': self.__filled_count * self.__frame_bytes,
+                'budget_bytes': self.__budget_bytes,
+                'hits': self.__hits,
+                'writes': self.__writes,
+            }
@@ -0,0 +1,251 @@
+import heapq
+import json
+import math
+import tempfile
+from itertools import islice
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from classes.JsonStream import JsonStream
+from classes.Shape import ShapeType
+from classes.Track import dense_annotations
+
+BATCH_SIZE = 4096
+# annotations held in memory at once while sorting them by frame, the rest is spilled to temporary files
+SORT_BATCH_SIZE = 50000
+ELLIPSE_SEGMENTS = 32
+
+
+def iter_annotations(filename, chunk_size=1 << 16):
+    # the project file is a single JSON list, its entries are decoded one by one without loading it whole
+    with open(filename) as f:
+        yield from JsonStream(f, chunk_size).iter_array()
+
+
+def timeline_annotations(timeline):
+    for (frame, shape) in timeline:
+        yield shape.to_save_format(frame)
+
+
+def batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def sorted_by_frame(annotations, batch_size=None):
+    batch_size = batch_size or SORT_BATCH_SIZE
+    files = []
+    batch = []
+    for entry in annotations:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            batch.sort(key=lambda e: e['frame'])
+            spill = tempfile.TemporaryFile('w+')
+            for e in batch:
+                spill.write(json.dumps(e) + '\n')
+            spill.seek(0)
+            files.append(spill)
+            batch = []
+    batch.sort(key=lambda e: e['frame'])
+    if len(files) == 0:
+        yield from batch
+        return
+    try:
+        runs = [(json.loads(line) for line in spill) for spill in files] + [iter(batch)]
+        yield from heapq.merge(*runs, key=lambda e: e['frame'])
+    finally:
+        for spill in files:
+            spill.close()
+
+
+def geometry(batch):
+    # points of every shape in the batch padded to the same length by repeating the first one,
+    # which changes neither the bounding box nor the shoelace sum
+    counts = np.array([len(e.get('points', ())) for e in batch])
+    points = np.zeros((len(batch), max(int(counts.max()), 1), 2), np.float64)
+    for i, e in enumerate(batch):
+        if counts[i] > 0:
+            points[i, :counts[i]] = e['points']
+            points[i, counts[i]:] = e['points'][0]
+    types = np.array([e['shape'] for e in batch])
+
+    mins = points.min(axis=1)
+    maxs = points.max(axis=1)
+    bbox = np.concatenate([mins, maxs - mins], axis=1)
+
+    x = points[:, :, 0]
+    y = points[:, :, 1]
+    shoelace = 0.5 * np.abs((x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1))
+    area = np.select([types == ShapeType.rectangle, types == ShapeType.ellipse, types == ShapeType.polygon],
+                     [bbox[:, 2] * bbox[:, 3], math.pi * bbox[:, 2] * bbox[:, 3] / 4, shoelace], 0)
+    return types, counts, points, bbox, area
+
+
+def ellipse_polygons(bbox):
+    angles = np.linspace(0, 2 * math.pi, ELLIPSE_SEGMENTS, endpoint=False)
+    cx = bbox[:, 0:1] + bbox[:, 2:3] / 2
+    cy = bbox[:, 1:2] + bbox[:, 3:4] / 2
+    xs = cx + bbox[:, 2:3] / 2 * np.cos(angles)
+    ys = cy + bbox[:, 3:4] / 2 * np.sin(angles)
+    return np.stack([xs, ys], axis=2).reshape(len(bbox), -1)
+
+
+def rectangle_polygons(bbox):
+    x1, y1 = bbox[:, 0], bbox[:, 1]
+    x2, y2 = x1 + bbox[:, 2], y1 + bbox[:, 3]
+    return np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1)
+
+
+def export_coco(annotations, f, width=0, height=0, name='frame', total_frames=None):
+    categories = dict()
+    images = set()
+    exported = 0
+    skipped = 0
+
+    f.write('{"annotations": [')
+    for batch in batches(annotations):
+        types, counts, points, bbox, area = geometry(batch)
+        ellipses = types == ShapeType.ellipse
+        rectangles = types == ShapeType.rectangle
+        # rounding and conversion to python numbers are done once per batch
+        ellipse_segmentations = np.round(ellipse_polygons(bbox[ellipses]), 2).tolist()
+        rectangle_segmentations = np.round(rectangle_polygons(bbox[rectangles]), 2).tolist()
+        ellipse_rows = (np.cumsum(ellipses) - 1).tolist()
+        rectangle_rows = (np.cumsum(rectangles) - 1).tolist()
+        bboxes = np.round(bbox, 2).tolist()
+        areas = np.round(area, 2).tolist()
+
+        for i, e in enumerate(batch):
+            if types[i] == ShapeType.polygon:
+                segmentation = points[i, :counts[i]].ravel().tolist()
+            elif ellipses[i]:
+                segmentation = ellipse_segmentations[ellipse_rows[i]]
+            elif rectangles[i]:
+                segmentation = rectangle_segmentations[rectangle_rows[i]]
+            else:
+                # lines and global events have no area
+                skipped += 1
+                continue
+            category = categories.setdefault(e.get('message', ''), len(categories) + 1)
+            images.add(e['frame'])
+            f.write(',' if exported > 0 else '')
+            exported += 1
+            f.write(json.dumps({
+                'id': exported,
+                'image_id': e['frame'] + 1,
+                'category_id': category,
+                'bbox': bboxes[i],
+                'area': areas[i],
+                'segmentation': [segmentation],
+                'iscrowd': 0,
+            }))
+
+    f.write('], "images": ')
+    f.write(json.dumps([{'id': frame + 1, 'frame': frame, 'file_name': f'{name}_{frame:06d}.jpg',
+                         'width': width, 'height': height} for frame in sorted(images)]))
+    f.write(', "categories": ')
+    f.write(json.dumps([{'id': i, 'name': message, 'supercategory': ''} for (message, i) in categories.items()]))
+    f.write('}\n')
+    return {'exported': exported, 'skipped': skipped}
+
+
+def export_mot(annotations, f, width=0, height=0, name='frame', total_frames=None):
+    # MOT has no labels, shapes with the same message form one track
+    tracks = dict()
+    exported = 0
+    skipped = 0
+    for batch in batches(sorted_by_frame(annotations)):
+        types, counts, points, bbox, area = geometry(batch)
+        boxed = np.isin(types, (ShapeType.rectangle, ShapeType.ellipse, ShapeType.polygon)).tolist()
+        bboxes = bbox.tolist()
+        rows = []
+        for i, e in enumerate(batch):
+            if not boxed[i]:
+                skipped += 1
+                continue
+            track = tracks.setdefault(e.get('message', ''), len(tracks) + 1)
+            x, y, w, h = bboxes[i]
+            rows.append(f'{e["frame"] + 1},{track},{x:.2f},{y:.2f},{w:.2f},{h:.2f},1,-1,-1,-1\n')
+        f.write(''.join(rows))
+        exported += len(rows)
+    return {'exported': exported, 'skipped': skipped, 'tracks': {i: message for (message, i) in tracks.items()}}
+
+
+def export_cvat(annotations, f, width=0, height=0, name='frame', total_frames=None):
+    # labels go in the header, they are collected while the annotations are sorted by frame
+    labels = dict()
+
+    def collect():
+        for e in annotations:
+            labels.setdefault(e.get('message', ''), None)
+            yield e
+
+    ordered = sorted_by_frame(collect())
+    first = next(ordered, None)
+
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n<annotations>\n  <version>1.1</version>\n  <meta>\n    <task>\n')
+    f.write(f'      <name>{escape(name)}</name>\n')
+    if total_frames is not None:
+        f.write(f'      <size>{total_frames}</size>\n')
+    f.write('      <mode>annotation</mode>\n      <labels>\n')
+    for label in labels:
+        f.write(f'        <label>\n          <name>{escape(label)}</name>\n        </label>\n')
+    f.write('      </labels>\n    </task>\n  </meta>\n')
+
+    def restored():
+        if first is not None:
+            yield first
+            yield from ordered
+
+    current = None
+    exported = 0
+    for batch in batches(restored()):
+        types, counts, points, bbox, area = geometry(batch)
+        types = types.tolist()
+        bboxes = bbox.tolist()
+        for i, e in enumerate(batch):
+            if e['frame'] != current:
+                if current is not None:
+                    f.write('  </image>\n')
+                current = e['frame']
+                f.write(f'  <image id="{current}" name={quoteattr(f"{name}_{current:06d}")} width="{width}" '
+                        f'height="{height}">\n')
+            label = quoteattr(e.get('message', ''))
+            coords = ';'.join(f'{x:.2f},{y:.2f}' for (x, y) in points[i, :counts[i]].tolist())
+            if types[i] == ShapeType.rectangle:
+                x, y, w, h = bboxes[i]
+                f.write(f'    <box label={label} occluded="0" source="manual" xtl="{x:.2f}" ytl="{y:.2f}" '
+                        f'xbr="{x + w:.2f}" ybr="{y + h:.2f}" z_order="0"/>\n')
+            elif types[i] == ShapeType.ellipse:
+                x, y, w, h = bboxes[i]
+                f.write(f'    <ellipse label={label} occluded="0" source="manual" cx="{x + w / 2:.2f}" '
+                        f'cy="{y + h / 2:.2f}" rx="{w / 2:.2f}" ry="{h / 2:.2f}" z_order="0"/>\n')
+            elif types[i] == ShapeType.polygon:
+                f.write(f'    <polygon label={label} occluded="0" source="manual" points="{coords}" z_order="0"/>\n')
+            elif types[i] == ShapeType.line:
+                f.write(f'    <polyline label={label} occluded="0" source="manual" points="{coords}" z_order="0"/>\n')
+            else:
+                f.write(f'    <tag label={label} source="manual"/>\n')
+            exported += 1
+    if current is not None:
+        f.write('  </image>\n')
+    f.write('</annotations>\n')
+    return {'exported': exported, 'skipped': 0}
+
+
+FORMATS = {
+    'coco': export_coco,
+    'mot': export_mot,
+    'cvat': export_cvat,
+}
+
+
+def export(annotations, filename, format, **kwargs):
+    # the formats hold one annotation per frame, tracks are interpolated on their whole range
+    with open(filename, 'w', newline='') as f:
+        return FORMATS[format](dense_annotations(annotations), f, **kwargs)
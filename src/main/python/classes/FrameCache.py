@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import cv2
+import numpy as np
+
+CODECS = {
+    'jpeg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 95]),
+    'png': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+}
+
+
+class CompressedFrameCache:
+    def __init__(self, codec='jpeg', budget_bytes=256 * 1024 * 1024, workers=2):
+        self.__extension, self.__params = CODECS[codec]
+        self.__codec = codec
+        self.__budget_bytes = budget_bytes
+        self.__workers = workers
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__lock = Lock()
+        self.__frames = OrderedDict()
+        self.__pending = set()
+        self.__bytes = 0
+        self.__generation = 0
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__skipped = 0
+        self.__encode_times = deque(maxlen=100)
+        self.__decode_times = deque(maxlen=100)
+        self.__raw_bytes = 0
+        self.__encoded_bytes = 0
+
+    def __contains__(self, index):
+        with self.__lock:
+            return index in self.__frames
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__frames)
+
+    def __encode(self, generation, index, frame):
+        start = time.time()
+        check, encoded = cv2.imencode(self.__extension, frame, self.__params)
+        elapsed = time.time() - start
+        with self.__lock:
+            self.__pending.discard(index)
+            # frames of a cleared source are thrown away
+            if not check or generation != self.__generation:
+                return
+            self.__encode_times.append(elapsed)
+            self.__raw_bytes += frame.nbytes
+            self.__encoded_bytes += encoded.nbytes
+            if index in self.__frames:
+                self.__bytes -= self.__frames.pop(index).nbytes
+            self.__frames[index] = encoded
+            self.__bytes += encoded.nbytes
+            self.__evict()
+
+    def __evict(self):
+        while self.__bytes > self.__budget_bytes and len(self.__frames) > 0:
+            _, encoded = self.__frames.popitem(last=False)
+            self.__bytes -= encoded.nbytes
+
+    def put(self, index, frame: np.ndarray):
+        # the frame must not be modified afterwards, it is encoded in the background
+        with self.__lock:
+            if index in self.__frames or index in self.__pending:
+                return
+            if len(self.__pending) >= self.__workers * 2:
+                # encoders are behind the decoder, do not let the queue grow
+                self.__skipped += 1
+                return
+            self.__pending.add(index)
+            generation = self.__generation
+        self.__executor.submit(self.__encode, generation, index, frame)
+
+    def get(self, index):
+        with self.__lock:
+            encoded = self.__frames.get(index)
+            if encoded is None:
+                self.__misses += 1
+                return None
+            self.__frames.move_to_end(index)
+            self.__hits += 1
+        start = time.time()
+        frame = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        elapsed = time.time() - start
+        with self.__lock:
+            self.__decode_times.append(elapsed)
+        return frame
+
+    def set_budget(self, budget_bytes):
+        with self.__lock:
+            self.__budget_bytes = budget_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__frames.clear()
+            self.__bytes = 0
+            self.__hits = 0
+            self.__misses = 0
+            self.__skipped = 0
+            self.__encode_times.clear()
+            self.__decode_times.clear()
+            self.__raw_bytes = 0
+            self.__encoded_bytes = 0
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False)
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'codec': self.__codec,
+                'frames': len(self.__frames),
+                'bytes': self.__bytes,
+                'budget_bytes': self.__budget_bytes,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / lookups if lookups > 0 else 0,
+                'skipped': self.__skipped,
+                'ratio': self.__raw_bytes / self.__encoded_bytes if self.__encoded_bytes > 0 else 0,
+                'encode_ms': sum(self.__encode_times) * 1000 / len(self.__encode_times)
+                if len(self.__encode_times) > 0 else 0,
+                'decode_ms': sum(self.__decode_times) * 1000 / len(self.__decode_times)
+                if len(self.__decode_times) > 0 else 0,
+            }
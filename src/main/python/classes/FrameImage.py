@@ -0,0 +1,26 @@
+import numpy as np
+from PySide2.QtGui import QImage
+
+
+class FrameImage:
+    def __init__(self, frame: np.ndarray):
+        # the QImage only wraps the buffer, so the array has to live as long as the image does
+        self.__frame = np.ascontiguousarray(frame)
+        height, width = self.__frame.shape[:2]
+        self.__image = QImage(self.__frame.data, width, height, self.__frame.strides[0], QImage.Format_BGR888)
+
+    @property
+    def frame(self):
+        return self.__frame
+
+    @property
+    def image(self):
+        return self.__image
+
+    @property
+    def width(self):
+        return self.__image.width()
+
+    @property
+    def height(self):
+        return self.__image.height()
@@ -0,0 +1,686 @@
+import http.client
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Full, Queue
+from socketserver import ThreadingMixIn
+from threading import Condition, Lock, RLock, Thread
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from classes import WebSocket
+from classes.Exporters import iter_annotations
+from classes.FrameCache import CompressedFrameCache
+from classes.Rendering import draw_shapes, fit_size, open_video
+from classes.Shape import Shape, ShapeType
+from classes.Tiles import get_executor
+from classes.Track import TRACKABLE, Track, from_save_format
+
+logger = logging.getLogger('FrameServer')
+
+JPEG_QUALITY = 90
+# frames rendered at a given size and annotation version, shared by every client
+RENDERED_BUDGET_BYTES = 256 * 1024 * 1024
+MAX_BATCH = 256
+# events a client has not received yet, a client that falls this far behind is disconnected
+EVENT_QUEUE_SIZE = 1024
+SHAPE_TYPES = (ShapeType.globals, ShapeType.rectangle, ShapeType.ellipse, ShapeType.polygon, ShapeType.line,
+               ShapeType.pointer)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RenderedFrameCache:
+    def __init__(self, budget_bytes=RENDERED_BUDGET_BYTES):
+        self.__budget_bytes = budget_bytes
+        self.__lock = Lock()
+        self.__frames = OrderedDict()
+        self.__bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key):
+        with self.__lock:
+            encoded = self.__frames.get(key)
+            if encoded is None:
+                self.__misses += 1
+                return None
+            self.__frames.move_to_end(key)
+            self.__hits += 1
+            return encoded
+
+    def put(self, key, encoded: bytes):
+        with self.__lock:
+            if key in self.__frames:
+                return
+            self.__frames[key] = encoded
+            self.__bytes += len(encoded)
+            while self.__bytes > self.__budget_bytes and len(self.__frames) > 0:
+                _, evicted = self.__frames.popitem(last=False)
+                self.__bytes -= len(evicted)
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'frames': len(self.__frames),
+                'bytes': self.__bytes,
+                'budget_bytes': self.__budget_bytes,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / lookups if lookups > 0 else 0,
+            }
+
+
+class DecoderPool:
+    # a few captures of the same video, a request goes to the one already positioned on the frame when possible
+    def __init__(self, filename, size):
+        self.__condition = Condition()
+        self.__free = []
+        for _ in range(size):
+            video, self.fps, self.width, self.height, self.total_frames = open_video(filename)
+            self.capabilities = video.capabilities
+            self.__free.append([video, 0])
+        self.__decoders = list(self.__free)
+        self.__seeks = 0
+        self.__decoded = 0
+
+    def __acquire(self, index):
+        with self.__condition:
+            while len(self.__free) == 0:
+                self.__condition.wait()
+            decoder = min(self.__free, key=lambda d: 0 if d[1] == index else 1)
+            self.__free.remove(decoder)
+            return decoder
+
+    def __release(self, decoder):
+        with self.__condition:
+            self.__free.append(decoder)
+            self.__condition.notify()
+
+    def read(self, indexes):
+        # consecutive indexes are read without seeking
+        decoder = self.__acquire(indexes[0])
+        frames = []
+        try:
+            video = decoder[0]
+            for index in indexes:
+                if decoder[1] != index:
+                    video.seek(index)
+                    self.__seeks += 1
+                check, frame = video.read()
+                decoder[1] = index + 1 if check else -1
+                self.__decoded += 1
+                frames.append(frame if check else None)
+        finally:
+            self.__release(decoder)
+        return frames
+
+    def stats(self):
+        return {'decoders': len(self.__decoders), 'decoded': self.__decoded, 'seeks': self.__seeks}
+
+    def release(self):
+        for video, _ in self.__decoders:
+            video.release()
+
+
+class AnnotationStore:
+    def __init__(self, filename=None):
+        self.__filename = filename
+        self.__lock = RLock()
+        # id -> (frame, shape or track), a track is on the frame of its first keyframe
+        self.__shapes = dict()
+        self.__frames = dict()
+        # tracks are kept as keyframes, their shapes are interpolated when a frame is rendered
+        self.__tracks = dict()
+        # bumped on every change of a frame, part of the rendered frame cache key
+        self.__versions = dict()
+        self.__dirty = False
+        self.__listeners = []
+        if filename is not None and os.path.exists(filename):
+            for entry in iter_annotations(filename):
+                self.__put(entry['frame'], from_save_format(entry))
+            logger.info(f'Loaded {len(self.__shapes)} annotations from {filename}')
+
+    @staticmethod
+    def to_entry(frame, shape):
+        return dict(shape.to_save_format(frame), id=shape.id)
+
+    @staticmethod
+    def from_entry(entry, id=None):
+        if isinstance(entry, dict) and 'keyframes' in entry:
+            if entry.get('shape') not in TRACKABLE or not isinstance(entry['keyframes'], list) or \
+                    len(entry['keyframes']) == 0 or \
+                    not all(isinstance(k, dict) and isinstance(k.get('frame'), int) for k in entry['keyframes']):
+                raise ValueError('A track needs a trackable shape and keyframes with an integer frame')
+            track = Track.from_save_format(entry, id or entry.get('id') or uuid.uuid4().hex)
+            track.message = str(track.message)
+            return track.first, track
+        if not isinstance(entry, dict) or entry.get('shape') not in SHAPE_TYPES or \
+                not isinstance(entry.get('frame'), int):
+            raise ValueError('An annotation needs a known shape and an integer frame')
+        shape = Shape(id or entry.get('id') or uuid.uuid4().hex, entry['shape'])
+        shape.set_points(entry.get('points', []))
+        shape.message = str(entry.get('message', ''))
+        return entry['frame'], shape
+
+    def __bump(self, first, last):
+        for frame in range(first, last + 1):
+            self.__versions[frame] = self.__versions.get(frame, 0) + 1
+
+    def __put(self, frame, shape):
+        self.__remove(shape.id)
+        self.__shapes[shape.id] = (frame, shape)
+        if isinstance(shape, Track):
+            self.__tracks[shape.id] = shape
+            self.__bump(shape.first, shape.last)
+        else:
+            self.__frames.setdefault(frame, dict())[shape.id] = shape
+            self.__bump(frame, frame)
+
+    def __remove(self, id):
+        if id not in self.__shapes:
+            return None
+        frame, shape = self.__shapes.pop(id)
+        if isinstance(shape, Track):
+            del self.__tracks[id]
+            self.__bump(shape.first, shape.last)
+        else:
+            del self.__frames[frame][id]
+            if len(self.__frames[frame]) == 0:
+                del self.__frames[frame]
+            self.__bump(frame, frame)
+        return frame, shape
+
+    def __notify(self, event):
+        # called once the lock is released, listeners may be slow
+        with self.__lock:
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            listener(event)
+
+    def listen(self, listener):
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def unlisten(self, listener):
+        with self.__lock:
+            if listener in self.__listeners:
+                self.__listeners.remove(listener)
+
+    def frame_shapes(self, frame):
+        # a copy of the shapes of a frame with its version, safe to draw outside of the lock
+        with self.__lock:
+            shapes = [shape.copy() for shape in self.__frames.get(frame, dict()).values()]
+            shapes.extend(track.shape_at(frame) for track in self.__tracks.values() if track.covers(frame))
+            return self.__versions.get(frame, 0), shapes
+
+    def version(self, frame):
+        with self.__lock:
+            return self.__versions.get(frame, 0)
+
+    def list(self, start=None, end=None):
+        with self.__lock:
+            # a track is listed when any of its frames is in the range
+            return [self.to_entry(frame, shape) for (frame, shape) in self.__shapes.values()
+                    if (start is None or (shape.last if isinstance(shape, Track) else frame) >= start) and
+                    (end is None or frame < end)]
+
+    def get(self, id):
+        with self.__lock:
+            if id not in self.__shapes:
+                return None
+            return self.to_entry(*self.__shapes[id])
+
+    def create(self, entry):
+        frame, shape = self.from_entry(entry, id=uuid.uuid4().hex)
+        with self.__lock:
+            self.__put(frame, shape)
+            self.__dirty = True
+            created = self.to_entry(frame, shape)
+        self.__notify({'op': 'created', 'annotation': created})
+        return created
+
+    def update(self, id, entry):
+        with self.__lock:
+            if id not in self.__shapes:
+                return None
+            frame, shape = self.from_entry(entry, id=id)
+            self.__put(frame, shape)
+            self.__dirty = True
+            updated = self.to_entry(frame, shape)
+        self.__notify({'op': 'updated', 'annotation': updated})
+        return updated
+
+    def delete(self, id):
+        with self.__lock:
+            removed = self.__remove(id)
+            if removed is None:
+                return False
+            self.__dirty = True
+        self.__notify({'op': 'deleted', 'id': id, 'frame': removed[0]})
+        return True
+
+    def save(self):
+        with self.__lock:
+            if self.__filename is None or not self.__dirty:
+                return
+            entries = [shape.to_save_format(frame) for (frame, shape) in self.__shapes.values()]
+            self.__dirty = False
+        temp = self.__filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp, self.__filename)
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__shapes)
+
+
+class EventClient:
+    # events are queued and written by the thread of the client connection, a slow client does not hold up the
+    # changes of the others
+    def __init__(self, ws):
+        self.__ws = ws
+        self.__queue = Queue(EVENT_QUEUE_SIZE)
+        self.__dropped = False
+
+    def push(self, event):
+        # False once the client is too far behind, it is then disconnected
+        try:
+            self.__queue.put_nowait(event)
+            return True
+        except Full:
+            self.__dropped = True
+            return False
+
+    def stop(self):
+        self.push(None)
+
+    def __receive(self):
+        # nothing is expected from clients, reading handles ping and close
+        while self.__ws.receive() is not None:
+            pass
+        self.stop()
+
+    def serve(self):
+        Thread(target=self.__receive, daemon=True).start()
+        while True:
+            event = self.__queue.get()
+            if event is None or self.__dropped:
+                break
+            try:
+                self.__ws.send(event)
+            except (ConnectionError, OSError):
+                break
+        if self.__dropped:
+            logger.warning('Disconnected an events client that fell behind')
+        self.__ws.close()
+
+
+class FrameServer:
+    def __init__(self, filename, annotations=None, host='127.0.0.1', port=8765, decoders=2,
+                 rendered_budget_bytes=RENDERED_BUDGET_BYTES, save_interval=2):
+        self.__filename = filename
+        self.__decoders = DecoderPool(filename, decoders)
+        self.__executor = ThreadPoolExecutor(max_workers=decoders)
+        # decoded source frames, so a changed annotation re-renders without decoding again
+        self.__source_cache = CompressedFrameCache('jpeg')
+        self.__rendered = RenderedFrameCache(rendered_budget_bytes)
+        self.__inflight = dict()
+        self.__inflight_lock = Lock()
+        self.__coalesced = 0
+        self.__clients = []
+        self.__clients_lock = Lock()
+        self.__save_interval = save_interval
+        self.__running = False
+
+        self.store = AnnotationStore(annotations)
+        self.store.listen(self.__broadcast)
+        self.__http = ThreadingHTTPServer((host, port), self.__handler())
+
+    @property
+    def address(self):
+        return self.__http.server_address
+
+    @property
+    def info(self):
+        return {
+            'filename': os.path.basename(self.__filename),
+            'fps': self.__decoders.fps,
+            'width': self.__decoders.width,
+            'height': self.__decoders.height,
+            'total_frames': self.__decoders.total_frames,
+            'capabilities': self.__decoders.capabilities,
+        }
+
+    def stats(self):
+        with self.__clients_lock:
+            clients = len(self.__clients)
+        return {
+            'rendered': self.__rendered.stats(),
+            'source': self.__source_cache.stats(),
+            'decoder': self.__decoders.stats(),
+            'coalesced': self.__coalesced,
+            'event_clients': clients,
+            'annotations': len(self.store),
+        }
+
+    def __render(self, index, size, frame):
+        version, shapes = self.store.frame_shapes(index)
+        frame = draw_shapes(frame.copy(), shapes, self.__decoders.width, self.__decoders.height)
+        if size != (self.__decoders.width, self.__decoders.height):
+            frame = get_executor().resize(frame, size, interpolation=cv2.INTER_AREA)
+        check, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return version, encoded.tobytes() if check else None
+
+    def __decode_run(self, run, size, futures):
+        try:
+            sources = {index: self.__source_cache.get(index) for index in run}
+            missing = [index for index in run if sources[index] is None]
+            if len(missing) > 0:
+                for index, frame in zip(missing, self.__decoders.read(missing)):
+                    sources[index] = frame
+                    if frame is not None:
+                        self.__source_cache.put(index, frame)
+            for index in run:
+                version, encoded = self.__render(index, size, sources[index]) if sources[index] is not None \
+                    else (None, None)
+                if encoded is not None:
+                    self.__rendered.put((index, size, version), encoded)
+                futures[index][1].set_result(encoded)
+        except Exception as e:
+            for index in run:
+                if not futures[index][1].done():
+                    futures[index][1].set_exception(e)
+        finally:
+            with self.__inflight_lock:
+                for index in run:
+                    key, future = futures[index]
+                    if self.__inflight.get(key) is future:
+                        del self.__inflight[key]
+
+    def frames(self, indexes, width=None, height=None):
+        # a batch of frames as jpeg bytes: cached ones are returned as they are, frames already being rendered
+        # for another client are waited on, the rest is decoded in runs of consecutive indexes
+        size = fit_size(self.__decoders.width, self.__decoders.height, width, height)
+        results = dict()
+        futures = dict()
+        todo = []
+        # read before taking the lock, the store has a lock of its own
+        versions = {index: self.store.version(index) for index in indexes
+                    if 0 <= index < self.__decoders.total_frames}
+        with self.__inflight_lock:
+            for index in indexes:
+                if index not in versions or index in results or index in futures:
+                    continue
+                key = (index, size, versions[index])
+                encoded = self.__rendered.get(key)
+                if encoded is not None:
+                    results[index] = encoded
+                elif key in self.__inflight:
+                    futures[index] = (key, self.__inflight[key])
+                    self.__coalesced += 1
+                else:
+                    self.__inflight[key] = Future()
+                    futures[index] = (key, self.__inflight[key])
+                    todo.append(index)
+
+        runs = []
+        for index in sorted(todo):
+            if len(runs) > 0 and runs[-1][-1] == index - 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        for run in runs:
+            self.__executor.submit(self.__decode_run, run, size, futures)
+
+        for index, (_, future) in futures.items():
+            results[index] = future.result()
+        return [(index, results.get(index)) for index in indexes if results.get(index) is not None]
+
+    def __remove_client(self, client):
+        with self.__clients_lock:
+            if client in self.__clients:
+                self.__clients.remove(client)
+
+    def __broadcast(self, event):
+        # only queues the event, each client connection writes its own
+        with self.__clients_lock:
+            clients = list(self.__clients)
+        for client in clients:
+            if not client.push(event):
+                self.__remove_client(client)
+
+    def serve_events(self, ws):
+        client = EventClient(ws)
+        with self.__clients_lock:
+            self.__clients.append(client)
+        client.serve()
+        self.__remove_client(client)
+
+    def __saver(self):
+        while self.__running:
+            time.sleep(self.__save_interval)
+            try:
+                self.store.save()
+            except OSError as e:
+                logger.error(f'Can not save annotations: {e}')
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def send_body(self, status, body: bytes, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or dict()).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, status, value):
+                self.send_body(status, json.dumps(value).encode())
+
+            def read_json(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length).decode()) if length > 0 else None
+
+            def route(self):
+                url = urlparse(self.path)
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                return [part for part in url.path.split('/') if part], query
+
+            def do_GET(self):
+                parts, query = self.route()
+                try:
+                    width = int(query['width']) if 'width' in query else None
+                    height = int(query['height']) if 'height' in query else None
+                    if parts == ['info']:
+                        self.send_json(200, server.info)
+                    elif parts == ['stats']:
+                        self.send_json(200, server.stats())
+                    elif parts == ['events']:
+                        self.upgrade()
+                    elif len(parts) == 2 and parts[0] == 'frames':
+                        frames = server.frames([int(parts[1])], width, height)
+                        if len(frames) == 0:
+                            self.send_json(404, {'error': 'No such frame'})
+                        else:
+                            self.send_body(200, frames[0][1], 'image/jpeg')
+                    elif parts == ['frames']:
+                        if 'indexes' in query:
+                            indexes = [int(i) for i in query['indexes'].split(',') if i]
+                        else:
+                            indexes = list(range(int(query['start']), int(query['start']) + int(query.get('count', 1))))
+                        frames = server.frames(indexes[:MAX_BATCH], width, height)
+                        # the frames one after another, the headers tell where each one ends
+                        self.send_body(200, b''.join(encoded for (_, encoded) in frames), 'application/octet-stream', {
+                            'X-Frame-Indexes': ','.join(str(index) for (index, _) in frames),
+                            'X-Frame-Lengths': ','.join(str(len(encoded)) for (_, encoded) in frames),
+                        })
+                    elif parts == ['annotations']:
+                        start = int(query['frame']) if 'frame' in query else query.get('start')
+                        end = start + 1 if 'frame' in query else query.get('end')
+                        self.send_json(200, server.store.list(None if start is None else int(start),
+                                                              None if end is None else int(end)))
+                    elif len(parts) == 2 and parts[0] == 'annotations':
+                        annotation = server.store.get(parts[1])
+                        if annotation is None:
+                            self.send_json(404, {'error': 'No such annotation'})
+                        else:
+                            self.send_json(200, annotation)
+                    else:
+                        self.send_json(404, {'error': 'Not found'})
+                except (KeyError, ValueError) as e:
+                    self.send_json(400, {'error': str(e)})
+
+            def do_POST(self):
+                parts, _ = self.route()
+                try:
+                    if parts != ['annotations']:
+                        self.send_json(404, {'error': 'Not found'})
+                        return
+                    entry = self.read_json()
+                    if isinstance(entry, list):
+                        self.send_json(201, [server.store.create(e) for e in entry])
+                    else:
+                        self.send_json(201, server.store.create(entry))
+                except ValueError as e:
+                    self.send_json(400, {'error': str(e)})
+
+            def do_PUT(self):
+                parts, _ = self.route()
+                try:
+                    if len(parts) != 2 or parts[0] != 'annotations':
+                        self.send_json(404, {'error': 'Not found'})
+                        return
+                    updated = server.store.update(parts[1], self.read_json())
+                    if updated is None:
+                        self.send_json(404, {'error': 'No such annotation'})
+                    else:
+                        self.send_json(200, updated)
+                except ValueError as e:
+                    self.send_json(400, {'error': str(e)})
+
+            def do_DELETE(self):
+                parts, _ = self.route()
+                if len(parts) == 2 and parts[0] == 'annotations' and server.store.delete(parts[1]):
+                    self.send_json(200, {'deleted': parts[1]})
+                else:
+                    self.send_json(404, {'error': 'No such annotation'})
+
+            def upgrade(self):
+                key = self.headers.get('Sec-WebSocket-Key')
+                if key is None or self.headers.get('Upgrade', '').lower() != 'websocket':
+                    self.send_json(400, {'error': 'Expected a WebSocket upgrade'})
+                    return
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', WebSocket.accept_key(key))
+                self.end_headers()
+                self.wfile.flush()
+                server.serve_events(WebSocket.WebSocket(self.rfile, self.wfile, masked=False))
+                self.close_connection = True
+
+        return Handler
+
+    def serve_forever(self):
+        self.__running = True
+        Thread(target=self.__saver, daemon=True).start()
+        logger.info(f'Serving {self.__filename} on http://{self.address[0]}:{self.address[1]}')
+        self.__http.serve_forever()
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.__running = False
+        self.__http.shutdown()
+        self.__http.server_close()
+        with self.__clients_lock:
+            for client in self.__clients:
+                client.stop()
+        self.__executor.shutdown(wait=True)
+        self.__source_cache.shutdown()
+        self.__decoders.release()
+        self.store.save()
+
+
+class FrameClient:
+    # a thin client over one keep-alive connection, not thread safe: one per thread
+    def __init__(self, host, port):
+        self.__host = host
+        self.__port = port
+        self.__connection = http.client.HTTPConnection(host, port)
+
+    def __request(self, method, path, body=None):
+        self.__connection.request(method, path, body=None if body is None else json.dumps(body),
+                                  headers={'Content-Type': 'application/json'})
+        response = self.__connection.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            raise ValueError(f'{method} {path}: {response.status} {data.decode()}')
+        return response, data
+
+    def info(self):
+        return json.loads(self.__request('GET', '/info')[1])
+
+    def stats(self):
+        return json.loads(self.__request('GET', '/stats')[1])
+
+    def frame(self, index, width=None, height=None):
+        size = ''.join([f'&width={width}' if width else '', f'&height={height}' if height else ''])
+        _, data = self.__request('GET', f'/frames/{index}?{size}')
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def frames(self, indexes, width=None, height=None, decode=True):
+        size = ''.join([f'&width={width}' if width else '', f'&height={height}' if height else ''])
+        response, data = self.__request('GET', f'/frames?indexes={",".join(str(i) for i in indexes)}{size}')
+        received = [int(i) for i in response.getheader('X-Frame-Indexes').split(',') if i]
+        lengths = [int(i) for i in response.getheader('X-Frame-Lengths').split(',') if i]
+        frames = []
+        offset = 0
+        for index, length in zip(received, lengths):
+            encoded = data[offset:offset + length]
+            offset += length
+            frames.append((index, cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR)
+                           if decode else encoded))
+        return frames
+
+    def annotations(self, frame=None, start=None, end=None):
+        if frame is not None:
+            return json.loads(self.__request('GET', f'/annotations?frame={frame}')[1])
+        query = '&'.join(f'{name}={value}' for name, value in (('start', start), ('end', end)) if value is not None)
+        return json.loads(self.__request('GET', f'/annotations?{query}')[1])
+
+    def create(self, entry):
+        return json.loads(self.__request('POST', '/annotations', entry)[1])
+
+    def update(self, id, entry):
+        return json.loads(self.__request('PUT', f'/annotations/{id}', entry)[1])
+
+    def delete(self, id):
+        self.__request('DELETE', f'/annotations/{id}')
+
+    def events(self):
+        return WebSocket.connect(self.__host, self.__port, '/events')
+
+    def close(self):
+        self.__connection.close()
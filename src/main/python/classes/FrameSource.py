@@ -0,0 +1,268 @@
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from classes.Tiles import get_executor
+from classes.Timestamps import build_timestamps
+
+logger = logging.getLogger('FrameSource')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+# image sequences carry no frame rate
+DEFAULT_FPS = 25.0
+IMAGE_READ_AHEAD = 16
+IMAGE_WORKERS = min(os.cpu_count() or 1, 8)
+
+
+class FrameSource:
+    # numbered frames of a video: read() returns the frame at the position and moves to the next one
+    # exact_seek: seek() lands on the requested frame, random_access: seeking costs no decoding,
+    # timestamps: presentation times are known, keyframes: the frames decodable on their own are known
+    capabilities = {'exact_seek': False, 'random_access': False, 'timestamps': False, 'keyframes': False}
+
+    def __init__(self, fps, width, height, total_frames):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.total_frames = total_frames
+        self._position = 0
+
+    @property
+    def position(self):
+        return self._position
+
+    def seek(self, index):
+        self._position = index
+
+    def read(self):
+        raise NotImplementedError
+
+    def timestamps(self, cancelled=None):
+        # presentation times in milliseconds, None when the source does not have them
+        return None
+
+    def keyframes(self):
+        # indexes of the frames decodable on their own, None when unknown
+        return None
+
+    def release(self):
+        pass
+
+
+class VideoCaptureSource(FrameSource):
+    capabilities = {'exact_seek': False, 'random_access': False, 'timestamps': True, 'keyframes': False}
+
+    def __init__(self, filename, count_frames=True):
+        self.__filename = filename
+        self.__video = cv2.VideoCapture(filename)
+        video = self.__video
+        total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+        if count_frames:
+            # the container may announce more frames than it holds
+            video.set(cv2.CAP_PROP_POS_FRAMES, total_frames)
+            check = False
+            while not check:
+                check, frame = video.read()
+                if not check:
+                    total_frames -= 1
+                    video.set(cv2.CAP_PROP_POS_FRAMES, total_frames)
+            video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            total_frames += 1
+        super().__init__(video.get(cv2.CAP_PROP_FPS), int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                         int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(total_frames))
+
+    @property
+    def position(self):
+        return int(self.__video.get(cv2.CAP_PROP_POS_FRAMES))
+
+    def seek(self, index):
+        self.__video.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+    def read(self):
+        return self.__video.read()
+
+    def timestamps(self, cancelled=None):
+        return build_timestamps(self.__filename, cancelled)
+
+    def release(self):
+        self.__video.release()
+
+
+def natural_key(name):
+    # frame_2.png before frame_10.png
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def image_files(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory), key=natural_key)
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+
+class ImageSequenceSource(FrameSource):
+    # a folder with one image per frame, images ahead of the position are decoded in parallel (the decoders
+    # release the GIL)
+    capabilities = {'exact_seek': True, 'random_access': True, 'timestamps': False, 'keyframes': True}
+
+    def __init__(self, directory, fps=DEFAULT_FPS, read_ahead=IMAGE_READ_AHEAD, workers=IMAGE_WORKERS):
+        self.__files = image_files(directory)
+        if len(self.__files) == 0:
+            raise ValueError(f'No images in {directory}')
+        first = cv2.imread(self.__files[0], cv2.IMREAD_COLOR)
+        if first is None:
+            raise ValueError(f'Cannot decode {self.__files[0]}')
+        super().__init__(fps, first.shape[1], first.shape[0], len(self.__files))
+        self.__read_ahead = read_ahead
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ImageSequence')
+        self.__pending = dict()
+        # consecutive reads, the read-ahead grows with them so random reads do not decode images for nothing
+        self.__sequential = 0
+        self.__last_read = None
+
+    def __decode(self, index):
+        frame = cv2.imread(self.__files[index], cv2.IMREAD_COLOR)
+        if frame is not None and (frame.shape[1], frame.shape[0]) != (self.width, self.height):
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def __prefetch(self, index):
+        last = min(index + min(self.__read_ahead, 1 << min(self.__sequential, 8)), self.total_frames)
+        # after a seek the images decoded for the old position are dropped
+        for pending in [i for i in self.__pending if not index <= i < last]:
+            self.__pending.pop(pending).cancel()
+        for i in range(index, last):
+            if i not in self.__pending:
+                self.__pending[i] = self.__executor.submit(self.__decode, i)
+
+    def read(self):
+        index = self._position
+        if not 0 <= index < self.total_frames:
+            return False, None
+        self.__sequential = self.__sequential + 1 if self.__last_read == index - 1 else 0
+        self.__last_read = index
+        self.__prefetch(index)
+        frame = self.__pending.pop(index).result()
+        self._position += 1
+        return frame is not None, frame
+
+    def keyframes(self):
+        return np.arange(self.total_frames)
+
+    def release(self):
+        for pending in self.__pending.values():
+            pending.cancel()
+        self.__pending.clear()
+        self.__executor.shutdown(wait=False)
+
+
+class Y4MSource(FrameSource):
+    # raw YUV4MPEG2 frames mapped from the file: a frame is found by its offset and only converted to BGR
+    capabilities = {'exact_seek': True, 'random_access': True, 'timestamps': False, 'keyframes': True}
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            header = f.readline()
+            if not header.startswith(b'YUV4MPEG2'):
+                raise ValueError(f'{filename} is not a YUV4MPEG2 file')
+            frame_header = f.readline()
+            if not frame_header.startswith(b'FRAME'):
+                raise ValueError(f'{filename} has no frames')
+        parameters = {token[:1]: token[1:] for token in header.decode('ascii').split()[1:]}
+        width = int(parameters['W'])
+        height = int(parameters['H'])
+        numerator, denominator = parameters.get('F', '25:1').split(':')
+        fps = int(numerator) / int(denominator)
+        self.__chroma = parameters.get('C', '420jpeg')
+        if self.__chroma.startswith('420'):
+            chroma_size = (width + 1) // 2 * ((height + 1) // 2)
+        elif self.__chroma.startswith('422'):
+            chroma_size = (width + 1) // 2 * height
+        elif self.__chroma.startswith('444'):
+            chroma_size = width * height
+        elif self.__chroma.startswith('mono'):
+            chroma_size = 0
+        else:
+            raise ValueError(f'Unsupported Y4M colorspace {self.__chroma}')
+        if self.__chroma.startswith('420') and (width % 2 or height % 2):
+            raise ValueError('Odd sized 4:2:0 Y4M frames are not supported')
+        # frame headers have no parameters in practice, every frame then has the same size
+        self.__offset = len(header) + len(frame_header)
+        self.__frame_size = width * height + 2 * chroma_size
+        self.__stride = len(frame_header) + self.__frame_size
+        self.__data = np.memmap(filename, np.uint8, 'r')
+        total_frames = (len(self.__data) - len(header)) // self.__stride
+        super().__init__(fps, width, height, total_frames)
+
+    def __planes(self, data):
+        width, height = self.width, self.height
+        y = data[:width * height].reshape(height, width)
+        if self.__chroma.startswith('mono'):
+            return get_executor().cvt_color(y, cv2.COLOR_GRAY2BGR)
+        # 4:2:2 and 4:4:4 only, 4:2:0 frames are converted as I420; chroma rows match luma rows, so each band of
+        # rows is upsampled and converted on its own
+        chroma_width = width if self.__chroma.startswith('444') else (width + 1) // 2
+        chroma_size = chroma_width * height
+        u = data[width * height:width * height + chroma_size].reshape(height, chroma_width)
+        v = data[width * height + chroma_size:].reshape(height, chroma_width)
+
+        def convert(y, u, v):
+            if chroma_width != width:
+                u = cv2.resize(u, (width, len(y)), interpolation=cv2.INTER_LINEAR)
+                v = cv2.resize(v, (width, len(y)), interpolation=cv2.INTER_LINEAR)
+            return cv2.cvtColor(cv2.merge([y, u, v]), cv2.COLOR_YUV2BGR)
+
+        return get_executor().map_rows(convert, y, u, v, output=np.empty((height, width, 3), np.uint8))
+
+    def read(self):
+        index = self._position
+        if not 0 <= index < self.total_frames:
+            return False, None
+        start = self.__offset + index * self.__stride
+        data = self.__data[start:start + self.__frame_size]
+        if self.__chroma.startswith('420'):
+            # the planes are already laid out as I420
+            frame = cv2.cvtColor(data.reshape(self.height * 3 // 2, self.width), cv2.COLOR_YUV2BGR_I420)
+        else:
+            frame = self.__planes(data)
+        self._position += 1
+        return True, frame
+
+    def keyframes(self):
+        return np.arange(self.total_frames)
+
+    def release(self):
+        self.__data = None
+
+
+def source_class(filename):
+    if os.path.isdir(filename):
+        return ImageSequenceSource
+    if os.path.splitext(filename)[1].lower() == '.y4m':
+        return Y4MSource
+    return VideoCaptureSource
+
+
+def open_source(filename, count_frames=True) -> FrameSource:
+    # an image sequence folder, a raw Y4M file, or anything else OpenCV can decode
+    cls = source_class(filename)
+    if cls is VideoCaptureSource:
+        return VideoCaptureSource(filename, count_frames)
+    return cls(filename)
+
+
+def is_valid_source(filename):
+    try:
+        if source_class(filename) is VideoCaptureSource:
+            video = cv2.VideoCapture(filename)
+            valid = video.isOpened() and video.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+            video.release()
+            return valid
+        source = open_source(filename)
+        source.release()
+        return source.total_frames > 0
+    except (cv2.error, OSError, ValueError, KeyError) as e:
+        logger.warning(f'Cannot open {filename}: {e}')
+        return False
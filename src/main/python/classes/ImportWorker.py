@@ -0,0 +1,67 @@
+import logging
+import time
+from threading import Thread, Semaphore
+
+from PySide2.QtCore import Signal, QObject
+
+from classes.Importers import FORMATS
+
+# chunks emitted but not yet consumed by the UI, the reader waits past that
+PENDING_CHUNKS = 4
+
+
+class Importer(QObject):
+    logger = logging.getLogger('Importer')
+
+    # every signal carries the generation of its import, queued signals of a cancelled one are ignored by checking
+    # it with current()
+    chunk = Signal(int, object)
+    finished = Signal(int, int, float)
+    failed = Signal(int, str)
+
+    def __init__(self):
+        super(Importer, self).__init__()
+        self.__generation = 0
+        self.__pending = Semaphore(PENDING_CHUNKS)
+
+    def start(self, filename, format):
+        self.cancel()
+        generation = self.__generation
+        pending = self.__pending
+
+        def cancelled():
+            return generation != self.__generation
+
+        def run():
+            start = time.time()
+            imported = 0
+            try:
+                for chunk in FORMATS[format](filename, cancelled):
+                    while not pending.acquire(timeout=0.1):
+                        if cancelled():
+                            return
+                    if cancelled():
+                        return
+                    imported += len(chunk)
+                    self.chunk.emit(generation, chunk)
+            except Exception as e:
+                # whatever the file holds, the UI has to hear that the import ended
+                self.logger.error(f'Import of {filename} failed: {e}')
+                self.failed.emit(generation, str(e))
+                return
+            if not cancelled():
+                self.logger.info(f'Imported {imported} shapes in {time.time() - start:.1f}s')
+                self.finished.emit(generation, imported, time.time() - start)
+
+        Thread(target=run, daemon=True).start()
+
+    def current(self, generation):
+        return generation == self.__generation
+
+    def consumed(self, generation):
+        if generation == self.__generation:
+            self.__pending.release()
+
+    def cancel(self):
+        self.__generation += 1
+        self.__pending = Semaphore(PENDING_CHUNKS)
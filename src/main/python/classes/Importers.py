@@ -0,0 +1,178 @@
+import re
+import uuid
+import xml.etree.ElementTree as ElementTree
+from itertools import islice
+
+import numpy as np
+
+from classes.JsonStream import JsonStream
+from classes.Shape import Shape, ShapeType
+
+CHUNK_SIZE = 5000
+FRAME_NUMBER = re.compile(r'(\d+)\D*$')
+
+
+def new_shape(shape_type, points, message):
+    shape = Shape(uuid.uuid4().hex, shape_type)
+    shape.set_points(points)
+    shape.message = message
+    return shape
+
+
+def import_mot(filename, cancelled=lambda: False):
+    # frame, id, left, top, width, height, ... (1-based frames), parsed a chunk of lines at a time
+    with open(filename) as f:
+        while not cancelled():
+            lines = [line for line in islice(f, CHUNK_SIZE) if line.strip()]
+            if len(lines) == 0:
+                return
+            columns = lines[0].count(',') + 1
+            if columns < 6:
+                raise ValueError(f'MOT rows need at least 6 columns, found {columns}')
+            rows = np.fromstring(','.join(line.strip() for line in lines), sep=',').reshape(-1, columns)
+            frames = rows[:, 0].astype(np.int64) - 1
+            tracks = rows[:, 1].astype(np.int64)
+            corners = np.round(np.stack([rows[:, 2], rows[:, 3], rows[:, 2] + rows[:, 4], rows[:, 3] + rows[:, 5]],
+                                        axis=1)).astype(np.int64).tolist()
+            yield [(frame, new_shape(ShapeType.rectangle, [(x1, y1), (x2, y2)], f'track {track}'))
+                   for frame, track, (x1, y1, x2, y2) in zip(frames.tolist(), tracks.tolist(), corners)]
+
+
+def coco_shape(annotation, categories):
+    message = categories.get(annotation.get('category_id'), str(annotation.get('category_id', '')))
+    segmentation = annotation.get('segmentation')
+    if isinstance(segmentation, list) and len(segmentation) > 0 and isinstance(segmentation[0], list) and \
+            len(segmentation[0]) >= 6:
+        ring = segmentation[0]
+        xs, ys = set(ring[0::2]), set(ring[1::2])
+        if len(ring) == 8 and len(xs) == 2 and len(ys) == 2:
+            # an axis aligned box, as exported for rectangles
+            return new_shape(ShapeType.rectangle, [(min(xs), min(ys)), (max(xs), max(ys))], message)
+        return new_shape(ShapeType.polygon, list(zip(ring[0::2], ring[1::2])), message)
+    if 'bbox' in annotation:
+        x, y, w, h = annotation['bbox']
+        return new_shape(ShapeType.rectangle, [(x, y), (x + w, y + h)], message)
+    return None
+
+
+def coco_frames(images):
+    # frames exported by this application carry their index, otherwise it is taken from the file name
+    frames = dict()
+    for position, image in enumerate(sorted(images, key=lambda i: i['id'])):
+        if 'frame' in image:
+            frames[image['id']] = image['frame']
+        else:
+            match = FRAME_NUMBER.search(image.get('file_name', ''))
+            frames[image['id']] = int(match.group(1)) if match is not None else position
+    return frames
+
+
+def import_coco(filename, cancelled=lambda: False):
+    images = []
+    categories = None
+    annotations_first = False
+
+    def read(streamed):
+        with open(filename) as f:
+            for key, value, is_element in JsonStream(f).iter_object(streamed=streamed):
+                yield key, value, is_element
+
+    # shapes need the frames of the images and the names of the categories; when either comes after the
+    # annotations (official COCO files end with the categories) the file is read twice
+    chunk = []
+    frames = None
+    for key, value, is_element in read(('annotations', 'images')):
+        if cancelled():
+            return
+        if key == 'images' and is_element:
+            images.append({name: value[name] for name in ('id', 'file_name', 'frame') if name in value})
+        elif key == 'categories':
+            categories = {category['id']: category['name'] for category in value}
+        elif key == 'annotations':
+            if len(images) == 0 or categories is None:
+                annotations_first = True
+                continue
+            if frames is None:
+                frames = coco_frames(images)
+            shape = coco_shape(value, categories)
+            if shape is not None:
+                chunk.append((frames.get(value['image_id'], 0), shape))
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+
+    if annotations_first:
+        frames = coco_frames(images)
+        categories = categories or dict()
+        for key, value, is_element in read(('annotations',)):
+            if cancelled():
+                return
+            if key == 'annotations' and is_element:
+                shape = coco_shape(value, categories)
+                if shape is not None:
+                    chunk.append((frames.get(value['image_id'], 0), shape))
+                if len(chunk) >= CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def cvat_points(value):
+    return [tuple(float(v) for v in point.split(',')) for point in value.split(';')]
+
+
+def cvat_shape(element, label):
+    label = element.get('label', label)
+    if element.tag == 'box':
+        return new_shape(ShapeType.rectangle, [(float(element.get('xtl')), float(element.get('ytl'))),
+                                               (float(element.get('xbr')), float(element.get('ybr')))], label)
+    if element.tag == 'ellipse':
+        cx, cy, rx, ry = (float(element.get(name)) for name in ('cx', 'cy', 'rx', 'ry'))
+        return new_shape(ShapeType.ellipse, [(cx - rx, cy - ry), (cx + rx, cy + ry)], label)
+    if element.tag == 'polygon':
+        return new_shape(ShapeType.polygon, cvat_points(element.get('points')), label)
+    if element.tag == 'polyline':
+        return new_shape(ShapeType.line, cvat_points(element.get('points')), label)
+    if element.tag == 'tag':
+        return new_shape(ShapeType.globals, [], label)
+    return None
+
+
+def import_cvat(filename, cancelled=lambda: False):
+    # CVAT for images (shapes inside <image>) and for video (shapes with a frame inside <track>)
+    chunk = []
+    frame = None
+    label = None
+    root = None
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'start':
+            if element.tag == 'image':
+                frame = int(element.get('id'))
+            elif element.tag == 'track':
+                label = element.get('label')
+            continue
+        if element.tag in ('box', 'ellipse', 'polygon', 'polyline', 'tag') and element.get('outside') != '1':
+            shape = cvat_shape(element, label)
+            if shape is not None:
+                chunk.append((int(element.get('frame', frame)), shape))
+        elif element.tag in ('image', 'track'):
+            # everything read so far is dropped, memory stays bounded
+            root.clear()
+            label = None
+            if cancelled():
+                return
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+FORMATS = {
+    'mot': import_mot,
+    'coco': import_coco,
+    'cvat': import_cvat,
+}
@@ -0,0 +1,86 @@
+import json
+
+WHITESPACE = ' \t\r\n'
+NUMBER = '0123456789.eE+-'
+
+
+class JsonStream:
+    # reads a JSON document from a file a chunk at a time, values are decoded one by one with raw_decode
+    def __init__(self, f, chunk_size=1 << 16):
+        self.__f = f
+        self.__chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__position = 0
+        self.__eof = False
+
+    def __fill(self):
+        if self.__eof:
+            return False
+        chunk = self.__f.read(self.__chunk_size)
+        self.__eof = chunk == ''
+        self.__buffer = self.__buffer[self.__position:] + chunk
+        self.__position = 0
+        return not self.__eof
+
+    def peek(self):
+        while True:
+            while self.__position < len(self.__buffer) and self.__buffer[self.__position] in WHITESPACE:
+                self.__position += 1
+            if self.__position < len(self.__buffer):
+                return self.__buffer[self.__position]
+            if not self.__fill():
+                return None
+
+    def expect(self, characters):
+        c = self.peek()
+        if c is None or c not in characters:
+            raise ValueError(f'Expected {characters!r}, found {c!r}')
+        self.__position += 1
+        return c
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer, self.__position)
+                # a number is only complete once something else follows it, it may continue in the next chunk
+                if isinstance(value, (int, float)) and not self.__eof:
+                    following = end
+                    while following < len(self.__buffer) and self.__buffer[following] in NUMBER:
+                        following += 1
+                    if following == len(self.__buffer):
+                        raise ValueError('Incomplete number')
+                self.__position = end
+                return value
+            except ValueError:
+                if self.__eof:
+                    raise
+            self.__fill()
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.__position += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_object(self, streamed=()):
+        # members listed in streamed are arrays yielded element by element as (key, element, True)
+        self.expect('{')
+        if self.peek() == '}':
+            self.__position += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            if key in streamed and self.peek() == '[':
+                for element in self.iter_array():
+                    yield key, element, True
+            else:
+                yield key, self.decode(), False
+            if self.expect(',}') == '}':
+                return
@@ -0,0 +1,57 @@
+import json
+from collections import deque
+from threading import Lock
+
+import numpy as np
+
+# upper bounds (ms) of the histogram buckets, the last one catches everything else
+HISTOGRAM_BUCKETS = [0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266, 533, float('inf')]
+
+
+class LatencyStats:
+    def __init__(self, window=300):
+        self.__lock = Lock()
+        self.__window = window
+        self.__samples = dict()
+
+    def add(self, stage, seconds):
+        with self.__lock:
+            if stage not in self.__samples:
+                self.__samples[stage] = deque(maxlen=self.__window)
+            self.__samples[stage].append(seconds * 1000)
+
+    def add_timings(self, timings: [(str, float)]):
+        # timings are consecutive (stage, end timestamp) pairs, the first one marks the start
+        for (_, start), (stage, end) in zip(timings, timings[1:]):
+            self.add(stage, end - start)
+        if len(timings) > 1:
+            self.add('total', timings[-1][1] - timings[0][1])
+
+    def clear(self):
+        with self.__lock:
+            self.__samples.clear()
+
+    def summary(self):
+        with self.__lock:
+            samples = {stage: np.array(values) for stage, values in self.__samples.items() if len(values) > 0}
+        result = dict()
+        for stage, values in samples.items():
+            counts = np.histogram(values, bins=[0] + HISTOGRAM_BUCKETS)[0]
+            result[stage] = {
+                'count': int(values.size),
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(np.percentile(values, 50)),
+                'p95_ms': float(np.percentile(values, 95)),
+                'p99_ms': float(np.percentile(values, 99)),
+                'max_ms': float(values.max()),
+                'histogram': [{'le_ms': bucket if bucket != float('inf') else None, 'count': int(count)}
+                              for bucket, count in zip(HISTOGRAM_BUCKETS, counts)],
+            }
+        return result
+
+    def to_json(self, indent=2):
+        return json.dumps(self.summary(), indent=indent)
+
+    def to_status(self):
+        summary = self.summary()
+        return ' | '.join(f'{stage} {s["p50_ms"]:.1f}/{s["p95_ms"]:.1f}ms' for stage, s in summary.items())
@@ -0,0 +1,74 @@
+import logging
+import time
+from queue import Queue
+from threading import Thread
+
+logger = logging.getLogger('Pipeline')
+
+# items waiting in front of each stage
+DEPTH = 2
+
+
+class Stage:
+    def __init__(self, name, function, depth):
+        self.name = name
+        self.function = function
+        self.queue = Queue(depth)
+        self.processed = 0
+        self.busy = 0.0
+
+
+class Pipeline:
+    # stages on their own threads joined by bounded queues, every item goes through all of them in order; OpenCV
+    # releases the GIL, so the stages of consecutive frames overlap and the throughput is the one of the slowest
+    # stage. A stage returning None drops the item; when a stage raises, failed(item, error) gives the item handed
+    # to the next stages instead, so they can report it
+    def __init__(self, stages, depth=DEPTH, failed=None):
+        self.__failed = failed
+        self.__stages = [Stage(name, function, depth) for (name, function) in stages]
+        self.__threads = [Thread(target=self.__run, args=(i,), name=f'Pipeline-{stage.name}', daemon=True)
+                          for i, stage in enumerate(self.__stages)]
+        for thread in self.__threads:
+            thread.start()
+
+    def __run(self, i):
+        stage = self.__stages[i]
+        following = self.__stages[i + 1].queue if i + 1 < len(self.__stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                if following is not None:
+                    following.put(None)
+                return
+            start = time.time()
+            try:
+                item = stage.function(item)
+            except Exception as e:
+                logger.error(f'{stage.name}: {e}')
+                item = self.__failed(item, e) if self.__failed is not None else None
+            stage.busy += time.time() - start
+            stage.processed += 1
+            if following is not None and item is not None:
+                following.put(item)
+
+    @property
+    def full(self):
+        return self.__stages[0].queue.full()
+
+    def put(self, item):
+        self.__stages[0].queue.put(item)
+
+    def depths(self):
+        return [(stage.name, stage.queue.qsize()) for stage in self.__stages]
+
+    def stats(self):
+        return {stage.name: {'depth': stage.queue.qsize(), 'capacity': stage.queue.maxsize,
+                             'processed': stage.processed,
+                             'busy_ms': stage.busy * 1000 / stage.processed if stage.processed > 0 else 0}
+                for stage in self.__stages}
+
+    def close(self):
+        # the items already queued go through before the threads end
+        self.put(None)
+        for thread in self.__threads:
+            thread.join()
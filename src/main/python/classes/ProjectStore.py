@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import sqlite3
+import uuid
+
+from classes.DiskCache import fingerprint
+from classes.Exporters import batches, iter_annotations
+from classes.Shape import Shape
+from classes.Track import Track
+
+logger = logging.getLogger('ProjectStore')
+
+# rows per transaction on bulk inserts
+BATCH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT,
+    fingerprint TEXT,
+    fps REAL,
+    width INTEGER,
+    height INTEGER,
+    total_frames INTEGER
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    frame INTEGER NOT NULL,
+    shape TEXT NOT NULL,
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    points TEXT NOT NULL,
+    timestamp REAL,
+    keyframes TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS videos_fingerprint ON videos(fingerprint);
+CREATE INDEX IF NOT EXISTS videos_name ON videos(name);
+CREATE INDEX IF NOT EXISTS shapes_video_frame ON shapes(video_id, frame);
+CREATE INDEX IF NOT EXISTS shapes_message_video_frame ON shapes(message_id, video_id, frame);
+'''
+
+INSERT_SHAPE = 'INSERT INTO shapes (uid, video_id, frame, shape, message_id, points, timestamp, keyframes) ' \
+               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+class ProjectStore:
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__connection = sqlite3.connect(filename, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode = WAL')
+        self.__connection.execute('PRAGMA synchronous = NORMAL')
+        self.__connection.execute('PRAGMA foreign_keys = ON')
+        self.__connection.executescript(SCHEMA)
+        # projects created before tracks were stored
+        if 'keyframes' not in [row[1] for row in self.__connection.execute('PRAGMA table_info(shapes)')]:
+            self.__connection.execute('ALTER TABLE shapes ADD COLUMN keyframes TEXT')
+        self.__messages = {text: id for (id, text) in self.__connection.execute('SELECT id, text FROM messages')}
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.__connection.execute('PRAGMA optimize')
+        self.__connection.close()
+
+    def analyze(self):
+        # statistics let the planner start from the most selective index (e.g. one video out of hundreds)
+        self.__connection.execute('ANALYZE')
+
+    def __message_id(self, text, added):
+        # messages are few and repeated on every shape, their ids are kept in memory; ids of messages inserted by
+        # the running transaction go in added, they are only kept once it commits
+        id = self.__messages.get(text, added.get(text))
+        if id is None:
+            self.__connection.execute('INSERT OR IGNORE INTO messages (text) VALUES (?)', (text,))
+            id = self.__connection.execute('SELECT id FROM messages WHERE text = ?', (text,)).fetchone()[0]
+            added[text] = id
+        return id
+
+    def video(self, filename=None, name=None, **metadata):
+        # a video is found by the fingerprint of its file, so moving or renaming it keeps its annotations;
+        # without the file (e.g. migrating a JSON file alone) by its name
+        video_fingerprint = fingerprint(filename) if filename is not None and os.path.exists(filename) else None
+        name = name or os.path.splitext(os.path.basename(filename))[0]
+        with self.__connection:
+            row = None
+            if video_fingerprint is not None:
+                row = self.__connection.execute('SELECT id FROM videos WHERE fingerprint = ?',
+                                                (video_fingerprint,)).fetchone()
+            if row is None:
+                row = self.__connection.execute('SELECT id FROM videos WHERE name = ? AND fingerprint IS NULL',
+                                                (name,)).fetchone()
+            if row is None:
+                id = self.__connection.execute('INSERT INTO videos (name) VALUES (?)', (name,)).lastrowid
+            else:
+                id = row[0]
+            columns = dict(metadata, name=name)
+            if filename is not None:
+                columns['path'] = os.path.abspath(filename)
+            if video_fingerprint is not None:
+                columns['fingerprint'] = video_fingerprint
+            self.__connection.execute(f'UPDATE videos SET {", ".join(c + " = ?" for c in columns)} WHERE id = ?',
+                                      list(columns.values()) + [id])
+        return id
+
+    def videos(self):
+        rows = self.__connection.execute('SELECT v.id, v.name, v.path, v.total_frames, COUNT(s.id) FROM videos v '
+                                         'LEFT JOIN shapes s ON s.video_id = v.id GROUP BY v.id ORDER BY v.name')
+        return [{'id': id, 'name': name, 'path': path, 'total_frames': total_frames, 'shapes': shapes}
+                for (id, name, path, total_frames, shapes) in rows]
+
+    def __insert_batch(self, video_id, batch, added):
+        rows = [(e.get('id') or uuid.uuid4().hex, video_id, e['frame'], e['shape'],
+                 self.__message_id(e.get('message', ''), added), json.dumps(e.get('points', [])), e.get('timestamp'),
+                 json.dumps(e['keyframes']) if 'keyframes' in e else None)
+                for e in batch]
+        self.__connection.executemany(INSERT_SHAPE, rows)
+
+    def insert(self, video_id, annotations):
+        # annotations in the save format, inserted with one prepared statement per batch and transaction
+        inserted = 0
+        for batch in batches(annotations, BATCH_SIZE):
+            added = dict()
+            with self.__connection:
+                self.__insert_batch(video_id, batch, added)
+            self.__messages.update(added)
+            inserted += len(batch)
+        return inserted
+
+    def replace(self, video_id, annotations):
+        # a single transaction: when an annotation is rejected the saved ones are kept
+        inserted = 0
+        added = dict()
+        with self.__connection:
+            self.__connection.execute('DELETE FROM shapes WHERE video_id = ?', (video_id,))
+            for batch in batches(annotations, BATCH_SIZE):
+                self.__insert_batch(video_id, batch, added)
+                inserted += len(batch)
+        self.__messages.update(added)
+        return inserted
+
+    def load(self, video_id):
+        # only the rows of one video, as the (frame, shape) pairs of the timeline
+        rows = self.__connection.execute('SELECT s.uid, s.frame, s.shape, m.text, s.points, s.keyframes FROM shapes s '
+                                         'JOIN messages m ON m.id = s.message_id WHERE s.video_id = ? '
+                                         'ORDER BY s.id', (video_id,))
+        for (uid, frame, shape_type, message, points, keyframes) in rows:
+            if keyframes is not None:
+                shape = Track.from_save_format({'shape': shape_type, 'keyframes': json.loads(keyframes)}, uid)
+            else:
+                shape = Shape(uid, shape_type)
+                shape.set_points(json.loads(points))
+            shape.message = message
+            yield frame, shape
+
+    def query(self, message=None, video=None, shape=None, start=None, end=None, limit=None):
+        # message and video match exactly, or as a LIKE pattern when they contain %; tracks are found by their first
+        # frame
+        conditions = []
+        parameters = []
+        if message is not None:
+            conditions.append('m.text LIKE ?' if '%' in message else 'm.text = ?')
+            parameters.append(message)
+        if video is not None:
+            conditions.append('v.name LIKE ?' if '%' in video else 'v.name = ?')
+            parameters.append(video)
+        if shape is not None:
+            conditions.append('s.shape = ?')
+            parameters.append(shape)
+        if start is not None:
+            conditions.append('s.frame >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('s.frame < ?')
+            parameters.append(end)
+        sql = 'SELECT v.name, s.frame, s.timestamp, s.shape, m.text, s.points, s.keyframes FROM shapes s ' \
+              'JOIN messages m ON m.id = s.message_id JOIN videos v ON v.id = s.video_id'
+        if len(conditions) > 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY v.name, s.frame'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+        for (name, frame, timestamp, shape_type, text, points, keyframes) in self.__connection.execute(sql, parameters):
+            entry = {'video': name, 'frame': frame, 'shape': shape_type, 'message': text,
+                     'points': json.loads(points)}
+            if keyframes is not None:
+                entry['keyframes'] = json.loads(keyframes)
+            if timestamp is not None:
+                entry['timestamp'] = timestamp
+            yield entry
+
+    def count(self, message=None):
+        # shapes per message and video
+        sql = 'SELECT m.text, v.name, COUNT(*) FROM shapes s JOIN messages m ON m.id = s.message_id ' \
+              'JOIN videos v ON v.id = s.video_id'
+        parameters = []
+        if message is not None:
+            sql += ' WHERE m.text LIKE ?' if '%' in message else ' WHERE m.text = ?'
+            parameters.append(message)
+        sql += ' GROUP BY s.message_id, s.video_id ORDER BY m.text, v.name'
+        return [{'message': text, 'video': name, 'count': count}
+                for (text, name, count) in self.__connection.execute(sql, parameters)]
+
+    def migrate(self, annotations_filename, video_filename=None, name=None):
+        # a project JSON file saved by the application, streamed into the store
+        if video_filename is None and name is None:
+            name = os.path.basename(annotations_filename)
+            name = name[:-len('.annotations.json')] if name.endswith('.annotations.json') else \
+                os.path.splitext(name)[0]
+        video_id = self.video(video_filename, name)
+        inserted = self.replace(video_id, iter_annotations(annotations_filename))
+        logger.info(f'Migrated {inserted} annotations from {annotations_filename}')
+        return video_id, inserted
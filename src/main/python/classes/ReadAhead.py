@@ -0,0 +1,117 @@
+import ctypes
+import math
+import os
+import sys
+import time
+from collections import deque
+
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_memory():
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    elif sys.platform.startswith('win'):
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        pass
+    # no way to know (e.g. Mac OS), assume half of the machine is free
+    total = total_memory()
+    return total // 2 if total is not None else 1024 * 1024 * 1024
+
+
+class ReadAhead:
+    def __init__(self, memory_fraction=0.25, seconds=2, minimum=10, maximum=600, check_interval=2,
+                 pressure_fraction=0.1, fixed=None):
+        self.__memory_fraction = memory_fraction
+        self.__seconds = seconds
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__check_interval = check_interval
+        self.__pressure_fraction = pressure_fraction
+        self.__fixed = fixed
+
+        self.__frame_bytes = 1
+        self.__fps = 30
+        self.__decode_times = deque(maxlen=50)
+        self.__last_check = 0
+        self.__size = fixed if fixed is not None else minimum
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def frame_bytes(self):
+        return self.__frame_bytes
+
+    def configure(self, width, height, fps):
+        self.__frame_bytes = max(width * height * 3, 1)
+        self.__fps = fps if fps and fps > 0 else 30
+        self.__decode_times.clear()
+
+    def add_decode_time(self, seconds):
+        self.__decode_times.append(seconds)
+
+    def update(self, force=False):
+        now = time.time()
+        if not force and now - self.__last_check < self.__check_interval:
+            return None
+        self.__last_check = now
+
+        available = available_memory()
+        total = total_memory() or available
+        budget = int(available * self.__memory_fraction)
+        by_memory = budget // self.__frame_bytes
+
+        decode_time = sum(self.__decode_times) / len(self.__decode_times) if len(self.__decode_times) > 0 else 0
+        # slow decoders need a deeper buffer to ride out the frames that take longer than the frame interval
+        by_speed = int(math.ceil(self.__fps * self.__seconds * max(1, decode_time * self.__fps)))
+
+        pressure = available < total * self.__pressure_fraction
+        if self.__fixed is not None:
+            size = self.__fixed
+            reason = 'fixed'
+        elif pressure:
+            size = max(min(self.__size // 2, by_memory), 1)
+            reason = 'memory pressure'
+        else:
+            size = max(min(by_speed, by_memory, self.__maximum), min(self.__minimum, max(by_memory, 1)))
+            reason = 'memory' if by_memory < by_speed else 'decode speed'
+
+        if not force and size == self.__size:
+            return None
+        self.__size = size
+        return {
+            'frames': size,
+            'frame_bytes': self.__frame_bytes,
+            'cache_bytes': size * self.__frame_bytes,
+            'budget_bytes': budget,
+            'available_bytes': available,
+            'decode_ms': decode_time * 1000,
+            'pressure': pressure,
+            'reason': reason,
+        }
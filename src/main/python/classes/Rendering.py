@@ -0,0 +1,182 @@
+import logging
+
+import cv2
+import numpy as np
+
+from classes.FrameSource import open_source
+from classes.Shape import Shape, ShapeType
+from classes.Tiles import get_executor
+
+logger = logging.getLogger('Rendering')
+
+
+def open_video(filename):
+    source = open_source(filename)
+    return source, source.fps, source.width, source.height, source.total_frames
+
+
+def fit_size(video_width, video_height, container_width=None, container_height=None):
+    # the largest size with the video ratio that fits in the container, a missing side only limits by the other
+    # one and without both the video keeps its own size
+    if container_width is None and container_height is None:
+        return video_width, video_height
+    ratio = video_width / video_height
+    container_width = container_width if container_width is not None else container_height * ratio
+    container_height = container_height if container_height is not None else container_width / ratio
+    return (max(int(min(container_width, container_height * ratio)), 1),
+            max(int(min(container_height, container_width / ratio)), 1))
+
+
+def shape_modifier(shape: Shape, video_width, video_height, highlight_shape=None, highlight_color=None):
+    if highlight_shape == shape.id:
+        color = highlight_color
+        if shape.color == shape.last_color:
+            last_color = highlight_color
+        else:
+            last_color = shape.last_color
+    else:
+        color = shape.color
+        last_color = shape.last_color
+
+    def mask_negative(frame, mask):
+        return get_executor().map_rows(mask_negative_rows, frame, mask, output=frame)
+
+    def mask_negative_rows(frame, mask):
+        # bands the mask does not reach are left as they are
+        if cv2.countNonZero(mask) == 0:
+            return frame
+        negative = frame.copy()
+        negative = cv2.bitwise_not(negative)
+        negative = cv2.bitwise_and(negative, negative, mask=mask)
+
+        mask = cv2.bitwise_not(mask)
+        frame = cv2.bitwise_and(frame, frame, mask=mask)
+        frame = cv2.bitwise_or(negative, frame)
+        return frame
+
+    def mask_opposite(frame, mask):
+        return get_executor().map_rows(mask_opposite_rows, frame, mask, output=frame)
+
+    def mask_opposite_rows(frame, mask):
+        if cv2.countNonZero(mask) == 0:
+            return frame
+        opposite = frame.copy()
+        opposite = cv2.inRange(opposite, np.array([0, 0, 0]), np.array([128, 128, 128]))
+        opposite = cv2.cvtColor(opposite, cv2.COLOR_GRAY2RGB)
+        opposite = cv2.bitwise_and(opposite, opposite, mask=mask)
+
+        mask = cv2.bitwise_not(mask)
+        frame = cv2.bitwise_and(frame, frame, mask=mask)
+        frame = cv2.bitwise_or(opposite, frame)
+
+        return frame
+
+    def negative_text(frame, text, x, y):
+        w, h, _ = frame.shape
+        mask = np.zeros((w, h), frame.dtype)
+        cv2.putText(mask, text, (x, y), cv2.FONT_HERSHEY_DUPLEX, 1.0, (255, 255, 255), 1)
+        frame = mask_opposite(frame, mask)
+
+        return frame
+
+    if shape.shape == ShapeType.globals:
+        def modifier(frame):
+            cv2.rectangle(frame, (0, 0), (video_width, video_height), color, 3)
+            frame = negative_text(frame, shape.message, 10, 40)
+            return frame
+    elif shape.shape == ShapeType.pointer:
+        def modifier(frame):
+            if len(shape.points) >= 1:
+                x, y = shape.points[0]
+                if None not in (x, y):
+                    w, h, _ = frame.shape
+                    mask = np.zeros((w, h), frame.dtype)
+                    cv2.line(mask, (x, 0), (x, video_height), (255, 255, 255), 3)
+                    cv2.line(mask, (0, y), (video_width, y), (255, 255, 255), 3)
+                    frame = mask_negative(frame, mask)
+                    return frame
+
+            return frame
+    elif shape.shape == ShapeType.ellipse:
+        def modifier(frame):
+            if len(shape.points) >= 2:
+                x1, y1 = shape.points[0]
+                x2, y2 = shape.points[1]
+                if None not in (x1, y1, x2, y2):
+                    centerx = int((x1 + x2) / 2)
+                    centery = int((y1 + y2) / 2)
+                    sizex = int(abs(x1 - centerx))
+                    sizey = int(abs(y1 - centery))
+
+                    cv2.ellipse(frame, (centerx, centery), (sizex, sizey), 0, 0, 360, color, 3)
+                    frame = negative_text(frame, shape.message, centerx - sizex + 10, centery + 7)
+            elif len(shape.points) == 1:
+                x, y = shape.points[0]
+                cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
+                frame = negative_text(frame, shape.message, x + 10, y + 40)
+            return frame
+    elif shape.shape == ShapeType.rectangle:
+        def modifier(frame):
+            if len(shape.points) >= 2:
+                x1, y1 = shape.points[0]
+                x2, y2 = shape.points[1]
+                if None not in (x1, y1, x2, y2):
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+                frame = negative_text(frame, shape.message, min(x1, x2) + 10, min(y1, y2) + 40)
+            elif len(shape.points) == 1:
+                x, y = shape.points[0]
+                cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
+                frame = negative_text(frame, shape.message, x + 10, y + 40)
+            return frame
+    elif shape.shape == ShapeType.polygon:
+        def modifier(frame):
+            if len(shape.points) > 1:
+                for i, p in enumerate(shape.points):
+                    x1, y1 = shape.points[i]
+                    if i == len(shape.points) - 1:
+                        c = last_color
+                        x2, y2 = shape.points[0]
+                    else:
+                        c = color
+                        x2, y2 = shape.points[i + 1]
+
+                    cv2.line(frame, (x1, y1), (x2, y2), c, 3)
+                xt, yt = shape.points[0]
+                frame = negative_text(frame, shape.message, xt + 10, yt + 40)
+            elif len(shape.points) == 1:
+                x, y = shape.points[0]
+                cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
+                frame = negative_text(frame, shape.message, x + 10, y + 40)
+            return frame
+    elif shape.shape == ShapeType.line:
+        def modifier(frame):
+            if len(shape.points) > 1:
+                for i, p in enumerate(shape.points):
+                    if i < len(shape.points) - 1:
+                        x1, y1 = shape.points[i]
+                        if i == len(shape.points) - 2:
+                            c = last_color
+                        else:
+                            c = color
+                        x2, y2 = shape.points[i + 1]
+
+                        cv2.line(frame, (x1, y1), (x2, y2), c, 3)
+                xt, yt = shape.points[0]
+                frame = negative_text(frame, shape.message, xt + 10, yt + 40)
+            elif len(shape.points) == 1:
+                x, y = shape.points[0]
+                cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
+                frame = negative_text(frame, shape.message, x + 10, y + 40)
+            return frame
+    else:
+        def modifier(frame):
+            return frame
+
+        logger.warning(f'Unknown shape while trying to add a new modifier: {shape.shape}')
+    return modifier
+
+
+def draw_shapes(frame, shapes, video_width, video_height, highlight_shape=None, highlight_color=None):
+    for shape in shapes:
+        frame = shape_modifier(shape, video_width, video_height, highlight_shape, highlight_color)(frame)
+    return frame
@@ -0,0 +1,253 @@
+import logging
+import os
+import time
+from multiprocessing import Process, Queue, Value
+from threading import Thread, Lock
+
+import cv2
+import numpy as np
+from PySide2.QtCore import Signal, QObject
+
+from classes.FrameSource import open_source
+from classes.VideoIndex import VideoIndex
+
+THUMBNAIL_SIZE = (64, 36)
+# 16 bins per channel, taken from the top 4 bits of each value
+BINS = 16
+BIN_SHIFT = 4
+CHUNK_SIZE = 300
+SAVE_INTERVAL = 5
+
+
+def histograms(thumbnails: np.ndarray):
+    # one bincount for the whole batch: every (frame, channel, bin) gets its own slot
+    n = len(thumbnails)
+    bins = (thumbnails >> BIN_SHIFT).reshape(n, -1, 3).astype(np.int64)
+    bins += np.arange(3) * BINS
+    bins += (np.arange(n) * BINS * 3)[:, None, None]
+    return np.bincount(bins.ravel(), minlength=n * BINS * 3).reshape(n, BINS * 3).astype(np.uint16)
+
+
+def differences(thumbnails: np.ndarray):
+    return np.abs(np.diff(thumbnails.astype(np.int16), axis=0)).mean(axis=(1, 2, 3)).astype(np.float32) / 255
+
+
+def detect_cuts(hist: np.ndarray, diff: np.ndarray, done: np.ndarray, threshold=0.35, diff_threshold=0.08,
+                min_gap=10):
+    h = hist.astype(np.float32) / (THUMBNAIL_SIZE[0] * THUMBNAIL_SIZE[1])
+    distance = np.zeros(len(h), np.float32)
+    # L1 distance of each channel is at most 2
+    distance[1:] = np.abs(h[1:] - h[:-1]).sum(axis=1) / 6
+    valid = np.zeros(len(h), bool)
+    valid[1:] = done[1:] & done[:-1]
+    candidates = np.flatnonzero(valid & (distance > threshold) & (diff > diff_threshold))
+
+    # flashes and fast motion give bursts of candidates, only the strongest one is kept
+    cuts = []
+    for candidate in candidates:
+        if len(cuts) > 0 and candidate - cuts[-1] < min_gap:
+            if distance[candidate] > distance[cuts[-1]]:
+                cuts[-1] = candidate
+        else:
+            cuts.append(candidate)
+    return np.array(cuts, np.int64)
+
+
+def analyze_chunk(video, task, cancelled):
+    start = task['start']
+    first = max(start - 1, 0)
+    video.seek(first)
+    thumbnails = []
+    for _ in range(first, task['end']):
+        if cancelled.value > task['generation']:
+            return None
+        check, frame = video.read()
+        if not check:
+            break
+        thumbnails.append(cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA))
+    if len(thumbnails) == 0:
+        return np.zeros((0, BINS * 3), np.uint16), np.zeros(0, np.float32)
+
+    thumbnails = np.stack(thumbnails)
+    diff = differences(thumbnails)
+    if start == 0:
+        diff = np.concatenate([np.zeros(1, np.float32), diff])
+    else:
+        thumbnails = thumbnails[1:]
+    return histograms(thumbnails), diff
+
+
+def analyzer(tasks: Queue, results: Queue, cancelled: Value):
+    logger = logging.getLogger('SceneDetector')
+    filename = None
+    video = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        if cancelled.value > task['generation']:
+            continue
+        try:
+            if task['filename'] != filename:
+                if video is not None:
+                    video.release()
+                filename = task['filename']
+                video = open_source(filename, count_frames=False)
+            start_time = time.time()
+            analyzed = analyze_chunk(video, task, cancelled)
+            if analyzed is not None:
+                hist, diff = analyzed
+                results.put({'action': 'chunk', 'generation': task['generation'], 'start': task['start'],
+                             'end': task['end'], 'hist': hist, 'diff': diff, 'seconds': time.time() - start_time})
+        except Exception as e:
+            logger.error(f'Error: {e}')
+            # the chunk stays undone, but the detector still counts it so it can finish
+            results.put({'action': 'chunk', 'generation': task['generation'], 'start': task['start'],
+                         'end': task['end'], 'failed': True})
+    if video is not None:
+        video.release()
+
+
+class SceneDetector(QObject):
+    logger = logging.getLogger('SceneDetector')
+
+    progress = Signal(int, int, int)
+    finished = Signal(int)
+
+    def __init__(self):
+        super(SceneDetector, self).__init__()
+        self.__tasks = None
+        self.__results = None
+        self.__cancelled = Value('i', 0)
+        self.__generation = 0
+        self.__processes = []
+        self.__lock = Lock()
+        self.__index = None
+        self.__hist = None
+        self.__diff = None
+        self.__done = None
+        self.__pending = 0
+        self.__save_time = 0
+        self.__cuts = np.zeros(0, np.int64)
+
+    @property
+    def cuts(self):
+        return self.__cuts
+
+    @property
+    def running(self):
+        return self.__pending > 0
+
+    def start(self, workers=None):
+        if len(self.__processes) == 0:
+            workers = workers or max((os.cpu_count() or 1) - 2, 1)
+            self.__tasks = Queue()
+            self.__results = Queue()
+            self.__processes = [Process(target=analyzer, args=(self.__tasks, self.__results, self.__cancelled),
+                                        daemon=True) for _ in range(workers)]
+            for process in self.__processes:
+                process.start()
+            Thread(target=self.__thread_execution, daemon=True).start()
+
+    def __thread_execution(self):
+        while True:
+            result = self.__results.get()
+            if result is None:
+                break
+            with self.__lock:
+                if result['generation'] != self.__generation:
+                    continue
+                if not result.get('failed', False):
+                    start = result['start']
+                    end = start + len(result['hist'])
+                    self.__hist[start:end] = result['hist']
+                    self.__diff[start:end] = result['diff']
+                    self.__done[start:end] = True
+                self.__pending -= 1
+                self.__update()
+                done = int(np.count_nonzero(self.__done))
+                total = len(self.__done)
+                finished = self.__pending == 0
+                if finished or time.time() - self.__save_time >= SAVE_INTERVAL:
+                    self.__save()
+            self.progress.emit(done, total, len(self.__cuts))
+            if finished:
+                self.logger.info(f'{len(self.__cuts)} scene cuts in {total} frames')
+                self.finished.emit(len(self.__cuts))
+
+    def __update(self):
+        self.__cuts = detect_cuts(self.__hist, self.__diff, self.__done)
+
+    def __save(self):
+        self.__save_time = time.time()
+        self.__index.set('scene_hist', self.__hist)
+        self.__index.set('scene_diff', self.__diff)
+        self.__index.set('scene_done', self.__done)
+        self.__index.set('scene_cuts', self.__cuts)
+        self.__index.save()
+
+    def analyze(self, filename, total_frames):
+        self.cancel()
+        generation = self.__generation
+
+        def prepare():
+            # loading the sidecar hashes the video, it is kept off the GUI thread
+            index = VideoIndex(filename)
+            hist = index.get('scene_hist')
+            diff = index.get('scene_diff')
+            done = index.get('scene_done')
+            if done is None or len(done) != total_frames:
+                hist = np.zeros((total_frames, BINS * 3), np.uint16)
+                diff = np.zeros(total_frames, np.float32)
+                done = np.zeros(total_frames, bool)
+            with self.__lock:
+                if generation != self.__generation:
+                    return
+                self.__index = index
+                self.__hist = np.array(hist)
+                self.__diff = np.array(diff)
+                self.__done = np.array(done)
+                self.__update()
+                # only the chunks left unfinished by a previous session are analyzed again
+                chunks = [(start, min(start + CHUNK_SIZE, total_frames))
+                          for start in range(0, total_frames, CHUNK_SIZE)]
+                chunks = [(start, end) for (start, end) in chunks if not self.__done[start:end].all()]
+                self.__pending = len(chunks)
+                done = int(np.count_nonzero(self.__done))
+            self.progress.emit(done, total_frames, len(self.__cuts))
+            if len(chunks) == 0:
+                self.finished.emit(len(self.__cuts))
+                return
+            self.start()
+            for (start, end) in chunks:
+                self.__tasks.put({'generation': generation, 'filename': filename, 'start': start, 'end': end})
+
+        Thread(target=prepare, daemon=True).start()
+
+    def cancel(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__cancelled.value = self.__generation
+            if self.__index is not None and self.__pending > 0:
+                self.__save()
+            self.__pending = 0
+            self.__index = None
+            self.__cuts = np.zeros(0, np.int64)
+
+    def next_cut(self, index):
+        cuts = self.__cuts
+        position = np.searchsorted(cuts, index, side='right')
+        return int(cuts[position]) if position < len(cuts) else None
+
+    def previous_cut(self, index):
+        cuts = self.__cuts
+        position = np.searchsorted(cuts, index, side='left')
+        return int(cuts[position - 1]) if position > 0 else None
+
+    def destroy(self):
+        self.cancel()
+        if len(self.__processes) > 0:
+            for _ in self.__processes:
+                self.__tasks.put(None)
+            self.__results.put(None)
+            self.__processes = []
@@ -100,6 +100,12 @@ class Shape:
         if len(self.__structure['points']) > 0:
             self.__structure['points'].pop()
 
+    def move_point(self, index, x, y):
+        self.__structure['points'][index] = (int(x), int(y))
+
+    def set_points(self, points):
+        self.__structure['points'] = [(int(x), int(y)) for (x, y) in points]
+
     @property
     def valid(self):
         return (self.max_points is None or len(self.__structure['points']) <= self.max_points) and (self.min_points is None or len(self.__structure['points']) >= self.min_points)
@@ -115,6 +121,13 @@ class Shape:
     def reset(self):
         self.__structure['points'].clear()
 
+    def copy(self):
+        # a much cheaper deepcopy, points are immutable tuples
+        shape = Shape(self.id, self.shape, self.__color, self.__last_color)
+        shape.set_points(self.points)
+        shape.message = self.message
+        return shape
+
     def to_json(self, hide_id=False, indent=2):
         structure = self.__structure.copy()
         if hide_id:
@@ -136,11 +149,13 @@ class Shape:
             return shape
         return None
 
-    def to_save_format(self, frame):
+    def to_save_format(self, frame, timestamp=None):
         structure = self.__structure.copy()
 
         del structure['id']
         if len(structure['points']) == 0:
             del structure['points']
         structure['frame'] = frame
+        if timestamp is not None:
+            structure['timestamp'] = round(timestamp, 6)
         return structure
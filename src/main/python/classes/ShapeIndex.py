@@ -0,0 +1,115 @@
+import math
+
+from classes.Shape import Shape, ShapeType
+from classes.Track import Track
+
+
+def segment_distance(x, y, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+    t = 0 if length == 0 else max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / length))
+    return math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+
+def inside_polygon(x, y, points):
+    inside = False
+    j = len(points) - 1
+    for i in range(len(points)):
+        xi, yi = points[i]
+        xj, yj = points[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def contains(shape: Shape, x, y, tolerance):
+    points = shape.points
+    if shape.shape == ShapeType.rectangle and len(points) >= 2:
+        (x1, y1), (x2, y2) = points[0], points[1]
+        return min(x1, x2) - tolerance <= x <= max(x1, x2) + tolerance and \
+            min(y1, y2) - tolerance <= y <= max(y1, y2) + tolerance
+    if shape.shape == ShapeType.ellipse and len(points) >= 2:
+        (x1, y1), (x2, y2) = points[0], points[1]
+        rx = abs(x2 - x1) / 2 + tolerance
+        ry = abs(y2 - y1) / 2 + tolerance
+        return ((x - (x1 + x2) / 2) / rx) ** 2 + ((y - (y1 + y2) / 2) / ry) ** 2 <= 1
+    if shape.shape == ShapeType.polygon and len(points) >= 3:
+        if inside_polygon(x, y, points):
+            return True
+        edges = zip(points, points[1:] + points[:1])
+        return any(segment_distance(x, y, x1, y1, x2, y2) <= tolerance for ((x1, y1), (x2, y2)) in edges)
+    if shape.shape == ShapeType.line and len(points) >= 2:
+        edges = zip(points, points[1:])
+        return any(segment_distance(x, y, x1, y1, x2, y2) <= tolerance for ((x1, y1), (x2, y2)) in edges)
+    return False
+
+
+class ShapeIndex:
+    def __init__(self, cell_size=64, tolerance=6):
+        self.__cell_size = cell_size
+        self.__tolerance = tolerance
+        # frame -> cell -> ids, and id -> (frame, cells, shape)
+        self.__grids = dict()
+        self.__entries = dict()
+        # tracks span many frames, they are tested on their interpolated shape
+        self.__tracks = dict()
+
+    def __len__(self):
+        return len(self.__entries) + len(self.__tracks)
+
+    def __cells(self, shape: Shape):
+        points = shape.points
+        if shape.shape == ShapeType.globals or len(points) == 0:
+            return []
+        xs = [x for (x, _) in points]
+        ys = [y for (_, y) in points]
+        first_x = int((min(xs) - self.__tolerance) // self.__cell_size)
+        last_x = int((max(xs) + self.__tolerance) // self.__cell_size)
+        first_y = int((min(ys) - self.__tolerance) // self.__cell_size)
+        last_y = int((max(ys) + self.__tolerance) // self.__cell_size)
+        return [(cx, cy) for cx in range(first_x, last_x + 1) for cy in range(first_y, last_y + 1)]
+
+    def add(self, frame, shape: Shape):
+        self.remove(shape.id)
+        if isinstance(shape, Track):
+            self.__tracks[shape.id] = shape
+            return
+        cells = self.__cells(shape)
+        grid = self.__grids.setdefault(frame, dict())
+        for cell in cells:
+            grid.setdefault(cell, []).append(shape.id)
+        self.__entries[shape.id] = (frame, cells, shape)
+
+    def remove(self, id):
+        self.__tracks.pop(id, None)
+        entry = self.__entries.pop(id, None)
+        if entry is not None:
+            frame, cells, _ = entry
+            grid = self.__grids[frame]
+            for cell in cells:
+                grid[cell].remove(id)
+                if len(grid[cell]) == 0:
+                    del grid[cell]
+            if len(grid) == 0:
+                del self.__grids[frame]
+
+    def clear(self):
+        self.__grids.clear()
+        self.__entries.clear()
+        self.__tracks.clear()
+
+    def query(self, frame, x, y):
+        grid = self.__grids.get(frame)
+        ids = grid.get((int(x // self.__cell_size), int(y // self.__cell_size))) if grid is not None else None
+        if ids is not None:
+            # ids are kept in insertion order, the most recently added shape is drawn on top
+            for id in reversed(ids):
+                shape = self.__entries[id][2]
+                if contains(shape, x, y, self.__tolerance):
+                    return shape
+        for track in reversed(list(self.__tracks.values())):
+            if track.covers(frame) and contains(track.shape_at(frame), x, y, self.__tolerance):
+                return track
+        return None
@@ -0,0 +1,120 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('Tiles')
+
+# frames smaller than this are processed in one call, the threads would cost more than they save
+MIN_PIXELS = 1920 * 1080 * 2
+# rows a band edge may move to fall on a whole source row when resizing
+ALIGN_SEARCH = 8
+
+
+def default_workers():
+    # the decoding thread of the reader keeps a core busy
+    return max((os.cpu_count() or 1) - 1, 1)
+
+
+class TileExecutor:
+    # splits frames into horizontal bands processed on a thread pool of its own; OpenCV releases the GIL and its
+    # own threads are disabled in the reader and player processes, so the pool size is what each process uses
+    def __init__(self, workers=None, min_pixels=MIN_PIXELS):
+        self.__workers = workers or default_workers()
+        self.__min_pixels = min_pixels
+        self.__executor = ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='Tiles') \
+            if self.__workers > 1 else None
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def tiled(self, frame: np.ndarray):
+        return self.__executor is not None and frame.shape[0] * frame.shape[1] >= self.__min_pixels
+
+    def __bands(self, rows):
+        count = min(self.__workers, rows)
+        return [(round(i * rows / count), round((i + 1) * rows / count)) for i in range(count)]
+
+    def __run(self, function, bands):
+        # the calling thread takes the first band instead of waiting
+        futures = [self.__executor.submit(function, *band) for band in bands[1:]]
+        function(*bands[0])
+        for future in futures:
+            future.result()
+
+    def map_rows(self, function, *frames, output=None):
+        # function maps bands of rows of the frames (all with the same height) to a band of the output, for
+        # operations where every output pixel only depends on the pixels at the same place; the output may be the
+        # first frame, a band returned unchanged is then not copied
+        if not self.tiled(frames[0]):
+            return function(*frames)
+        output = np.empty_like(frames[0]) if output is None else output
+
+        def process(top, bottom):
+            band = function(*[frame[top:bottom] for frame in frames])
+            if not np.may_share_memory(band, output):
+                output[top:bottom] = band
+
+        self.__run(process, self.__bands(frames[0].shape[0]))
+        return output
+
+    def cvt_color(self, frame: np.ndarray, code):
+        # not for the planar YUV layouts, their chroma rows are not next to their luma rows
+        if not self.tiled(frame):
+            return cv2.cvtColor(frame, code)
+        sample = cv2.cvtColor(frame[:1], code)
+        output = np.empty((frame.shape[0],) + sample.shape[1:], sample.dtype)
+
+        def process(top, bottom):
+            cv2.cvtColor(frame[top:bottom], code, dst=output[top:bottom])
+
+        self.__run(process, self.__bands(frame.shape[0]))
+        return output
+
+    def resize(self, frame: np.ndarray, size, interpolation=cv2.INTER_CUBIC):
+        width, height = size
+        rows = frame.shape[0]
+        # upscaled bands would need the rows of their neighbours
+        if not self.tiled(frame) or height >= rows:
+            return cv2.resize(frame, size, interpolation=interpolation)
+        scale = rows / height
+        # a band edge where the output row starts on a whole source row, every band then has the scale of the
+        # whole frame and the bands join without seams
+        edges = [0]
+        for (top, _) in self.__bands(height)[1:]:
+            candidates = range(max(top - ALIGN_SEARCH, edges[-1] + 1), min(top + ALIGN_SEARCH, height - 1) + 1)
+            if len(candidates) > 0:
+                edges.append(min(candidates, key=lambda row: abs(row * scale - round(row * scale))))
+        edges.append(height)
+        output = np.empty((height, width) + frame.shape[2:], frame.dtype)
+
+        def process(top, bottom):
+            cv2.resize(frame[int(round(top * scale)):int(round(bottom * scale))], (width, bottom - top),
+                       dst=output[top:bottom], interpolation=interpolation)
+
+        self.__run(process, list(zip(edges[:-1], edges[1:])))
+        return output
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+
+
+executor = None
+
+
+def configure(workers=None):
+    # once per process, before its frames are processed
+    global executor
+    if executor is not None:
+        executor.shutdown()
+    executor = TileExecutor(workers)
+    logger.debug(f'{executor.workers} tile workers')
+    return executor
+
+
+def get_executor() -> TileExecutor:
+    return executor if executor is not None else configure()
@@ -0,0 +1,57 @@
+import math
+
+import cv2
+import numpy as np
+
+
+def build_timestamps(filename, cancelled=None):
+    # grab() still decodes every frame, it only skips the color conversion and copy of retrieve(); the position is
+    # the presentation time of the grabbed frame
+    video = cv2.VideoCapture(filename)
+    timestamps = []
+    try:
+        while video.grab():
+            if cancelled is not None and cancelled():
+                return None
+            timestamps.append(video.get(cv2.CAP_PROP_POS_MSEC))
+    finally:
+        video.release()
+    if len(timestamps) < 2 or not any(timestamps[1:]):
+        # the backend does not report positions
+        return None
+    # a few containers report slightly out of order positions around keyframes
+    return np.maximum.accumulate(np.array(timestamps, np.float64))
+
+
+def format_seconds(seconds):
+    hours = math.floor(seconds / 60 / 60)
+    minutes = math.floor(seconds / 60) - hours * 60
+    seconds = math.floor(seconds) - hours * 60 * 60 - minutes * 60
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+
+
+class TimestampIndex:
+    def __init__(self, timestamps_ms: np.ndarray):
+        self.__timestamps = timestamps_ms / 1000
+        deltas = np.diff(self.__timestamps)
+        self.__frame_duration = float(np.median(deltas)) if len(deltas) > 0 else 0
+
+    def __len__(self):
+        return len(self.__timestamps)
+
+    @property
+    def timestamps(self):
+        return self.__timestamps
+
+    @property
+    def duration(self):
+        return float(self.__timestamps[-1]) + self.__frame_duration if len(self.__timestamps) > 0 else 0
+
+    def time(self, frame):
+        frame = max(min(frame, len(self.__timestamps) - 1), 0)
+        return float(self.__timestamps[frame])
+
+    def frame(self, seconds):
+        # the frame shown at that time: the last one starting at or before it (with some rounding slack)
+        frame = int(np.searchsorted(self.__timestamps, seconds + 0.0005, side='right')) - 1
+        return max(min(frame, len(self.__timestamps) - 1), 0)
@@ -0,0 +1,144 @@
+import ctypes
+import json
+import os
+import struct
+import threading
+import time
+from multiprocessing import RawArray, Value
+
+# records only store the id of their name, names get an id when first recorded by any process and are kept in a
+# table shared by all of them; past MAX_NAMES distinct names (or for an empty name) the id is 0, 'unknown'
+MAX_NAMES = 1024
+NAME_BYTES = 64
+UNKNOWN = 'unknown'
+
+# timestamp (us), pid, tid, phase, name, argument
+RECORD = struct.Struct('<dIIcxHq')
+
+PHASE_BEGIN = b'B'
+PHASE_END = b'E'
+PHASE_INSTANT = b'i'
+PHASE_COUNTER = b'C'
+PHASE_METADATA = b'M'
+
+
+class TraceBuffer:
+    def __init__(self, capacity=1 << 16):
+        self.__capacity = capacity
+        self.__buffer = RawArray(ctypes.c_char, capacity * RECORD.size)
+        self.__counter = Value(ctypes.c_uint64, 0)
+        self.__names = NameTable()
+
+    def recorder(self, process_name):
+        return TraceRecorder(self.__buffer, self.__counter, self.__capacity, self.__names, process_name)
+
+    def clear(self):
+        with self.__counter.get_lock():
+            self.__counter.value = 0
+
+    def records(self):
+        with self.__counter.get_lock():
+            count = self.__counter.value
+            first = max(0, count - self.__capacity)
+            data = bytes(self.__buffer)
+        records = []
+        for i in range(first, count):
+            slot = i % self.__capacity
+            records.append(RECORD.unpack_from(data, slot * RECORD.size))
+        return records
+
+    def to_chrome_trace(self):
+        names = self.__names.names()
+        events = []
+        for (ts, pid, tid, phase, name_id, arg) in sorted(self.records(), key=lambda r: r[0]):
+            phase = phase.decode()
+            name = names[name_id] if name_id < len(names) else UNKNOWN
+            if phase == 'M':
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+            elif phase == 'C':
+                events.append({'name': name, 'ph': 'C', 'ts': ts, 'pid': pid, 'tid': tid, 'args': {name: arg}})
+            else:
+                event = {'name': name, 'ph': phase, 'ts': ts, 'pid': pid, 'tid': tid, 'args': {'index': arg}}
+                if phase == 'i':
+                    event['s'] = 't'
+                events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class NameTable:
+    # append only, so the ids a process has seen stay valid and it only takes the lock for names new to it
+    def __init__(self):
+        self.__table = RawArray(ctypes.c_char, MAX_NAMES * NAME_BYTES)
+        self.__count = Value(ctypes.c_uint32, 0)
+        self.__ids = dict()
+        self.id(UNKNOWN)
+
+    def __getstate__(self):
+        # the ids known by a process are not sent to the others
+        return self.__table, self.__count
+
+    def __setstate__(self, state):
+        self.__table, self.__count = state
+        self.__ids = dict()
+
+    def __name(self, i):
+        return self.__table[i * NAME_BYTES:(i + 1) * NAME_BYTES].rstrip(b'\0').decode('utf-8', 'replace')
+
+    def id(self, name):
+        id = self.__ids.get(name)
+        if id is not None:
+            return id
+        encoded = str(name).encode()[:NAME_BYTES]
+        if len(encoded) == 0:
+            return 0
+        with self.__count.get_lock():
+            count = self.__count.value
+            id = next((i for i in range(count)
+                       if self.__table[i * NAME_BYTES:(i + 1) * NAME_BYTES].rstrip(b'\0') == encoded), None)
+            if id is None:
+                if count == MAX_NAMES:
+                    return 0
+                id = count
+                self.__table[id * NAME_BYTES:id * NAME_BYTES + len(encoded)] = encoded
+                self.__count.value = count + 1
+        self.__ids[name] = id
+        return id
+
+    def names(self):
+        with self.__count.get_lock():
+            return [self.__name(i) for i in range(self.__count.value)]
+
+
+class TraceRecorder:
+    def __init__(self, buffer, counter, capacity, names, process_name):
+        self.__buffer = buffer
+        self.__counter = counter
+        self.__capacity = capacity
+        self.__names = names
+        self.__pid = os.getpid()
+        self.__write(PHASE_METADATA, process_name, 0)
+
+    def __write(self, phase, name, arg):
+        record = RECORD.pack(time.time() * 1000000, self.__pid, threading.get_ident() & 0xffffffff, phase,
+                             self.__names.id(name), int(arg) if arg is not None else -1)
+        with self.__counter.get_lock():
+            slot = self.__counter.value % self.__capacity
+            self.__counter.value += 1
+        offset = slot * RECORD.size
+        self.__buffer[offset:offset + RECORD.size] = record
+
+    def begin(self, name, arg=None):
+        self.__write(PHASE_BEGIN, name, arg)
+
+    def end(self, name, arg=None):
+        self.__write(PHASE_END, name, arg)
+
+    def instant(self, name, arg=None):
+        self.__write(PHASE_INSTANT, name, arg)
+
+    def counter(self, name, value):
+        self.__write(PHASE_COUNTER, name, value)
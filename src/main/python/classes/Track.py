@@ -0,0 +1,210 @@
+import uuid
+
+import numpy as np
+
+from classes.Shape import Shape, ShapeType
+
+# shapes whose points can be interpolated between keyframes
+TRACKABLE = (ShapeType.rectangle, ShapeType.ellipse, ShapeType.polygon, ShapeType.line)
+
+
+class Track:
+    # a shape moving over a range of frames: only its keyframes are stored, the points of the frames in between
+    # are linearly interpolated, vertex by vertex
+    def __init__(self, id, shape, color=(255, 0, 0), last_color=(255, 0, 0)):
+        if shape not in TRACKABLE:
+            raise ValueError(f'A {shape} cannot be tracked')
+        self.__id = id
+        self.__shape = shape
+        self.__color = color
+        self.__last_color = last_color
+        self.message = ''
+        # sorted keyframe indexes and their points, (keyframes, vertices, 2)
+        self.__frames = np.empty(0, np.int64)
+        self.__points = np.empty((0, 0, 2), np.float64)
+
+    @property
+    def id(self):
+        return self.__id
+
+    @id.setter
+    def id(self, id):
+        self.__id = id
+
+    @property
+    def shape(self):
+        return self.__shape
+
+    @property
+    def color(self):
+        return self.__color
+
+    @color.setter
+    def color(self, color):
+        self.__color = color
+
+    @property
+    def last_color(self):
+        return self.__last_color
+
+    @last_color.setter
+    def last_color(self, last_color):
+        self.__last_color = last_color
+
+    @property
+    def keyframes(self):
+        return [int(frame) for frame in self.__frames]
+
+    @property
+    def first(self):
+        return int(self.__frames[0])
+
+    @property
+    def last(self):
+        return int(self.__frames[-1])
+
+    @property
+    def points(self):
+        # the points of the first keyframe, like a shape drawn on the first frame of the track
+        return [(int(x), int(y)) for (x, y) in self.__points[0]] if len(self) > 0 else []
+
+    def __len__(self):
+        return len(self.__frames)
+
+    def covers(self, frame):
+        return len(self) > 0 and self.__frames[0] <= frame <= self.__frames[-1]
+
+    def set_keyframes(self, frames, points):
+        # keyframes are replaced on the same frames, every keyframe has the same number of vertices
+        frames = np.asarray(frames, np.int64).reshape(-1)
+        points = np.asarray(points, np.float64)
+        if len(frames) == 0:
+            return
+        if points.ndim != 3 or points.shape[0] != len(frames) or points.shape[2] != 2:
+            raise ValueError('Keyframes need a list of (x, y) points per frame')
+        if len(self) > 0 and points.shape[1] != self.__points.shape[1]:
+            raise ValueError(f'Keyframes of this track have {self.__points.shape[1]} points')
+        if len(self) == 0:
+            self.__points = np.empty((0, points.shape[1], 2), np.float64)
+        kept = ~np.isin(self.__frames, frames)
+        frames, unique = np.unique(frames[::-1], return_index=True)
+        # on repeated frames the last points win
+        points = points[::-1][unique]
+        all_frames = np.concatenate([self.__frames[kept], frames])
+        order = np.argsort(all_frames, kind='stable')
+        self.__frames = all_frames[order]
+        self.__points = np.concatenate([self.__points[kept], points])[order]
+
+    def set_keyframe(self, frame, points):
+        self.set_keyframes([frame], [points])
+
+    def remove_keyframe(self, frame):
+        kept = self.__frames != frame
+        self.__frames = self.__frames[kept]
+        self.__points = self.__points[kept]
+
+    def interpolate(self, frames):
+        # points of any number of frames at once, (frames, vertices, 2); frames out of the track are clamped
+        frames = np.asarray(frames, np.float64).reshape(-1)
+        if len(self) == 1:
+            return np.repeat(self.__points, len(frames), axis=0)
+        after = np.clip(np.searchsorted(self.__frames, frames, side='right'), 1, len(self) - 1)
+        before = after - 1
+        start = self.__frames[before]
+        weights = np.clip((frames - start) / (self.__frames[after] - start), 0, 1)[:, None, None]
+        return self.__points[before] * (1 - weights) + self.__points[after] * weights
+
+    def shape_at(self, frame):
+        shape = Shape(self.__id, self.__shape, self.__color, self.__last_color)
+        shape.set_points(np.rint(self.interpolate([frame])[0]))
+        shape.message = self.message
+        return shape
+
+    def simplify(self, tolerance=1.0, fixed=()):
+        # drops the keyframes that interpolation reproduces within the tolerance, in pixels; the fixed frames (e.g.
+        # the keyframes set by the user) are always kept
+        if len(self) <= 2:
+            return
+        kept = np.isin(self.__frames, np.asarray(list(fixed), np.int64))
+        kept[[0, -1]] = True
+        indexes = np.flatnonzero(kept)
+        segments = list(zip(indexes[:-1], indexes[1:]))
+        while len(segments) > 0:
+            first, last = segments.pop()
+            if last - first < 2:
+                continue
+            span = self.__frames[last] - self.__frames[first]
+            weights = ((self.__frames[first + 1:last] - self.__frames[first]) / span)[:, None, None]
+            interpolated = self.__points[first] * (1 - weights) + self.__points[last] * weights
+            errors = np.abs(self.__points[first + 1:last] - interpolated).max(axis=(1, 2))
+            worst = int(np.argmax(errors))
+            if errors[worst] > tolerance:
+                middle = first + 1 + worst
+                kept[middle] = True
+                segments.append((first, middle))
+                segments.append((middle, last))
+        self.__frames = self.__frames[kept]
+        self.__points = self.__points[kept]
+
+    def dense(self, start=None, end=None):
+        # one annotation per frame of [start, end) in the save format, interpolated in a single pass
+        if len(self) == 0:
+            return
+        first = self.first if start is None else max(start, self.first)
+        last = self.last + 1 if end is None else min(end, self.last + 1)
+        if first >= last:
+            return
+        points = np.rint(self.interpolate(np.arange(first, last))).astype(np.int64).tolist()
+        for (frame, frame_points) in zip(range(first, last), points):
+            yield {'shape': self.__shape, 'points': frame_points, 'message': self.message, 'frame': frame}
+
+    def copy(self):
+        track = Track(self.__id, self.__shape, self.__color, self.__last_color)
+        track.message = self.message
+        track.__frames = self.__frames.copy()
+        track.__points = self.__points.copy()
+        return track
+
+    @staticmethod
+    def from_shape(frame, shape: Shape):
+        track = Track(shape.id, shape.shape, shape.color, shape.last_color)
+        track.message = shape.message
+        track.set_keyframe(frame, shape.points)
+        return track
+
+    @staticmethod
+    def from_save_format(entry, id):
+        track = Track(id, entry['shape'])
+        track.message = entry.get('message', '')
+        keyframes = entry['keyframes']
+        track.set_keyframes([k['frame'] for k in keyframes], [k['points'] for k in keyframes])
+        return track
+
+    def to_save_format(self, frame=None, timestamp=None):
+        # the frame of a track is its first keyframe
+        structure = {
+            'shape': self.__shape,
+            'message': self.message,
+            'frame': self.first,
+            'keyframes': [{'frame': frame, 'points': points}
+                          for (frame, points) in zip(self.keyframes, np.rint(self.__points).astype(np.int64).tolist())],
+        }
+        if timestamp is not None:
+            structure['timestamp'] = round(timestamp, 6)
+        return structure
+
+
+def from_save_format(entry, id=None):
+    # a shape on one frame, or a track when the entry has keyframes
+    if 'keyframes' in entry:
+        return Track.from_save_format(entry, id or uuid.uuid1().hex)
+    return Shape.from_save_format(entry)
+
+
+def dense_annotations(annotations):
+    # annotations in the save format with every track expanded to one annotation per frame
+    for entry in annotations:
+        if 'keyframes' in entry:
+            yield from Track.from_save_format(entry, None).dense()
+        else:
+            yield entry
@@ -0,0 +1,229 @@
+import logging
+import os
+import time
+import uuid
+from multiprocessing import Process, Queue, Value
+from threading import Lock, Thread
+
+import cv2
+import numpy as np
+from PySide2.QtCore import Signal, QObject
+
+from classes.FrameSource import open_source
+
+# tracking runs on a downscaled grayscale copy of the frames
+TRACKING_WIDTH = 640
+# backward tracking decodes forward in chunks of this size and walks them in reverse
+CHUNK_SIZE = 32
+BATCH_SIZE = 8
+MIN_FEATURES = 6
+
+
+def shape_mask(shape_points, width, height, padding=10):
+    x, y, w, h = cv2.boundingRect(shape_points.astype(np.float32))
+    mask = np.zeros((height, width), np.uint8)
+    cv2.rectangle(mask, (x - padding, y - padding), (x + w + padding, y + h + padding), 255, -1)
+    return mask
+
+
+def read_chunks(video, start, frames, direction):
+    if direction > 0:
+        video.seek(start)
+        for index in range(start, start + frames + 1):
+            check, frame = video.read()
+            if not check:
+                return
+            yield index, frame
+    else:
+        end = start
+        first = max(start - frames, 0)
+        while end > first:
+            begin = max(end - CHUNK_SIZE, first)
+            video.seek(begin)
+            chunk = []
+            for index in range(begin, end + 1):
+                check, frame = video.read()
+                if not check:
+                    break
+                chunk.append((index, frame))
+            if len(chunk) == 0:
+                return
+            # the last frame of a chunk is the first one of the previous chunk, it is not yielded twice
+            for index, frame in reversed(chunk if end == start else chunk[:-1]):
+                yield index, frame
+            end = begin
+
+
+def track(video, task, cancelled, results):
+    start = task['index']
+    direction = task['direction']
+    shape_points = np.array(task['points'], np.float32)
+
+    features = None
+    previous = None
+    scale = 1
+    batch = []
+    tracked = 0
+    start_time = time.time()
+    lost = False
+
+    for index, frame in read_chunks(video, start, task['frames'], direction):
+        if cancelled.value > task['generation']:
+            break
+        if previous is None:
+            scale = min(1, TRACKING_WIDTH / frame.shape[1])
+        gray = cv2.cvtColor(cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        if previous is not None:
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, gray, features, None, winSize=(21, 21),
+                                                        maxLevel=3)
+            found = status.reshape(-1) == 1
+            matrix = None
+            if np.count_nonzero(found) >= MIN_FEATURES:
+                matrix, inliers = cv2.estimateAffinePartial2D(features[found], moved[found], method=cv2.RANSAC)
+            if matrix is None:
+                lost = True
+                break
+            # the shape follows the similarity transform of the features inside it
+            shape_points = cv2.transform((shape_points * scale).reshape(-1, 1, 2), matrix).reshape(-1, 2) / scale
+            features = moved[found][inliers.reshape(-1) == 1].reshape(-1, 1, 2)
+            tracked += 1
+            batch.append((index, [(int(round(x)), int(round(y))) for (x, y) in shape_points]))
+            if len(batch) >= BATCH_SIZE:
+                results.put({'action': 'propagated', 'job': task['job'], 'shapes': batch})
+                batch = []
+        if features is None or len(features) < MIN_FEATURES * 2:
+            mask = shape_mask(shape_points * scale, gray.shape[1], gray.shape[0])
+            features = cv2.goodFeaturesToTrack(gray, maxCorners=100, qualityLevel=0.01, minDistance=5, mask=mask)
+            if features is None:
+                lost = True
+                break
+        previous = gray
+
+    if len(batch) > 0:
+        results.put({'action': 'propagated', 'job': task['job'], 'shapes': batch})
+    results.put({
+        'action': 'done',
+        'job': task['job'],
+        'direction': direction,
+        'frames': tracked,
+        'seconds': time.time() - start_time,
+        'lost': lost,
+    })
+
+
+def tracker(tasks: Queue, results: Queue, cancelled: Value):
+    logger = logging.getLogger('Tracker')
+    filename = None
+    video = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        try:
+            if task['filename'] != filename:
+                if video is not None:
+                    video.release()
+                filename = task['filename']
+                video = open_source(filename, count_frames=False)
+            track(video, task, cancelled, results)
+        except Exception as e:
+            logger.error(f'Error: {e}')
+            results.put({'action': 'done', 'job': task['job'], 'direction': task['direction'], 'frames': 0,
+                         'seconds': 0, 'lost': True})
+    if video is not None:
+        video.release()
+
+
+class Tracker(QObject):
+    logger = logging.getLogger('Tracker')
+
+    propagated = Signal(str, object)
+    finished = Signal(str, dict)
+
+    def __init__(self):
+        super(Tracker, self).__init__()
+        self.__tasks = None
+        self.__results = None
+        self.__cancelled = Value('i', 0)
+        self.__generation = 0
+        self.__processes = []
+        # jobs are updated by the results thread and cancelled from the UI thread
+        self.__jobs = dict()
+        self.__jobs_lock = Lock()
+
+    @property
+    def running(self):
+        with self.__jobs_lock:
+            return len(self.__jobs) > 0
+
+    def start(self, workers=None):
+        if len(self.__processes) == 0:
+            # the reader and the player keep their cores
+            workers = workers or max((os.cpu_count() or 1) - 2, 1)
+            self.__tasks = Queue()
+            self.__results = Queue()
+            self.__processes = [Process(target=tracker, args=(self.__tasks, self.__results, self.__cancelled),
+                                        daemon=True) for _ in range(workers)]
+            for process in self.__processes:
+                process.start()
+            Thread(target=self.__thread_execution, daemon=True).start()
+
+    def __thread_execution(self):
+        while True:
+            result = self.__results.get()
+            if result is None:
+                break
+            with self.__jobs_lock:
+                job = self.__jobs.get(result['job'])
+                if job is None:
+                    continue
+                if result['action'] == 'done':
+                    job['frames'] += result['frames']
+                    job['seconds'] += result['seconds']
+                    job['lost'] = job['lost'] or result['lost']
+                    job['pending'] -= 1
+                    if job['pending'] > 0:
+                        continue
+                    self.__jobs.pop(result['job'], None)
+            # signals are emitted without the lock, their slots may start or cancel jobs
+            if result['action'] == 'propagated':
+                self.propagated.emit(result['job'], result['shapes'])
+            elif result['action'] == 'done':
+                # each direction runs on its own core
+                fps = job['frames'] / job['seconds'] if job['seconds'] > 0 else 0
+                self.logger.info(f'Propagated {job["frames"]} frames at {fps:.1f} fps/core')
+                self.finished.emit(result['job'], {'frames': job['frames'], 'fps_per_core': fps,
+                                                   'lost': job['lost']})
+
+    def propagate(self, filename, index, points, frames, backward=True):
+        self.start()
+        job = uuid.uuid1().hex
+        directions = (1, -1) if backward else (1,)
+        with self.__jobs_lock:
+            self.__jobs[job] = {'pending': len(directions), 'frames': 0, 'seconds': 0, 'lost': False}
+        for direction in directions:
+            self.__tasks.put({
+                'job': job,
+                'generation': self.__generation,
+                'filename': filename,
+                'index': index,
+                'points': list(points),
+                'frames': frames,
+                'direction': direction,
+            })
+        return job
+
+    def cancel(self):
+        self.__generation += 1
+        self.__cancelled.value = self.__generation
+        with self.__jobs_lock:
+            self.__jobs.clear()
+
+    def destroy(self):
+        if len(self.__processes) > 0:
+            self.cancel()
+            for _ in self.__processes:
+                self.__tasks.put(None)
+            self.__results.put(None)
+            self.__processes = []
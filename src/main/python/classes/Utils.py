@@ -1,6 +1,13 @@
+from functools import lru_cache
+
 from pygments import highlight, lexers, formatters
 
+# building the lexer, the formatter and its style sheet costs more than highlighting a shape
+LEXER = lexers.JsonLexer()
+FORMATTER = formatters.HtmlFormatter()
+STYLE = '<style>' + FORMATTER.get_style_defs() + '</style>'
+
 
+@lru_cache(maxsize=64)
 def json_to_html(json):
-    return '<style>' + formatters.HtmlFormatter().get_style_defs() + '</style>' + highlight(json, lexers.JsonLexer(),
-                     formatters.HtmlFormatter())
+    return STYLE + highlight(json, LEXER, FORMATTER)
@@ -0,0 +1,96 @@
+import logging
+import os
+import tempfile
+from threading import RLock
+
+import numpy as np
+
+from classes.DiskCache import fingerprint
+
+logger = logging.getLogger('VideoIndex')
+
+# used when the sidecar can not be written next to the video (e.g. read-only media)
+FALLBACK_DIRECTORY = os.path.join(os.path.expanduser('~'), '.video-annotation', 'index')
+EXTENSION = '.vaindex.npz'
+
+
+class VideoIndex:
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__fingerprint = fingerprint(filename)
+        self.__lock = RLock()
+        self.__arrays = dict()
+        self.__dirty = False
+        self.__path = None
+
+        self.__candidates = [filename + EXTENSION, os.path.join(FALLBACK_DIRECTORY, self.__fingerprint + EXTENSION)]
+        for path in self.__candidates:
+            if os.path.exists(path):
+                try:
+                    with np.load(path) as data:
+                        if str(data['fingerprint']) == self.__fingerprint:
+                            self.__arrays = {name: data[name] for name in data.files if name != 'fingerprint'}
+                            self.__path = path
+                            break
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f'Ignoring index {path}: {e}')
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def path(self):
+        return self.__path
+
+    def __contains__(self, name):
+        with self.__lock:
+            return name in self.__arrays
+
+    def get(self, name, default=None):
+        with self.__lock:
+            return self.__arrays.get(name, default)
+
+    def set(self, name, array: np.ndarray):
+        with self.__lock:
+            self.__arrays[name] = array
+            self.__dirty = True
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+            arrays = dict(self.__arrays)
+            self.__dirty = False
+
+        paths = ([self.__path] if self.__path is not None else []) + self.__candidates
+
+        # other parts of the application may have saved their own arrays in the meantime
+        existing = next((path for path in paths if os.path.exists(path)), None)
+        if existing is not None:
+            try:
+                with np.load(existing) as data:
+                    if str(data['fingerprint']) == self.__fingerprint:
+                        for name in data.files:
+                            if name != 'fingerprint' and name not in arrays:
+                                arrays[name] = data[name]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f'Ignoring index {existing}: {e}')
+
+        for path in paths:
+            temp = None
+            try:
+                directory = os.path.dirname(os.path.abspath(path))
+                os.makedirs(directory, exist_ok=True)
+                # a temporary file of its own, several threads and processes save the index of the same video
+                with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path), suffix='.tmp',
+                                                 delete=False) as f:
+                    temp = f.name
+                    np.savez(f, fingerprint=np.array(self.__fingerprint), **arrays)
+                os.replace(temp, path)
+                self.__path = path
+                return
+            except OSError as e:
+                logger.warning(f'Can not write index {path}: {e}')
+                if temp is not None and os.path.exists(temp):
+                    os.remove(temp)
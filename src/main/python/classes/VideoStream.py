@@ -1,318 +1,492 @@
+import copy
 import logging
-import math
 import time
+from collections import deque
 from multiprocessing import Process, Pipe, connection, Queue, Lock, RLock
-from threading import Thread
+from threading import Thread, Lock as ThreadLock
 import cv2
-import numpy as np
-import qimage2ndarray
-from PySide2.QtCore import Signal, QObject
-from PySide2.QtGui import QPixmap
-from classes.Shape import Shape, ShapeType
+from PySide2.QtCore import Signal, QObject, QTimer, Qt
+from PySide2.QtGui import QGuiApplication
+from classes.DiskCache import DiskFrameCache, fingerprint
+from classes.FrameCache import CompressedFrameCache
+from classes.FrameSource import is_valid_source, source_class
+from classes.Latency import LatencyStats
+from classes.Pipeline import Pipeline
+from classes.ReadAhead import ReadAhead
+from classes.Rendering import fit_size, open_video, shape_modifier
+from classes.Shape import Shape
+from classes.Tiles import configure as configure_tiles
+from classes.Track import Track
+from classes.Timestamps import TimestampIndex, build_timestamps, format_seconds
+from classes.Trace import TraceBuffer
+from classes.VideoIndex import VideoIndex
+from classes.Viewport import ImagePyramid, Viewport, crop
 
 # fix for multiprocessing
 cv2.setNumThreads(0)
 
+# seconds the commands loop waits for a message while the pipeline is full
+PIPELINE_WAIT = 0.002
+# milliseconds without a resize before the reader renders at the new size
+RESIZE_SETTLE = 150
 
-def reader(conn_player: connection.Connection, filename, container_width, container_height, cache_dim):
+
+def reader(conn_player: connection.Connection, cache_dim, trace_buffer: TraceBuffer = None, memory_fraction=0.25,
+           compressed_codec='jpeg', tile_workers=None):
     logger = logging.getLogger('Reader')
     try:
-        terminate = False
+        # large frames are overlaid and resized in bands, on threads of this process only
+        tiles = configure_tiles(tile_workers)
+        send_lock = ThreadLock()
 
-        container_width = int(container_width)
-        container_height = int(container_height)
+        def send(message):
+            # frames are sent by the last stage of the pipeline, everything else by the commands loop
+            with send_lock:
+                conn_player.send(message)
 
-        logger.render(f'File: {filename}')
-        video = cv2.VideoCapture(filename)
-
-        video_fps = video.get(cv2.CAP_PROP_FPS)
-        video_width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        video_height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        terminate = False
+        suspended = True
+        tracer = None
+        read_ahead = ReadAhead(memory_fraction, fixed=cache_dim)
+        # second tier: recently decoded frames, compressed, so stepping around a long region skips the decoder
+        compressed_cache = CompressedFrameCache(compressed_codec) if compressed_codec else None
+        # optional third tier: display sized frames kept on disk across sessions
+        disk_cache = None
+        raw_hits = 0
+        decoded = 0
+        stats_time = 0
+
+        filename = None
+        video_fingerprint = None
+        generation = None
+        video = None
+        video_fps = None
+        video_width = 1
+        video_height = 1
+        video_total_frames = 0
+        container_width = 1
+        container_height = 1
 
         def get_resized_size():
-            video_ratio = video_width / video_height
-            w = int(min(container_width, container_height * video_ratio))
-            h = int(min(container_height, container_width / video_ratio))
-            return w, h
+            return fit_size(video_width, video_height, container_width, container_height)
 
         video_resized_width, video_resized_height = get_resized_size()
 
-        video_total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
-        video.set(cv2.CAP_PROP_POS_FRAMES, video_total_frames)
-        check = False
-        while not check:
-            check, frame = video.read()
-            if not check:
-                video_total_frames -= 1
-                video.set(cv2.CAP_PROP_POS_FRAMES, video_total_frames)
-        video.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        video_total_frames += 1
-        video_total_frames = int(video_total_frames)
-
-        assert None not in (
-        container_height, container_width, video, video_fps, video_width, video_height, video_resized_width,
-        video_resized_height, video_total_frames)
+        def open_disk_cache():
+            nonlocal video_fingerprint
+            if disk_cache is not None and filename is not None:
+                # only needed by the disk cache, it reads the file (or stats every image of a sequence)
+                if video_fingerprint is None:
+                    video_fingerprint = fingerprint(filename)
+                disk_cache.open(video_fingerprint, video_total_frames, video_resized_width, video_resized_height)
+
+        def send_read_ahead(decision):
+            if compressed_cache is not None:
+                compressed_cache.set_budget(decision['budget_bytes'] // 2)
+            send({'action': 'read_ahead', 'generation': generation, **decision})
+
+        def send_cache_stats():
+            send({
+                'action': 'cache_stats',
+                'generation': generation,
+                'raw': {'hits': raw_hits, 'frames': len(cache) + len(skip_cache)},
+                'compressed': compressed_cache.stats() if compressed_cache is not None else None,
+                'disk': disk_cache.stats() if disk_cache is not None else None,
+                'pipeline': pipeline.stats(),
+                'decoded': decoded,
+            })
 
         def send_metadata():
             metadata = {
                 'action': 'metadata',
+                'generation': generation,
+                'filename': filename,
                 'fps': video_fps,
                 'width': video_width,
                 'height': video_height,
                 'resized_width': video_resized_width,
                 'resized_height': video_resized_height,
                 'total_frames': video_total_frames,
+                'capabilities': video.capabilities,
                 'container_width': container_width,
                 'container_height': container_height,
             }
-            conn_player.send(metadata)
-
-        send_metadata()
+            send(metadata)
 
         index = 0
+        already_skipped = False
         skip_cache = dict()
         cache = dict()
         shapes = dict()
-        drawing_shapes = []
+        shape_frames = dict()
+        # id -> track, only keyframes are sent to the reader
+        tracks = dict()
+        drawing_shapes = dict()
+        shapes_seq = 0
+        shapes_resyncing = False
         highlight_shape = None
         highlight_color = None
-
-        def get_modifier(shape: Shape):
-            if highlight_shape == shape.id:
-                color = highlight_color
-                if shape.color == shape.last_color:
-                    last_color = highlight_color
-                else:
-                    last_color = shape.last_color
+        profiling = False
+        # zoomed region of the source, cropped before scaling
+        roi = None
+
+        def skip(new_index):
+            nonlocal index, skip_cache, already_skipped
+            index = new_index
+            if already_skipped:
+                skip_cache.update(cache.copy())
             else:
-                color = shape.color
-                last_color = shape.last_color
-
-            def mask_negative(frame, mask):
-                negative = frame.copy()
-                negative = cv2.bitwise_not(negative)
-                negative = cv2.bitwise_and(negative, negative, mask=mask)
-
-                mask = cv2.bitwise_not(mask)
-                frame = cv2.bitwise_and(frame, frame, mask=mask)
-                frame = cv2.bitwise_or(negative, frame)
-                return frame
-
-            def mask_opposite(frame, mask):
-                opposite = frame.copy()
-                opposite = cv2.inRange(opposite, np.array([0, 0, 0]), np.array([128, 128, 128]))
-                opposite = cv2.cvtColor(opposite, cv2.COLOR_GRAY2RGB)
-                opposite = cv2.bitwise_and(opposite, opposite, mask=mask)
-
-                mask = cv2.bitwise_not(mask)
-                frame = cv2.bitwise_and(frame, frame, mask=mask)
-                frame = cv2.bitwise_or(opposite, frame)
-
-                return frame
-
-            def negative_text(frame, text, x, y):
-                w, h, _ = frame.shape
-                mask = np.zeros((w, h), frame.dtype)
-                cv2.putText(mask, text, (x, y), cv2.FONT_HERSHEY_DUPLEX, 1.0, (255, 255, 255), 1)
-                frame = mask_opposite(frame, mask)
-
-                return frame
-
-            if shape.shape == ShapeType.globals:
-                def modifier(frame):
-                    cv2.rectangle(frame, (0, 0), (video_width, video_height), color, 3)
-                    frame = negative_text(frame, shape.message, 10, 40)
-                    return frame
-            elif shape.shape == ShapeType.pointer:
-                def modifier(frame):
-                    if len(shape.points) >= 1:
-                        x, y = shape.points[0]
-                        if None not in (x, y):
-                            w, h, _ = frame.shape
-                            mask = np.zeros((w, h), frame.dtype)
-                            cv2.line(mask, (x, 0), (x, video_height), (255, 255, 255), 3)
-                            cv2.line(mask, (0, y), (video_width, y), (255, 255, 255), 3)
-                            frame = mask_negative(frame, mask)
-                            return frame
-
-                    return frame
-            elif shape.shape == ShapeType.ellipse:
-                def modifier(frame):
-                    if len(shape.points) >= 2:
-                        x1, y1 = shape.points[0]
-                        x2, y2 = shape.points[1]
-                        if None not in (x1, y1, x2, y2):
-                            centerx = int((x1 + x2) / 2)
-                            centery = int((y1 + y2) / 2)
-                            sizex = int(abs(x1 - centerx))
-                            sizey = int(abs(y1 - centery))
-
-                            cv2.ellipse(frame, (centerx, centery), (sizex, sizey), 0, 0, 360, color, 3)
-                            frame = negative_text(frame, shape.message, centerx - sizex + 10, centery + 7)
-                    elif len(shape.points) == 1:
-                        x, y = shape.points[0]
-                        cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
-                        frame = negative_text(frame, shape.message, x + 10, y + 40)
-                    return frame
-            elif shape.shape == ShapeType.rectangle:
-                def modifier(frame):
-                    if len(shape.points) >= 2:
-                        x1, y1 = shape.points[0]
-                        x2, y2 = shape.points[1]
-                        if None not in (x1, y1, x2, y2):
-                            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
-                        frame = negative_text(frame, shape.message, min(x1, x2) + 10, min(y1, y2) + 40)
-                    elif len(shape.points) == 1:
-                        x, y = shape.points[0]
-                        cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
-                        frame = negative_text(frame, shape.message, x + 10, y + 40)
-                    return frame
-            elif shape.shape == ShapeType.polygon:
-                def modifier(frame):
-                    if len(shape.points) > 1:
-                        for i, p in enumerate(shape.points):
-                            x1, y1 = shape.points[i]
-                            if i == len(shape.points) - 1:
-                                c = last_color
-                                x2, y2 = shape.points[0]
-                            else:
-                                c = color
-                                x2, y2 = shape.points[i + 1]
-
-                            cv2.line(frame, (x1, y1), (x2, y2), c, 3)
-                        xt, yt = shape.points[0]
-                        frame = negative_text(frame, shape.message, xt + 10, yt + 40)
-                    elif len(shape.points) == 1:
-                        x, y = shape.points[0]
-                        cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
-                        frame = negative_text(frame, shape.message, x + 10, y + 40)
-                    return frame
-            elif shape.shape == ShapeType.line:
-                def modifier(frame):
-                    if len(shape.points) > 1:
-                        for i, p in enumerate(shape.points):
-                            if i < len(shape.points) - 1:
-                                x1, y1 = shape.points[i]
-                                if i == len(shape.points) - 2:
-                                    c = last_color
-                                else:
-                                    c = color
-                                x2, y2 = shape.points[i + 1]
-
-                                cv2.line(frame, (x1, y1), (x2, y2), c, 3)
-                        xt, yt = shape.points[0]
-                        frame = negative_text(frame, shape.message, xt + 10, yt + 40)
-                    elif len(shape.points) == 1:
-                        x, y = shape.points[0]
-                        cv2.ellipse(frame, (x, y), (2, 2), 0, 0, 360, color, 3)
-                        frame = negative_text(frame, shape.message, x + 10, y + 40)
-                    return frame
+                skip_cache = cache.copy()
+            cache.clear()
+            already_skipped = True
+
+        def put_shape(shape_index, shape: Shape):
+            remove_shape(shape.id)
+            if isinstance(shape, Track):
+                tracks[shape.id] = shape
+                return
+            if shape_index not in shapes:
+                shapes[shape_index] = dict()
+            shapes[shape_index][shape.id] = shape
+            shape_frames[shape.id] = shape_index
+
+        def remove_shape(id):
+            tracks.pop(id, None)
+            if id in shape_frames:
+                shape_index = shape_frames.pop(id)
+                del shapes[shape_index][id]
+                if len(shapes[shape_index]) == 0:
+                    del shapes[shape_index]
+
+        def find_shape(target, id):
+            if target == 'drawing':
+                return drawing_shapes.get(id)
+            if id in shape_frames:
+                return shapes[shape_frames[id]][id]
+            return None
+
+        def apply_shapes_delta(delta):
+            target = delta['target']
+            op = delta['op']
+            if op == 'add_batch':
+                for (shape_index, shape) in delta['shapes']:
+                    put_shape(shape_index, shape)
+            elif op == 'add':
+                if target == 'drawing':
+                    drawing_shapes[delta['shape'].id] = delta['shape']
+                else:
+                    put_shape(delta['index'], delta['shape'])
+            elif op == 'remove':
+                if target == 'drawing':
+                    drawing_shapes.pop(delta['id'], None)
+                else:
+                    remove_shape(delta['id'])
+            elif op == 'clear':
+                if target == 'drawing':
+                    drawing_shapes.clear()
+                else:
+                    shapes.clear()
+                    shape_frames.clear()
+                    tracks.clear()
             else:
-                def modifier(frame):
-                    return frame
+                shape = find_shape(target, delta['id'])
+                if shape is None:
+                    logger.warning(f'Shapes delta for unknown shape: {delta["id"]}')
+                elif op == 'add_point':
+                    shape.add_point(*delta['point'])
+                elif op == 'move_point':
+                    shape.move_point(delta['point_index'], *delta['point'])
+                elif op == 'set_points':
+                    shape.set_points(delta['points'])
+                elif op == 'set_message':
+                    shape.message = delta['message']
+
+        def frame_shapes(shape_index):
+            # the shapes of a frame, the tracks covering it interpolated at the frame and the ones being drawn
+            drawn = list(shapes[shape_index].values()) if shape_index in shapes else []
+            drawn.extend(track.shape_at(shape_index) for track in tracks.values() if track.covers(shape_index))
+            drawn.extend(drawing_shapes.values())
+            return drawn
 
-                logger.warning(f'Unknown shape while trying to add a new modifier: {shape.shape}')
-            return modifier
+        def get_modifier(shape: Shape):
+            return shape_modifier(shape, video_width, video_height, highlight_shape, highlight_color)
+
+        # a decoded frame goes through overlay -> resize -> send on their own threads, while this one handles
+        # commands and decodes the next frames; a job carries everything its stages need so they never read
+        # the state changed here
+        def overlay_stage(job):
+            tracer, index, timings = job['tracer'], job['index'], job['timings']
+            if job['error'] is None and len(job['shapes']) > 0:
+                if tracer is not None:
+                    tracer.begin('overlay', index)
+                frame = job['frame']
+                for s in job['shapes']:
+                    frame = shape_modifier(s, *job['video_size'], *job['highlight'])(frame)
+                job['frame'] = frame
+                if tracer is not None:
+                    tracer.end('overlay', index)
+            if timings is not None:
+                timings.append(('reader.overlay', time.time()))
+            return job
+
+        def resize_stage(job):
+            tracer, index, timings = job['tracer'], job['index'], job['timings']
+            # frames from disk are already at display size
+            if job['error'] is None and job['size'] is not None:
+                if tracer is not None:
+                    tracer.begin('resize', index)
+                job['frame'] = tiles.resize(crop(job['frame'], job['roi']), job['size'], interpolation=cv2.INTER_CUBIC)
+                if tracer is not None:
+                    tracer.end('resize', index)
+                if job['disk_cache'] is not None:
+                    job['disk_cache'].put(index, job['frame'])
+            if timings is not None:
+                timings.append(('reader.resize', time.time()))
+            return job
+
+        def send_stage(job):
+            tracer, index = job['tracer'], job['index']
+            if tracer is not None:
+                tracer.begin('send', index)
+            # a frame that could not be rendered is sent empty, the player moves past it like a shown frame
+            send({
+                'action': 'frame',
+                'generation': job['generation'],
+                'frame': job['frame'] if job['error'] is None else None,
+                'error': job['error'],
+                'index': index,
+                'timings': job['timings'],
+            })
+            if tracer is not None:
+                tracer.end('send', index)
+
+        # indexes of the frames a stage failed on, dropped from the read-ahead by the commands loop
+        failed_indexes = deque()
+
+        def failed(job, error):
+            failed_indexes.append(job['index'])
+            job['error'] = str(error)
+            return job
+
+        pipeline = Pipeline([('overlay', overlay_stage), ('resize', resize_stage), ('send', send_stage)],
+                            failed=failed)
+
+        def drop_failed():
+            while len(failed_indexes) > 0:
+                cache.pop(failed_indexes.popleft(), None)
 
         while not terminate:
             already_skipped = False
-            while not terminate and (conn_player.poll() or len(cache) >= cache_dim):
+            drop_failed()
+            while not terminate and (conn_player.poll() or suspended or len(cache) >= read_ahead.size or
+                                     pipeline.full):
+                if not suspended and len(cache) < read_ahead.size and not conn_player.poll(PIPELINE_WAIT):
+                    # only waiting for the pipeline to make room
+                    continue
                 player_action = conn_player.recv()
-                logger.render(f'Action player -> reader: {player_action}')
+                if tracer is not None:
+                    tracer.instant(player_action['action'], player_action.get('index', player_action.get('seq')))
                 if player_action['action'] == 'END':
                     terminate = True
+                elif player_action['action'] == 'open':
+                    if player_action['filename'] != filename:
+                        # a new source: everything cached belongs to the previous one
+                        if video is not None:
+                            video.release()
+                        filename = player_action['filename']
+                        video, video_fps, video_width, video_height, video_total_frames = open_video(filename)
+                        video_fingerprint = None
+                        read_ahead.configure(video_width, video_height, video_fps)
+                        if compressed_cache is not None:
+                            compressed_cache.clear()
+                        raw_hits = 0
+                        decoded = 0
+                        cache.clear()
+                        skip_cache.clear()
+                        shapes.clear()
+                        shape_frames.clear()
+                        tracks.clear()
+                        drawing_shapes.clear()
+                        highlight_shape = None
+                        roi = None
+                    generation = player_action['generation']
+                    container_width = player_action['width']
+                    container_height = player_action['height']
+                    video_resized_width, video_resized_height = get_resized_size()
+                    open_disk_cache()
+                    send_metadata()
+                    send_read_ahead(read_ahead.update(force=True))
+                    skip(player_action['index'])
+                    suspended = False
+                elif player_action['action'] == 'suspend':
+                    suspended = True
+                    if disk_cache is not None:
+                        disk_cache.close()
                 elif player_action['action'] == 'resize':
                     container_width = player_action['width']
                     container_height = player_action['height']
                     video_resized_width, video_resized_height = get_resized_size()
+                    open_disk_cache()
                     send_metadata()
                 elif player_action['action'] == 'skip_to':
-                    index = player_action['index']
-                    if already_skipped:
-                        skip_cache.update(cache.copy())
-                    else:
-                        skip_cache = cache.copy()
-                    cache.clear()
-                    logger.render(f'Cached for skip: {skip_cache.keys()}')
-                    already_skipped = True
+                    skip(player_action['index'])
                 elif player_action['action'] == 'gc':
                     if player_action['index'] in cache:
                         del cache[player_action['index']]
-                elif player_action['action'] == 'set_shapes':
-                    shapes.clear()
-                    new_shapes = player_action['shapes']
-                    for (index, shape) in new_shapes:
-                        if index not in shapes:
-                            shapes[index] = []
-                        # for k in shapes:
-                        #     shapes[k] = [m for m in shapes[k] if m.id != shape.id]
-                        shapes[index].append(shape)
-                elif player_action['action'] == 'add_shape':
-                    index = player_action['index']
-                    if index not in shapes:
-                        shapes[index] = []
-                    for k in shapes:
-                        shapes[k] = [m for m in shapes[k] if m.id != player_action['shape'].id]
-                    shapes[index].append(player_action['shape'])
-                elif player_action['action'] == 'remove_shape':
-                    for k in shapes:
-                        shapes[k] = [m for m in shapes[k] if m.id != player_action['id']]
-                elif player_action['action'] == 'clear_shapes':
-                    shapes.clear()
+                elif player_action['action'] == 'shapes_snapshot':
+                    if player_action['seq'] > shapes_seq:
+                        shapes_seq = player_action['seq']
+                        shapes_resyncing = False
+                        shapes.clear()
+                        shape_frames.clear()
+                        tracks.clear()
+                        for (shape_index, shape) in player_action['shapes']:
+                            put_shape(shape_index, shape)
+                        drawing_shapes.clear()
+                        for shape in player_action['drawing_shapes']:
+                            drawing_shapes[shape.id] = shape
+                elif player_action['action'] == 'shapes_delta':
+                    if shapes_resyncing or player_action['seq'] <= shapes_seq:
+                        logger.render(f'Ignoring shapes delta {player_action["seq"]} (at {shapes_seq})')
+                    elif player_action['seq'] > shapes_seq + 1:
+                        logger.warning(f'Shapes delta gap: wanted {shapes_seq + 1}, got {player_action["seq"]}')
+                        shapes_resyncing = True
+                        send({'action': 'resync_shapes', 'generation': generation, 'seq': shapes_seq})
+                    else:
+                        shapes_seq = player_action['seq']
+                        apply_shapes_delta(player_action)
                 elif player_action['action'] == 'highlight_shape':
                     highlight_shape = player_action['id']
                     highlight_color = player_action['color']
-                elif player_action['action'] == 'add_drawing_shape':
-                    drawing_shapes = [m for m in drawing_shapes if m.id != player_action['shape'].id]
-                    drawing_shapes.append(player_action['shape'])
-                elif player_action['action'] == 'remove_drawing_shape':
-                    drawing_shapes = [m for m in drawing_shapes if m.id != player_action['id']]
-                elif player_action['action'] == 'clear_drawing_shapes':
-                    drawing_shapes.clear()
-
-            if not terminate and len(cache) < cache_dim:
-                if index in skip_cache:
+                elif player_action['action'] == 'viewport':
+                    roi = player_action['roi']
+                elif player_action['action'] == 'still':
+                    # the full resolution frame, for zooming in the paused video without waiting for the reader
+                    still = cache.get(player_action['index'])
+                    if still is None:
+                        still = skip_cache.get(player_action['index'])
+                    if still is None and compressed_cache is not None:
+                        still = compressed_cache.get(player_action['index'])
+                    if still is not None:
+                        still = still.copy()
+                        for s in frame_shapes(player_action['index']):
+                            still = get_modifier(s)(still)
+                        send({'action': 'still', 'generation': generation, 'index': player_action['index'],
+                                          'frame': still})
+                elif player_action['action'] == 'profile':
+                    profiling = player_action['enabled']
+                elif player_action['action'] == 'trace':
+                    tracer = trace_buffer.recorder('Reader') if player_action['enabled'] and trace_buffer else None
+                elif player_action['action'] == 'disk_cache':
+                    if disk_cache is not None:
+                        disk_cache.shutdown()
+                        disk_cache = None
+                    if player_action['enabled']:
+                        disk_cache = DiskFrameCache(player_action['directory'], player_action['budget_bytes'])
+                        if not suspended:
+                            open_disk_cache()
+
+            if not terminate and not suspended and len(cache) < read_ahead.size and not pipeline.full:
+                timings = [('reader.start', time.time())] if profiling else None
+                if tracer is not None:
+                    tracer.begin('decode', index)
+                from_decoder = False
+                from_disk = False
+                overlaid = index in shapes or len(drawing_shapes) > 0 or \
+                    any(track.covers(index) for track in tracks.values())
+                # the disk cache only holds whole, display sized frames without annotations
+                cacheable = not overlaid and roi is None
+                if disk_cache is not None and cacheable:
+                    frame = disk_cache.get(index)
+                    from_disk = frame is not None
+                if from_disk:
+                    check = True
+                elif skip_cache.get(index) is not None:
                     check = True
                     frame = skip_cache[index]
+                    raw_hits += 1
                 else:
-                    video_index = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+                    frame = compressed_cache.get(index) if compressed_cache is not None else None
+                    check = frame is not None
+                if not check:
+                    video_index = video.position
                     if index != video_index:
-                        logger.render(f'Misalignment: wanted {index}, seek at {video_index}')
-                        video.set(cv2.CAP_PROP_POS_FRAMES, index)
+                        if tracer is not None:
+                            tracer.instant('seek', video_index)
+                        video.seek(index)
+                    decode_start = time.time()
                     check, frame = video.read()
+                    read_ahead.add_decode_time(time.time() - decode_start)
+                    from_decoder = True
+                    decoded += 1
+                if tracer is not None:
+                    tracer.end('decode', index)
 
                 if check:
-                    cache[index] = frame.copy()
-
-                    if index in shapes:
-                        for s in shapes[index]:
-                            frame = get_modifier(s)(frame)
-                    for s in drawing_shapes:
-                        frame = get_modifier(s)(frame)
-
-                    frame = cv2.resize(frame, (video_resized_width, video_resized_height),
-                                       interpolation=cv2.INTER_CUBIC)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-                    conn_player.send({
-                        'action': 'frame',
-                        'frame': frame,
+                    if timings is not None:
+                        timings.append(('reader.decode', time.time()))
+                    # frames from disk are already at display size, they only hold a place in the read-ahead
+                    cache[index] = None if from_disk else frame
+                    # frames of random access sources cost no decoding to read again
+                    if from_decoder and compressed_cache is not None and not video.capabilities['random_access']:
+                        compressed_cache.put(index, frame)
+                    if tracer is not None:
+                        tracer.counter('cache', len(cache))
+
+                    # shapes are copied, they keep changing here while the frame is drawn
+                    drawn = [] if from_disk else [s.copy() for s in frame_shapes(index)]
+                    pipeline.put({
                         'index': index,
+                        'generation': generation,
+                        # the cached frame stays clean, the overlays are drawn on a copy
+                        'frame': frame.copy() if len(drawn) > 0 else frame,
+                        'shapes': drawn,
+                        'highlight': (highlight_shape, highlight_color),
+                        'video_size': (video_width, video_height),
+                        'roi': roi,
+                        'size': None if from_disk else (video_resized_width, video_resized_height),
+                        'disk_cache': disk_cache if cacheable else None,
+                        'timings': timings,
+                        'tracer': tracer,
+                        'error': None,
                     })
+                    if tracer is not None:
+                        for (name, depth) in pipeline.depths():
+                            tracer.counter(f'{name}_queue', depth)
 
-                    # logger.render(f'Frame {index} cached ({len(cache)})')
                     index += 1
 
-        conn_player.send({'action': 'ENDED'})
+                    read_ahead_decision = read_ahead.update()
+                    if read_ahead_decision is not None:
+                        if read_ahead_decision['pressure']:
+                            skip_cache.clear()
+                        send_read_ahead(read_ahead_decision)
+                    if time.time() - stats_time >= 2:
+                        stats_time = time.time()
+                        send_cache_stats()
+
+        pipeline.close()
+        if video is not None:
+            video.release()
+        if compressed_cache is not None:
+            compressed_cache.shutdown()
+        if disk_cache is not None:
+            disk_cache.shutdown()
+        send({'action': 'ENDED'})
         conn_player.close()
     except Exception as e:
         logger.error(f'Error: {e}')
 
 
-def player(conn_reader: connection.Connection, conn_ui: connection.Connection, conn_command: connection.Connection):
+def player(conns_reader: [connection.Connection], conn_ui: connection.Connection,
+           conn_command: connection.Connection, trace_buffer: TraceBuffer = None):
     logger = logging.getLogger('Player')
     try:
         terminate = False
+        tracer = None
+
+        conn_reader = None
+        generation = None
 
         cache = []
         render_time = 0
@@ -322,23 +496,10 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
         skipping = False
         speed = 1
         fps = None
-        width = None
-        height = None
-        total_frames = None
-
-        while not terminate:
-            action = conn_reader.recv()
-            if action['action'] == 'metadata':
-                fps = action['fps']
-                width = action['width']
-                height = action['height']
-                total_frames = action['total_frames']
-
-                conn_ui.send(action)
-                break
-        assert None not in (fps, width, height, total_frames)
 
         def get_interval():
+            if fps is None:
+                return 0.016
             i = 1.0 / (fps * speed)
             return 0.016 if i < 0.016 else i
 
@@ -346,22 +507,37 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
         assert interval is not None
 
         while not terminate:
-            while not terminate and conn_reader.poll():
-                action = conn_reader.recv()
-
-                tmp = action.copy()
-                if 'frame' in tmp:
-                    del tmp['frame']
-                logger.player(f'Action reader -> player: {tmp}')
-
-                if action['action'] == 'frame':
-                    cache.append(action)
-                elif action['action'] == 'metadata':
-                    conn_ui.send(action)
+            for conn in conns_reader:
+                while not terminate and conn.poll():
+                    action = conn.recv()
+                    if tracer is not None:
+                        tracer.instant(action['action'], action.get('index'))
+
+                    # leftovers of a suspended worker or of a previous source
+                    if conn is not conn_reader or action['generation'] != generation:
+                        continue
+
+                    if action['action'] == 'frame':
+                        if action['timings'] is not None:
+                            action['timings'].append(('pipe.reader_player', time.time()))
+                        cache.append(action)
+                    elif action['action'] == 'metadata':
+                        fps = action['fps']
+                        interval = get_interval()
+                        conn_ui.send(action)
+                    elif action['action'] == 'resync_shapes':
+                        conn_ui.send(action)
+                    elif action['action'] == 'read_ahead':
+                        conn_ui.send(action)
+                    elif action['action'] == 'cache_stats':
+                        conn_ui.send(action)
+                    elif action['action'] == 'still':
+                        conn_ui.send(action)
 
             while not terminate and conn_command.poll():
                 action = conn_command.recv()
-                logger.player(f'Action command -> player: {action}')
+                if tracer is not None:
+                    tracer.instant(action['action'], action.get('index'))
                 if action['action'] == 'pause':
                     playing = False
                 elif action['action'] == 'play':
@@ -371,6 +547,42 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
                     interval = get_interval()
                     logger.player(f'Speed: {speed}')
                     logger.player(f'Interval: {interval}')
+                elif action['action'] == 'open':
+                    new_conn_reader = conns_reader[action['worker']]
+                    if conn_reader is not None and conn_reader is not new_conn_reader:
+                        conn_reader.send({'action': 'suspend'})
+                    conn_reader = new_conn_reader
+                    generation = action['generation']
+                    fps = None
+                    conn_reader.send({
+                        'action': 'open',
+                        'generation': generation,
+                        'filename': action['filename'],
+                        'width': action['width'],
+                        'height': action['height'],
+                        'index': action['index'],
+                    })
+                    render_time = 0
+                    current_index = action['index']
+                    cache.clear()
+                    skipping = True
+                elif action['action'] == 'profile':
+                    for conn in conns_reader:
+                        conn.send(action)
+                elif action['action'] == 'disk_cache':
+                    for conn in conns_reader:
+                        conn.send(action)
+                elif action['action'] == 'trace':
+                    tracer = trace_buffer.recorder('Player') if action['enabled'] and trace_buffer else None
+                    for conn in conns_reader:
+                        conn.send(action)
+                elif action['action'] == 'END':
+                    for conn in conns_reader:
+                        conn.send({'action': 'END'})
+                    conn_ui.send({'action': 'END'})
+                    terminate = True
+                elif conn_reader is None:
+                    logger.warning(f'No video opened, ignoring: {action["action"]}')
                 elif action['action'] == 'resize':
                     conn_reader.send(action)
                 elif action['action'] == 'skip_to':
@@ -389,26 +601,16 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
                     })
                     render_time = 0
                     cache.clear()
-                elif action['action'] == 'add_shape':
+                elif action['action'] == 'shapes_delta':
                     conn_reader.send(action)
-                elif action['action'] == 'remove_shape':
-                    conn_reader.send(action)
-                elif action['action'] == 'set_shapes':
-                    conn_reader.send(action)
-                elif action['action'] == 'clear_shapes':
+                elif action['action'] == 'shapes_snapshot':
                     conn_reader.send(action)
                 elif action['action'] == 'highlight_shape':
                     conn_reader.send(action)
-                elif action['action'] == 'add_drawing_shape':
-                    conn_reader.send(action)
-                elif action['action'] == 'remove_drawing_shape':
+                elif action['action'] == 'viewport':
                     conn_reader.send(action)
-                elif action['action'] == 'clear_drawing_shapes':
+                elif action['action'] == 'still':
                     conn_reader.send(action)
-                elif action['action'] == 'END':
-                    conn_reader.send({'action': 'END'})
-                    conn_ui.send({'action': 'END'})
-                    terminate = True
 
             # refresh
             if not terminate:
@@ -417,6 +619,11 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
                     skipping = False
                     cache = cache[last_index_with_current_index:]
                     cached = cache.pop(0)
+                    if cached['timings'] is not None:
+                        cached['timings'].append(('player.wait', time.time()))
+                    if tracer is not None:
+                        tracer.instant('send', cached['index'])
+                        tracer.counter('cache', len(cache))
                     conn_ui.send(cached)
 
             if not terminate and len(cache) > 0 and (skipping or (playing and time.time() - render_time >= interval)):
@@ -429,19 +636,25 @@ def player(conn_reader: connection.Connection, conn_ui: connection.Connection, c
                             'action': 'gc',
                             'index': current_index,
                         })
+                    if cached['timings'] is not None:
+                        cached['timings'].append(('player.wait', time.time()))
+                    if tracer is not None:
+                        tracer.instant('send', cached['index'])
+                        tracer.counter('cache', len(cache))
                     conn_ui.send(cached)
                     current_index = cached['index']
 
-        while True:
-            action = conn_reader.recv()
-            if action['action'] == 'ENDED':
-                logger.player(f'Action reader -> player: {action}')
-                break
+        for conn in conns_reader:
+            while True:
+                action = conn.recv()
+                if action['action'] == 'ENDED':
+                    logger.player(f'Action reader -> player: {action}')
+                    break
+            conn.close()
         conn_ui.send({'action': 'ENDED'})
 
         conn_ui.close()
         conn_command.close()
-        conn_reader.close()
     except Exception as e:
         logger.error(e)
 
@@ -452,28 +665,18 @@ class VideoStream(QObject):
     @staticmethod
     def check_valid_video_file(filename):
         try:
-            video = cv2.VideoCapture(filename)
-            if not video.isOpened():
-                return False
-            frame_count = video.get(cv2.CAP_PROP_FRAME_COUNT)
-            if frame_count > 0:
-                return True
-            return False
-        except cv2.error as e:
-            return False
+            return is_valid_source(filename)
         except Exception as e:
             return False
 
     @staticmethod
     def index_to_formatted_time(frame, fps):
-        hours = math.floor(frame / fps / 60 / 60)
-        minutes = math.floor(frame / fps / 60) - hours * 60
-        seconds = math.floor(frame / fps) - hours * 60 * 60 - minutes * 60
-        return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+        return format_seconds(frame / fps)
 
-    draw_frame_signal = Signal(QPixmap, int, int, str, str, bool)
+    draw_frame_signal = Signal(object, int, int, str, str, bool)
     destroyed = Signal()
-    container_resized_signal = Signal(QPixmap, int)
+    opened = Signal(str, float)
+    resync_shapes_signal = Signal()
 
     def __init__(self):
         super(VideoStream, self).__init__()
@@ -488,7 +691,44 @@ class VideoStream(QObject):
         self.__playing = False
         self.__current_frame = 0
         self.__total_frames = 0
+        # what the frame source of the video can do, e.g. seek exactly or report timestamps
+        self.__capabilities = dict()
         self.__commands_pipe: connection.Connection = None
+        self.__shapes_seq = 0
+        self.__profiling = False
+        self.__trace_buffer = TraceBuffer()
+        self.__tracer = None
+        self.__mailbox = None
+        self.__mailbox_lock = ThreadLock()
+        self.__dropped_frames = 0
+        self.__mailbox_timer = QTimer(self)
+        self.__mailbox_timer.setTimerType(Qt.PreciseTimer)
+        self.__mailbox_timer.timeout.connect(self.__drain_mailbox)
+        # while the container is being resized the UI scales the frames it has, the reader only renders again
+        # once the size settles
+        self.__resize_pending = False
+        self.__resize_timer = QTimer(self)
+        self.__resize_timer.setSingleShot(True)
+        self.__resize_timer.setInterval(RESIZE_SETTLE)
+        self.__resize_timer.timeout.connect(self.__resize_settled)
+        self.__viewport = Viewport()
+        # the paused frame at full resolution, zoom steps are shown from it before the reader catches up
+        self.__pyramid = None
+        self.__filename = None
+        self.__generation = 0
+        self.__open_time = None
+        self.__workers = []
+        self.__workers_used = []
+        self.__positions = dict()
+        self.__timestamp_indexes = dict()
+        self.__timestamps: TimestampIndex = None
+        self.__read_ahead = None
+        self.__cache_stats = None
+        self.__pending_timings = dict()
+        self.latency = LatencyStats()
+        self.__synced_shapes = dict()
+        self.__synced_drawing_shapes = dict()
+        self.resync_shapes_signal.connect(self.resync_shapes)
 
     @property
     def is_destroyed(self):
@@ -512,20 +752,95 @@ class VideoStream(QObject):
 
     @property
     def current_timestamp(self):
-        return self.index_to_formatted_time(self.current_frame, self.fps)
+        return format_seconds(self.index_to_time(self.current_frame))
 
     @property
     def total_frames(self):
         return self.__total_frames
 
+    @property
+    def capabilities(self):
+        return self.__capabilities
+
     @property
     def total_timestamp(self):
-        return self.index_to_formatted_time(self.__total_frames, self.fps)
+        timestamps = self.__timestamps
+        if timestamps is not None:
+            return format_seconds(timestamps.duration)
+        return format_seconds(self.__total_frames / self.fps if self.fps else 0)
+
+    @property
+    def timestamps(self):
+        return self.__timestamps
+
+    def index_to_time(self, index):
+        # presentation time in seconds, exact for variable frame rate videos once the index is built
+        timestamps = self.__timestamps
+        if timestamps is not None:
+            return timestamps.time(index)
+        return index / self.fps if self.fps else 0
+
+    def time_to_index(self, seconds):
+        timestamps = self.__timestamps
+        if timestamps is not None:
+            return timestamps.frame(seconds)
+        return int(seconds * self.fps)
 
     @property
     def playing(self):
         return self.__playing
 
+    @property
+    def profiling(self):
+        return self.__profiling
+
+    @property
+    def tracing(self):
+        return self.__tracer is not None
+
+    @property
+    def dropped_frames(self):
+        return self.__dropped_frames
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def read_ahead(self):
+        return self.__read_ahead
+
+    @property
+    def resized_size(self):
+        # the size frames are displayed at, frames of another size are scaled to it
+        return self.__resized_width, self.__resized_height
+
+    @property
+    def cache_stats(self):
+        return self.__cache_stats
+
+    def __post_frame(self, frame, index, timings):
+        with self.__mailbox_lock:
+            dropped = self.__mailbox
+            self.__mailbox = (frame, index, self.total_frames, self.current_timestamp, self.total_timestamp,
+                              self.playing)
+            if dropped is not None:
+                self.__dropped_frames += 1
+                self.__pending_timings.pop(dropped[1], None)
+            if timings is not None:
+                if len(self.__pending_timings) > 100:
+                    self.__pending_timings.clear()
+                self.__pending_timings[index] = timings
+        if dropped is not None and self.__tracer is not None:
+            self.__tracer.instant('drop', dropped[1])
+
+    def __drain_mailbox(self):
+        with self.__mailbox_lock:
+            mail = self.__mailbox
+            self.__mailbox = None
+        if mail is not None:
+            self.draw_frame_signal.emit(*mail)
+
     def __thread_execution(self, conn_player: connection.Connection):
         logger = logging.getLogger('UIThread')
 
@@ -533,11 +848,9 @@ class VideoStream(QObject):
 
         while not terminate:
             action = conn_player.recv()
-
-            tmp = action.copy()
-            if 'frame' in tmp:
-                del tmp['frame']
-            logger.render(f'Action player -> ui: {tmp}')
+            tracer = self.__tracer
+            if tracer is not None:
+                tracer.instant(action['action'], action.get('index'))
 
             if action['action'] == 'END':
                 self.__destroyed = True
@@ -553,18 +866,49 @@ class VideoStream(QObject):
                 self.__total_frames = 0
                 terminate = True
             elif action['action'] == 'frame':
+                if action.get('error') is not None:
+                    logger.warning(f'Frame {action["index"]} not rendered: {action["error"]}')
                 if action['index'] is not None and action['frame'] is not None:
+                    timings = action['timings']
+                    if timings is not None:
+                        timings.append(('pipe.player_ui', time.time()))
                     self.__current_frame = action['index']
-                    self.draw_frame_signal.emit(QPixmap.fromImage(qimage2ndarray.array2qimage(action['frame'])), self.current_frame, self.total_frames, self.current_timestamp, self.total_timestamp, self.playing)
+                    if self.__open_time is not None:
+                        switch_latency = time.time() - self.__open_time
+                        self.__open_time = None
+                        logger.info(f'Opened {self.__filename} in {switch_latency * 1000:.1f}ms')
+                        self.opened.emit(self.__filename, switch_latency)
+                    # the BGR frame is handed over as is, the GUI thread wraps it without copying
+                    self.__post_frame(action['frame'], action['index'], timings)
             elif action['action'] == 'metadata':
                 self.__fps = action['fps']
                 self.__width = action['width']
                 self.__height = action['height']
                 self.__total_frames = action['total_frames']
-                self.__resized_width = action['resized_width']
-                self.__resized_height = action['resized_height']
-                self.__container_width = action['container_width']
-                self.__container_height = action['container_height']
+                self.__capabilities = action['capabilities']
+                if self.__resize_pending:
+                    # the reader does not know the size the container has now
+                    self.__resized_width, self.__resized_height = fit_size(self.__width, self.__height,
+                                                                           self.__container_width,
+                                                                           self.__container_height)
+                else:
+                    self.__resized_width = action['resized_width']
+                    self.__resized_height = action['resized_height']
+                    self.__container_width = action['container_width']
+                    self.__container_height = action['container_height']
+                self.__viewport.configure(self.__width, self.__height)
+            elif action['action'] == 'resync_shapes':
+                self.resync_shapes_signal.emit()
+            elif action['action'] == 'cache_stats':
+                self.__cache_stats = action
+            elif action['action'] == 'still':
+                self.__pyramid = ImagePyramid(action['frame'], action['index'])
+            elif action['action'] == 'read_ahead':
+                self.__read_ahead = action
+                logger.info(f'Read-ahead: {action["frames"]} frames '
+                            f'({action["cache_bytes"] / 1024 / 1024:.0f}MB, {action["reason"]}, '
+                            f'{action["available_bytes"] / 1024 / 1024:.0f}MB available, '
+                            f'decode {action["decode_ms"]:.1f}ms)')
 
         while True:
             action = conn_player.recv()
@@ -574,57 +918,152 @@ class VideoStream(QObject):
         self.destroyed.emit()
         conn_player.close()
 
-    def start(self, filename: str, container_width, container_height, cache_size=100):
+    def start(self, pool_size=2, cache_size=None, memory_fraction=0.5, compressed_codec='jpeg', tile_workers=None):
         if not self.__destroyed:
-            # creating a pipe
-            player_to_reader, reader_to_player = Pipe()
+            # creating the pipes
+            players_to_reader, readers_to_player = zip(*[Pipe() for _ in range(pool_size)])
             ui_to_player, player_to_ui = Pipe()
             command_to_player, player_to_command = Pipe()
             self.__commands_pipe = command_to_player
 
-            container_width = int(container_width)
-            container_height = int(container_height)
-
-            # creating new processes
-            reader_process = Process(target=reader,
-                                     args=(reader_to_player, filename, container_width, container_height, cache_size))
-            player_process = Process(target=player, args=(player_to_reader, player_to_ui, player_to_command))
+            # creating new processes, the readers are kept warm and reused for every opened video
+            # without a fixed cache_size each reader sizes its read-ahead from its share of the available memory;
+            # only the reader of the current video is busy, so each one may use tile_workers threads
+            reader_processes = [Process(target=reader, args=(reader_to_player, cache_size, self.__trace_buffer,
+                                                             memory_fraction / pool_size, compressed_codec,
+                                                             tile_workers))
+                                for reader_to_player in readers_to_player]
+            player_process = Process(target=player, args=(list(players_to_reader), player_to_ui, player_to_command,
+                                                          self.__trace_buffer))
 
             # running processes
-            reader_process.start()
+            for reader_process in reader_processes:
+                reader_process.start()
             player_process.start()
 
+            self.__workers = [None] * pool_size
+            self.__workers_used = [0] * pool_size
+
             thread_execution = Thread(target=self.__thread_execution, args=(ui_to_player,))
             thread_execution.start()
 
+            # frames are drained once per display refresh, older ones are dropped
+            screen = QGuiApplication.primaryScreen()
+            refresh_rate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60
+            self.__mailbox_timer.start(max(int(1000 / refresh_rate), 1))
+
+    def open(self, filename: str, container_width, container_height):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            if self.__filename is not None:
+                self.__positions[self.__filename] = self.__current_frame
+
+            # a worker that already has the file open keeps its frame cache, otherwise the least recently used one
+            if filename in self.__workers:
+                worker = self.__workers.index(filename)
+            else:
+                worker = min(range(len(self.__workers)), key=lambda i: self.__workers_used[i])
+                self.__workers[worker] = filename
+            self.__workers_used[worker] = time.time()
+
+            index = self.__positions.get(filename, 0)
+            self.__filename = filename
+            self.__timestamps = self.__timestamp_indexes.get(filename)
+            if self.__timestamps is None:
+                Thread(target=self.__load_timestamps, args=(filename,), daemon=True).start()
+            self.__generation += 1
+            self.__open_time = time.time()
+            self.__current_frame = index
+            self.__commands_pipe.send({
+                'action': 'open',
+                'worker': worker,
+                'generation': self.__generation,
+                'filename': filename,
+                'width': int(container_width),
+                'height': int(container_height),
+                'index': index,
+            })
+            # the worker may hold the shapes of another video
+            self.resync_shapes()
+            self.__viewport.reset()
+            self.__pyramid = None
+            self.__commands_pipe.send({'action': 'viewport', 'roi': None})
+
+    def __load_timestamps(self, filename):
+        index = VideoIndex(filename)
+        timestamps = index.get('pts_ms')
+        if timestamps is None:
+            if not source_class(filename).capabilities['timestamps']:
+                self.logger.info(f'{filename} has no timestamps, assuming a constant frame rate')
+                return
+            start = time.time()
+            timestamps = build_timestamps(filename, cancelled=lambda: self.__destroyed)
+            if timestamps is None:
+                self.logger.warning(f'No timestamps for {filename}, assuming a constant frame rate')
+                return
+            self.logger.info(f'Timestamps of {len(timestamps)} frames indexed in {time.time() - start:.1f}s')
+            index.set('pts_ms', timestamps)
+            index.save()
+        self.__timestamp_indexes[filename] = TimestampIndex(timestamps)
+        if self.__filename == filename:
+            self.__timestamps = self.__timestamp_indexes[filename]
+
     def __del__(self):
         self.destroy()
 
     def destroy(self):
         if not self.__destroyed:
             self.__destroyed = True
+            self.__mailbox_timer.stop()
             if self.__commands_pipe is not None:
                 self.__commands_pipe.send({'action': 'END'})
 
     def get_video_coord(self, container_x, container_y):
-        # container_x -= (self.__container_width - self.__resized_width) / 2
-        # container_y -= (self.__container_height - self.__resized_height) / 2
-        #
-        # container_x = int(max(min(container_x, self.__resized_width), 0))
-        # container_y = int(max(min(container_y, self.__resized_height), 0))
-        #
-        # x = self.__width * container_x / self.__resized_width
-        # y = self.__height * container_y / self.__resized_height
-
         blackbar_width = (self.__container_width - self.__resized_width) / 2
         blackbar_height = (self.__container_height - self.__resized_height) / 2
-        x = self.__width * (container_x - blackbar_width) / (self.__container_width - blackbar_width * 2)
-        y = self.__height * (container_y - blackbar_height) / (self.__container_height - blackbar_height * 2)
+        x, y = self.__viewport.to_source(container_x - blackbar_width, container_y - blackbar_height,
+                                         self.__resized_width, self.__resized_height)
 
         x = max(min(x, self.__width), 0)
         y = max(min(y, self.__height), 0)
         return int(x), int(y)
 
+    @property
+    def zoom(self):
+        return self.__viewport.zoom
+
+    def zoom_at(self, factor, container_x, container_y):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            x, y = self.get_video_coord(container_x, container_y)
+            self.__viewport.zoom_at(factor, x, y)
+            self.__update_viewport()
+
+    def pan(self, container_dx, container_dy):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            roi = self.__viewport.roi()
+            if roi is not None:
+                # dragging moves the picture, the visible region goes the other way
+                self.__viewport.pan(-container_dx * roi[2] / self.__resized_width,
+                                    -container_dy * roi[3] / self.__resized_height)
+                self.__update_viewport()
+
+    def reset_zoom(self):
+        if not self.__destroyed and self.__commands_pipe is not None and self.__viewport.zoomed:
+            self.__viewport.reset()
+            self.__update_viewport()
+
+    def __update_viewport(self):
+        roi = self.__viewport.roi()
+        self.__commands_pipe.send({'action': 'viewport', 'roi': roi})
+        if not self.__playing:
+            pyramid = self.__pyramid
+            if pyramid is not None and pyramid.index == self.__current_frame:
+                # shown right away, the frame rendered by the reader replaces it
+                self.__post_frame(pyramid.render(roi, self.__resized_width, self.__resized_height),
+                                  self.__current_frame, None)
+            else:
+                self.__commands_pipe.send({'action': 'still', 'index': self.__current_frame})
+        self.refresh()
+
     def play(self):
         if not self.__destroyed and self.__commands_pipe is not None:
             self.__commands_pipe.send({'action': 'play'})
@@ -647,46 +1086,146 @@ class VideoStream(QObject):
         if not self.__destroyed and self.__commands_pipe is not None:
             self.__commands_pipe.send({'action': 'refresh'})
 
+    def profile(self, enabled):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            self.__profiling = enabled
+            self.__pending_timings.clear()
+            self.__commands_pipe.send({'action': 'profile', 'enabled': enabled})
+
+    def trace(self, enabled):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            self.__tracer = self.__trace_buffer.recorder('UIThread') if enabled else None
+            self.__commands_pipe.send({'action': 'trace', 'enabled': enabled})
+
+    def disk_cache(self, enabled, directory=None, budget_bytes=10 * 1024 * 1024 * 1024):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            self.__commands_pipe.send({'action': 'disk_cache', 'enabled': enabled, 'directory': directory,
+                                       'budget_bytes': budget_bytes})
+
+    def export_trace(self, filename):
+        self.__trace_buffer.export(filename)
+
+    def frame_drawn(self, index):
+        if self.__tracer is not None:
+            self.__tracer.instant('draw', index)
+        timings = self.__pending_timings.pop(index, None)
+        if timings is not None:
+            timings.append(('gui.draw', time.time()))
+            self.latency.add_timings(timings)
+
     def resize(self, width, height):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'resize', 'width': width, 'height': height})
+            self.__container_width = width
+            self.__container_height = height
+            self.__resized_width, self.__resized_height = fit_size(self.__width, self.__height, width, height)
+            self.__resize_pending = True
+            self.__resize_timer.start()
+
+    def __resize_settled(self):
+        self.__resize_pending = False
+        if not self.__destroyed and self.__commands_pipe is not None:
+            self.__commands_pipe.send({'action': 'resize', 'width': self.__container_width,
+                                       'height': self.__container_height})
+            # while playing the frames already read are scaled until the next ones come at the new size
+            if not self.__playing:
+                self.refresh()
 
     def add_seconds(self, seconds):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.skip_to(int(max(min(self.current_frame + self.fps * seconds, self.total_frames - 1), 0)))
+            index = self.time_to_index(self.index_to_time(self.current_frame) + seconds)
+            self.skip_to(int(max(min(index, self.total_frames - 1), 0)))
 
     def add_frames(self, frames):
         if not self.__destroyed and self.__commands_pipe is not None:
             self.skip_to(max(min(self.current_frame + frames, self.total_frames - 1), 0))
 
+    def __send_shapes_delta(self, target, op, **kwargs):
+        # the overlays of the paused frame change
+        self.__pyramid = None
+        self.__shapes_seq += 1
+        self.__commands_pipe.send({'action': 'shapes_delta', 'seq': self.__shapes_seq, 'target': target, 'op': op,
+                                   **kwargs})
+
+    def __sync_shape(self, target, synced_shapes, frame_index, shape: Shape):
+        if isinstance(shape, Track):
+            # a track is sent whole, it only holds its keyframes
+            shape = shape.copy()
+            self.__send_shapes_delta(target, 'add', index=frame_index, shape=shape)
+            synced_shapes[shape.id] = (frame_index, shape)
+            return
+        synced = synced_shapes.get(shape.id)
+        if synced is None or synced[0] != frame_index or synced[1].shape != shape.shape or \
+                synced[1].color != shape.color or synced[1].last_color != shape.last_color:
+            self.__send_shapes_delta(target, 'add', index=frame_index, shape=shape)
+        else:
+            old_points = synced[1].points
+            new_points = shape.points
+            if len(new_points) == len(old_points) + 1 and new_points[:-1] == old_points:
+                self.__send_shapes_delta(target, 'add_point', id=shape.id, point=new_points[-1])
+            elif len(new_points) == len(old_points):
+                moved = [i for i, (p1, p2) in enumerate(zip(old_points, new_points)) if p1 != p2]
+                if len(moved) == 1:
+                    self.__send_shapes_delta(target, 'move_point', id=shape.id, point_index=moved[0],
+                                             point=new_points[moved[0]])
+                elif len(moved) > 1:
+                    self.__send_shapes_delta(target, 'set_points', id=shape.id, points=list(new_points))
+            else:
+                self.__send_shapes_delta(target, 'set_points', id=shape.id, points=list(new_points))
+            if synced[1].message != shape.message:
+                self.__send_shapes_delta(target, 'set_message', id=shape.id, message=shape.message)
+        synced_shapes[shape.id] = (frame_index, copy.deepcopy(shape))
+
+    def resync_shapes(self):
+        if not self.__destroyed and self.__commands_pipe is not None:
+            self.__shapes_seq += 1
+            self.__commands_pipe.send({
+                'action': 'shapes_snapshot',
+                'seq': self.__shapes_seq,
+                'shapes': [synced for synced in self.__synced_shapes.values()],
+                'drawing_shapes': [shape for (_, shape) in self.__synced_drawing_shapes.values()],
+            })
+
     def clear_shapes(self):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'clear_shapes'})
+            self.__synced_shapes.clear()
+            self.__send_shapes_delta('timeline', 'clear')
 
     def set_shapes(self, shapes: [(int, Shape)]):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'set_shapes', 'shapes': shapes})
+            self.__synced_shapes = {shape.id: (frame_index, copy.deepcopy(shape)) for (frame_index, shape) in shapes}
+            self.resync_shapes()
 
     def remove_shape(self, id: str):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'remove_shape', 'id': id})
+            if self.__synced_shapes.pop(id, None) is not None:
+                self.__send_shapes_delta('timeline', 'remove', id=id)
 
     def highlight_shape(self, id, color=(255, 255, 0)):
         if not self.__destroyed and self.__commands_pipe is not None:
+            self.__pyramid = None
             self.__commands_pipe.send({'action': 'highlight_shape', 'id': id, 'color': color})
 
     def add_shape(self, frame_index, shape: Shape):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'add_shape', 'index': frame_index, 'shape': shape})
+            self.__sync_shape('timeline', self.__synced_shapes, frame_index, shape)
+
+    def add_shapes(self, shapes: [(int, Shape)]):
+        # a whole batch of new shapes in a single message, e.g. while importing
+        if not self.__destroyed and self.__commands_pipe is not None:
+            for (frame_index, shape) in shapes:
+                self.__synced_shapes[shape.id] = (frame_index, shape.copy())
+            self.__send_shapes_delta('timeline', 'add_batch', shapes=list(shapes))
 
     def clear_drawing_shapes(self):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'clear_drawing_shapes'})
+            self.__synced_drawing_shapes.clear()
+            self.__send_shapes_delta('drawing', 'clear')
 
     def remove_drawing_shape(self, id: str):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'remove_drawing_shape', 'id': id})
+            if self.__synced_drawing_shapes.pop(id, None) is not None:
+                self.__send_shapes_delta('drawing', 'remove', id=id)
 
     def add_drawing_shape(self, shape: Shape):
         if not self.__destroyed and self.__commands_pipe is not None:
-            self.__commands_pipe.send({'action': 'add_drawing_shape', 'shape': shape})
+            self.__sync_shape('drawing', self.__synced_drawing_shapes, None, shape)
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+MAX_ZOOM = 32
+
+
+class Viewport:
+    # the visible region of the video in source coordinates, it keeps the video ratio so the display size
+    # does not change with the zoom
+    def __init__(self, width=1, height=1):
+        self.__width = width
+        self.__height = height
+        self.__zoom = 1.0
+        self.__center_x = width / 2
+        self.__center_y = height / 2
+
+    @property
+    def zoom(self):
+        return self.__zoom
+
+    @property
+    def zoomed(self):
+        return self.__zoom > 1
+
+    def configure(self, width, height):
+        if (width, height) != (self.__width, self.__height):
+            self.__width = width
+            self.__height = height
+            self.reset()
+
+    def reset(self):
+        self.__zoom = 1.0
+        self.__center_x = self.__width / 2
+        self.__center_y = self.__height / 2
+
+    def roi(self):
+        # (x, y, width, height) in whole source pixels, None when the whole frame is visible
+        if not self.zoomed:
+            return None
+        w = max(int(round(self.__width / self.__zoom)), 1)
+        h = max(int(round(self.__height / self.__zoom)), 1)
+        x = int(round(min(max(self.__center_x - w / 2, 0), self.__width - w)))
+        y = int(round(min(max(self.__center_y - h / 2, 0), self.__height - h)))
+        return x, y, w, h
+
+    def __clamp(self):
+        w = self.__width / self.__zoom
+        h = self.__height / self.__zoom
+        self.__center_x = min(max(self.__center_x, w / 2), self.__width - w / 2)
+        self.__center_y = min(max(self.__center_y, h / 2), self.__height - h / 2)
+
+    def zoom_at(self, factor, x, y):
+        # the source point (x, y) stays under the cursor
+        zoom = min(max(self.__zoom * factor, 1.0), MAX_ZOOM)
+        scale = self.__zoom / zoom
+        self.__center_x = x - (x - self.__center_x) * scale
+        self.__center_y = y - (y - self.__center_y) * scale
+        self.__zoom = zoom
+        self.__clamp()
+
+    def pan(self, dx, dy):
+        # in source pixels
+        self.__center_x += dx
+        self.__center_y += dy
+        self.__clamp()
+
+    def to_source(self, x, y, display_width, display_height):
+        # a point of the displayed (cropped and scaled) frame to source coordinates
+        roi = self.roi() or (0, 0, self.__width, self.__height)
+        return roi[0] + x * roi[2] / display_width, roi[1] + y * roi[3] / display_height
+
+
+def crop(frame: np.ndarray, roi):
+    # a view, nothing is copied before the resize
+    if roi is None:
+        return frame
+    x, y, w, h = roi
+    return frame[y:y + h, x:x + w]
+
+
+class ImagePyramid:
+    # successive halvings of a frame, a region is scaled from the smallest level that still has enough pixels
+    def __init__(self, frame: np.ndarray, index, min_size=256):
+        self.index = index
+        self.__levels = [frame]
+        while min(self.__levels[-1].shape[:2]) >= min_size * 2:
+            self.__levels.append(cv2.pyrDown(self.__levels[-1]))
+
+    def __len__(self):
+        return len(self.__levels)
+
+    def render(self, roi, width, height):
+        frame = self.__levels[0]
+        x, y, w, h = roi if roi is not None else (0, 0, frame.shape[1], frame.shape[0])
+        level = 0
+        while level + 1 < len(self.__levels) and w / 2 ** (level + 1) >= width and h / 2 ** (level + 1) >= height:
+            level += 1
+        scale = 2 ** level
+        region = self.__levels[level][y // scale:(y + h) // scale, x // scale:(x + w) // scale]
+        interpolation = cv2.INTER_AREA if region.shape[1] > width else cv2.INTER_LINEAR
+        return cv2.resize(region, (width, height), interpolation=interpolation)
@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+from threading import Lock
+
+# the small part of RFC 6455 needed to push events to clients: text, ping/pong and close frames, no extensions
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TEXT = 0x1
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def read_exactly(f, size):
+    data = b''
+    while len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            raise ConnectionError('WebSocket closed')
+        data += chunk
+    return data
+
+
+class WebSocket:
+    def __init__(self, rfile, wfile, masked, sock=None):
+        # clients mask what they send, servers do not
+        self.__sock = sock
+        self.__rfile = rfile
+        self.__wfile = wfile
+        self.__masked = masked
+        self.__lock = Lock()
+        self.__closed = False
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def __send(self, opcode, payload: bytes):
+        header = bytes([0x80 | opcode])
+        mask_bit = 0x80 if self.__masked else 0
+        if len(payload) < 126:
+            header += bytes([mask_bit | len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([mask_bit | 126]) + struct.pack('>H', len(payload))
+        else:
+            header += bytes([mask_bit | 127]) + struct.pack('>Q', len(payload))
+        if self.__masked:
+            mask = os.urandom(4)
+            header += mask
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        with self.__lock:
+            if self.__closed:
+                raise ConnectionError('WebSocket closed')
+            self.__wfile.write(header + payload)
+            self.__wfile.flush()
+
+    def send(self, message):
+        self.__send(TEXT, json.dumps(message).encode())
+
+    def receive(self):
+        # the next text message as decoded JSON, None once the connection is closed
+        while True:
+            try:
+                first, second = read_exactly(self.__rfile, 2)
+                size = second & 0x7F
+                if size == 126:
+                    size = struct.unpack('>H', read_exactly(self.__rfile, 2))[0]
+                elif size == 127:
+                    size = struct.unpack('>Q', read_exactly(self.__rfile, 8))[0]
+                mask = read_exactly(self.__rfile, 4) if second & 0x80 else None
+                payload = read_exactly(self.__rfile, size)
+            except (ConnectionError, OSError, ValueError):
+                self.__closed = True
+                return None
+            if mask is not None:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            opcode = first & 0x0F
+            if opcode == TEXT:
+                return json.loads(payload.decode())
+            if opcode == PING:
+                self.__send(PONG, payload)
+            elif opcode == CLOSE:
+                self.close()
+                return None
+
+    def close(self):
+        if not self.__closed:
+            try:
+                self.__send(CLOSE, b'')
+            except (ConnectionError, OSError):
+                pass
+            self.__closed = True
+            if self.__sock is not None:
+                self.__sock.close()
+
+
+def connect(host, port, path):
+    sock = socket.create_connection((host, port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+    rfile = sock.makefile('rb')
+    status = rfile.readline().decode()
+    headers = dict()
+    while True:
+        line = rfile.readline().decode().strip()
+        if not line:
+            break
+        name, value = line.split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    if ' 101 ' not in status or headers.get('sec-websocket-accept') != accept_key(key):
+        sock.close()
+        raise ConnectionError(f'WebSocket handshake failed: {status.strip()}')
+    return WebSocket(rfile, sock.makefile('wb'), masked=True, sock=sock)
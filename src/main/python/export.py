@@ -0,0 +1,36 @@
+import argparse
+import json
+import logging
+import os
+
+from classes.Exporters import FORMATS, export, iter_annotations
+from classes.FrameSource import open_source
+
+logger = logging.getLogger('Export')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export an annotation file to COCO, MOT or CVAT.')
+    parser.add_argument('annotations', help='annotation file saved by the application')
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=list(FORMATS), required=True)
+    parser.add_argument('--video', help='annotated video, used for the frame size, count and names')
+    args = parser.parse_args()
+
+    options = {'name': os.path.splitext(os.path.basename(args.annotations))[0]}
+    if args.video is not None:
+        video = open_source(args.video, count_frames=False)
+        options = {
+            'name': os.path.splitext(os.path.basename(os.path.normpath(args.video)))[0],
+            'width': video.width,
+            'height': video.height,
+            'total_frames': video.total_frames,
+        }
+        video.release()
+
+    result = export(iter_annotations(args.annotations), args.output, args.format, **options)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,46 @@
 import json
 import logging
 import multiprocessing
+import time
 import uuid
 from pathlib import Path
 from threading import RLock
 
-from PySide2.QtCore import QFile, QIODevice, QEvent, QObject, Qt, QDir
-from PySide2.QtGui import QPixmapCache
+from PySide2.QtCore import QFile, QIODevice, QEvent, QObject, Qt, QDir, QTimer, QRect
+from PySide2.QtGui import QPainter, QGuiApplication
 from PySide2.QtWidgets import QFileDialog, QLabel, QAction, QSlider, QPushButton, QGroupBox, QListWidget, QLineEdit, \
-    QMessageBox, QTextEdit, QStatusBar
+    QMessageBox, QTextEdit, QStatusBar, QInputDialog, QApplication
 from fbs_runtime.application_context.PySide2 import ApplicationContext
 from PySide2.QtUiTools import QUiLoader
 
 import sys
 
+from classes.Exporters import export, timeline_annotations
+from classes.FrameImage import FrameImage
+from classes.ImportWorker import Importer
+from classes.ProjectStore import ProjectStore
+from classes.SceneDetector import SceneDetector
+from classes.ShapeIndex import ShapeIndex
+from classes.Tracker import Tracker
+from classes.Track import Track, TRACKABLE, from_save_format
 from classes.VideoStream import VideoStream
 from classes.Utils import json_to_html
 from classes.Shape import Shape, ShapeType
 
 logger = logging.getLogger('Main')
 
+EXPORT_FILTERS = {
+    'COCO JSON (*.json)': 'coco',
+    'MOT CSV (*.txt)': 'mot',
+    'CVAT XML (*.xml)': 'cvat',
+}
+
+IMPORT_FILTERS = {
+    'COCO JSON (*.json)': 'coco',
+    'MOT CSV (*.txt *.csv)': 'mot',
+    'CVAT XML (*.xml)': 'cvat',
+}
+
 
 class EditNewMessageFilter(QObject):
     def __init__(self, parent, main):
@@ -57,6 +78,14 @@ class GlobalEventFilter(QObject):
                 else:
                     self.main.select_next_message()
                 return True
+            # text fields and lists keep their own paging
+            if event.key() in (Qt.Key_PageDown, Qt.Key_PageUp) and \
+                    not isinstance(QApplication.focusWidget(), (QLineEdit, QListWidget)):
+                if event.key() == Qt.Key_PageDown:
+                    self.main.next_cut()
+                else:
+                    self.main.previous_cut()
+                return True
             if event.key() == Qt.Key_S:
                 if event.modifiers() & Qt.CTRL == Qt.CTRL:
                     self.main.ui_action_save_annotations_triggered()
@@ -84,6 +113,18 @@ class GlobalEventFilter(QObject):
                 if event.key() == Qt.Key_L:
                     self.main.ui_btn_shape_line_clicked()
                     return True
+                if event.key() == Qt.Key_K:
+                    self.main.ui_btn_keyframe_timeline_clicked()
+                    return True
+                if event.key() == Qt.Key_Plus or event.key() == Qt.Key_Equal:
+                    self.main.zoom_video(1.25)
+                    return True
+                if event.key() == Qt.Key_Minus:
+                    self.main.zoom_video(1 / 1.25)
+                    return True
+                if event.key() == Qt.Key_0:
+                    self.main.reset_zoom()
+                    return True
                 if event.key() == Qt.Key_Space:
                     if self.main.videostream.playing:
                         self.main.pause()
@@ -113,20 +154,41 @@ class VideoEventFilter(QObject):
     def eventFilter(self, obj, event):
         # logger.debug(event.type())
 
+        if event.type() == QEvent.Paint:
+            if self.main.video_frame is not None:
+                self.main.paint_video_frame()
+                return True
+            return False
+
         if event.type() == QEvent.Resize:
+            # debounced by the video stream, the current frame is scaled until then
             if self.main.videostream:
                 self.main.videostream.resize(self.main.ui_lbl_video.frameGeometry().width(),
                                              self.main.ui_lbl_video.frameGeometry().height())
-                self.main.videostream.refresh()
             return True
 
         if self.main.videostream is not None and not self.main.videostream.playing:
             if event.type() == QEvent.Leave:
+                # a move still waiting would bring the pointer or the hover back
+                self.main.mouse_move_timer.stop()
+                self.main.pending_mouse_move = None
                 if self.main.drawing_shape is not None:
                     self.main.hide_pointer()
+                else:
+                    self.main.hover_shape(None)
+                return True
+
+            if event.type() == QEvent.Wheel:
+                self.main.zoom_video(1.25 ** (event.angleDelta().y() / 120), event.x(), event.y())
                 return True
 
             if event.type() == QEvent.MouseButtonPress:
+                # a press is handled after the moves that came before it
+                self.main.input_received()
+                self.main.flush_mouse_move()
+                if event.button() == Qt.MouseButton.MiddleButton:
+                    self.main.pan_position = (event.x(), event.y())
+                    return True
                 x, y = self.main.videostream.get_video_coord(event.x(), event.y())
                 logger.debug(f'Click on ({x}, {y})')
                 if event.button() == Qt.MouseButton.LeftButton:
@@ -142,30 +204,21 @@ class VideoEventFilter(QObject):
                     else:
                         self.main.drawing_shape.remove_last()
                     self.main.update_shape()
+                elif event.button() == Qt.MouseButton.LeftButton:
+                    self.main.select_shape(self.main.shape_at(x, y))
                 return True
 
-            if event.type() == QEvent.MouseMove or event.type() == QEvent.MouseButtonRelease:
-                x, y = self.main.videostream.get_video_coord(event.x(), event.y())
-
-                if self.main.video_pressed:
-                    if event.type() == QEvent.MouseButtonRelease:
-                        logger.debug(f'Release on ({x}, {y})')
-                        self.main.video_pressed = False
-                        if self.main.drawing_shape is not None:
-                            self.main.drawing_pointer.remove_last()
-                            self.main.drawing_pointer.add_point(x, y)
-                            self.main.show_pointer(refresh=False)
+            if event.type() == QEvent.MouseMove:
+                self.main.queue_mouse_move(event.x(), event.y())
+                return True
 
-                    if self.main.drawing_shape is not None:
-                        if len(self.main.drawing_shape.points) > 1:
-                            self.main.drawing_shape.remove_last()
-                        self.main.drawing_shape.add_point(x, y)
-                        self.main.update_shape()
+            if event.type() == QEvent.MouseButtonRelease:
+                self.main.input_received()
+                self.main.flush_mouse_move()
+                if event.button() == Qt.MouseButton.MiddleButton:
+                    self.main.pan_position = None
                 else:
-                    if self.main.drawing_shape is not None:
-                        self.main.drawing_pointer.remove_last()
-                        self.main.drawing_pointer.add_point(x, y)
-                        self.main.update_pointer()
+                    self.main.mouse_moved(event.x(), event.y(), released=True)
                 return True
 
         return False
@@ -200,11 +253,40 @@ class Main:
         self.was_playing = False
 
         self.video_pressed = False
+        self.pending_mouse_move = None
+        # last position of a middle button drag panning the zoomed video
+        self.pan_position = None
+        self.input_time = None
+        # last json shown by the shape inspector, it is not rendered again while unchanged
+        self.inspector_json = ''
+        self.video_frame: FrameImage = None
 
         self.drawing_shape = None
+        # id of the timeline shape or track the drawing shape becomes a keyframe of
+        self.keyframe_target = None
         self.drawing_pointer = Shape('drawing_pointer', ShapeType.pointer)
 
         self.timeline = []
+        # id -> position in the timeline, checked on use and rebuilt when stale
+        self.timeline_positions = dict()
+        self.shape_index = ShapeIndex()
+        self.hovered_shape = None
+
+        self.tracker = Tracker()
+        self.tracker.propagated.connect(self.on_shape_propagated)
+        self.tracker.finished.connect(self.on_propagation_finished)
+        self.propagating = dict()
+
+        self.scene_detector = SceneDetector()
+        self.scene_detector.progress.connect(self.on_scene_progress)
+
+        self.project = None
+        self.project_video_id = None
+
+        self.importer = Importer()
+        self.importer.chunk.connect(self.on_import_chunk)
+        self.importer.finished.connect(self.on_import_finished)
+        self.importer.failed.connect(self.on_import_failed)
 
         self.ui_status_bar: QStatusBar = self.window.findChild(QStatusBar, 'status_bar')
 
@@ -215,9 +297,15 @@ class Main:
         self.ui_lbl_video.installEventFilter(self.video_filter)
 
         self.ui_action_load_video: QAction = self.window.findChild(QAction, 'action_load_video')
+        self.ui_action_load_image_sequence: QAction = self.window.findChild(QAction, 'action_load_image_sequence')
         self.ui_action_load_annotations: QAction = self.window.findChild(QAction, 'action_load_annotations')
         self.ui_action_save_annotations: QAction = self.window.findChild(QAction, 'action_save_annotations')
         self.ui_action_save_annotations_as: QAction = self.window.findChild(QAction, 'action_save_annotations_as')
+        self.ui_action_save_timestamps: QAction = self.window.findChild(QAction, 'action_save_timestamps')
+        self.ui_action_open_project: QAction = self.window.findChild(QAction, 'action_open_project')
+        self.ui_action_save_to_project: QAction = self.window.findChild(QAction, 'action_save_to_project')
+        self.ui_action_import_annotations: QAction = self.window.findChild(QAction, 'action_import_annotations')
+        self.ui_action_export_annotations: QAction = self.window.findChild(QAction, 'action_export_annotations')
 
         self.ui_slider_speed: QSlider = self.window.findChild(QSlider, 'slider_speed')
         self.ui_lbl_speed: QLabel = self.window.findChild(QLabel, 'lbl_speed')
@@ -250,6 +338,8 @@ class Main:
         self.ui_list_timeline: QListWidget = self.window.findChild(QListWidget, 'list_timeline')
         self.ui_btn_edit_timeline: QPushButton = self.window.findChild(QPushButton, 'btn_edit_timeline')
         self.ui_btn_delete_timeline: QPushButton = self.window.findChild(QPushButton, 'btn_delete_timeline')
+        self.ui_btn_propagate_timeline: QPushButton = self.window.findChild(QPushButton, 'btn_propagate_timeline')
+        self.ui_btn_keyframe_timeline: QPushButton = self.window.findChild(QPushButton, 'btn_keyframe_timeline')
 
         self.ui_list_messages: QListWidget = self.window.findChild(QListWidget, 'list_messages')
         self.ui_edit_new_message: QLineEdit = self.window.findChild(QLineEdit, 'edit_new_message')
@@ -265,6 +355,35 @@ class Main:
         self.ui_action_about: QAction = self.window.findChild(QAction, 'action_about')
         self.ui_action_about.triggered.connect(self.show_about)
 
+        self.ui_action_disk_cache: QAction = self.window.findChild(QAction, 'action_disk_cache')
+        self.ui_action_disk_cache.toggled.connect(self.ui_action_disk_cache_toggled)
+
+        self.ui_action_latency_stats: QAction = self.window.findChild(QAction, 'action_latency_stats')
+        self.ui_action_latency_stats.toggled.connect(self.ui_action_latency_stats_toggled)
+        self.ui_action_dump_latency_stats: QAction = self.window.findChild(QAction, 'action_dump_latency_stats')
+        self.ui_action_dump_latency_stats.triggered.connect(self.ui_action_dump_latency_stats_triggered)
+
+        self.ui_action_record_trace: QAction = self.window.findChild(QAction, 'action_record_trace')
+        self.ui_action_record_trace.toggled.connect(self.ui_action_record_trace_toggled)
+        self.ui_action_export_trace: QAction = self.window.findChild(QAction, 'action_export_trace')
+        self.ui_action_export_trace.triggered.connect(self.ui_action_export_trace_triggered)
+
+        self.ui_lbl_latency = QLabel()
+        self.ui_lbl_latency.setVisible(False)
+        self.ui_status_bar.addPermanentWidget(self.ui_lbl_latency)
+        self.ui_lbl_scenes = QLabel()
+        self.ui_status_bar.addPermanentWidget(self.ui_lbl_scenes)
+        self.latency_timer = QTimer()
+        self.latency_timer.setInterval(500)
+        self.latency_timer.timeout.connect(self.update_latency_stats)
+
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60
+        self.mouse_move_timer = QTimer()
+        self.mouse_move_timer.setSingleShot(True)
+        self.mouse_move_timer.setInterval(max(int(1000 / refresh_rate), 1))
+        self.mouse_move_timer.timeout.connect(self.flush_mouse_move)
+
         self.ui_btn_add_new_message.setEnabled(False)
         self.ui_edit_new_message.textChanged.connect(self.ui_edit_new_message_text_changed)
 
@@ -272,9 +391,14 @@ class Main:
         self.ui_edit_new_message.installEventFilter(self.edit_new_message_filter)
 
         self.ui_action_load_video.triggered.connect(self.ui_action_load_video_triggered)
+        self.ui_action_load_image_sequence.triggered.connect(self.ui_action_load_image_sequence_triggered)
         self.ui_action_load_annotations.triggered.connect(self.ui_action_load_annotations_triggered)
         self.ui_action_save_annotations.triggered.connect(self.ui_action_save_annotations_triggered)
         self.ui_action_save_annotations_as.triggered.connect(self.ui_action_save_annotations_as_triggered)
+        self.ui_action_open_project.triggered.connect(self.ui_action_open_project_triggered)
+        self.ui_action_save_to_project.triggered.connect(self.ui_action_save_to_project_triggered)
+        self.ui_action_import_annotations.triggered.connect(self.ui_action_import_annotations_triggered)
+        self.ui_action_export_annotations.triggered.connect(self.ui_action_export_annotations_triggered)
 
         self.ui_slider_speed.valueChanged.connect(self.ui_slider_speed_valueChanged)
         self.ui_btn_play.clicked.connect(self.ui_btn_play_clicked)
@@ -312,8 +436,8 @@ class Main:
         self.ui_list_timeline.itemSelectionChanged.connect(self.ui_list_timeline_item_changed)
         self.ui_btn_edit_timeline.clicked.connect(self.ui_btn_edit_timeline_clicked)
         self.ui_btn_delete_timeline.clicked.connect(self.ui_btn_delete_timeline_clicked)
-
-        QPixmapCache.setCacheLimit(1024 * 1024 * 1024)
+        self.ui_btn_propagate_timeline.clicked.connect(self.ui_btn_propagate_timeline_clicked)
+        self.ui_btn_keyframe_timeline.clicked.connect(self.ui_btn_keyframe_timeline_clicked)
 
         self.appctxt.app.aboutToQuit.connect(self.about_to_quit)
 
@@ -330,6 +454,10 @@ class Main:
                                    "Right Arrow: Next frame / forward 5 secs (if playing)\n"
                                    "Left Arrow: Previous frame / backward 5 secs (if playing)\n"
                                    "Shift + Up/Down Arrow: Insert new message\n"
+                                   "Page Down/Up: Next / previous scene cut\n"
+                                   "Mouse wheel, +/-: Zoom in / out\n"
+                                   "Middle button drag: Pan the zoomed video\n"
+                                   "0: Reset zoom\n"
                                    "Escape: Clear the current drawing shape\n"
                                    "Return: Create event\n"
                                    "Space: Play / Pause\n"
@@ -337,6 +465,7 @@ class Main:
                                    "R: Rectangle\n"
                                    "E: Ellipse\n"
                                    "P: Polygon\n"
+                                   "K: Track the selected event with keyframes (then Return on another frame)\n"
                                    "CMD/CTRL+S: Save annotations\n"
                                    "L: Line\n\nIn order to create a new event, you need to select a valid shape and a valid (non-empty) message.")
         msg_box.exec_()
@@ -348,6 +477,11 @@ class Main:
         msg_box.exec_()
 
     def ui_btn_edit_timeline_clicked(self):
+        selected = self.list_timeline_get_selected()
+        if selected is not None and isinstance(selected[2], Track):
+            # a track is edited at the current frame, the edited shape becomes a keyframe
+            self.ui_btn_keyframe_timeline_clicked()
+            return
         deleted = self.delete_selected_list_timeline()
         if deleted is not None:
             frame, shape = deleted
@@ -361,10 +495,213 @@ class Main:
     def ui_btn_delete_timeline_clicked(self):
         self.delete_selected_list_timeline()
 
+    def ui_btn_propagate_timeline_clicked(self):
+        selected = self.list_timeline_get_selected()
+        if selected is not None and self.videostream is not None:
+            i, frame, shape = selected
+            if shape.shape == ShapeType.globals or len(shape.points) == 0:
+                self.ui_status_bar.showMessage("Only shapes with points can be propagated", 3000)
+                return
+            frames, ok = QInputDialog.getInt(self.window, 'Propagate', 'Frames to track forward and backward:',
+                                             30, 1, self.videostream.total_frames)
+            if ok:
+                if isinstance(shape, Track):
+                    # a track is tracked from where it is shown, its keyframes are kept as they are
+                    frame = self.videostream.current_frame
+                    track = shape.copy()
+                    points = shape.shape_at(frame).points
+                else:
+                    # the propagated shape becomes a track, a tracked frame is a keyframe until tracking ends
+                    track = Track.from_shape(frame, shape)
+                    points = shape.points
+                job = self.tracker.propagate(self.videostream.filename, frame, points, frames)
+                self.propagating[job] = (track, set(track.keyframes))
+                self.ui_status_bar.showMessage("Propagating...")
+
+    def on_shape_propagated(self, job, shapes):
+        # tracked frames are gathered here, the track is sent to the video stream once when tracking ends
+        if job not in self.propagating:
+            return
+        track, keyframes = self.propagating[job]
+        shapes = [(frame, points) for (frame, points) in shapes if frame not in keyframes]
+        if len(shapes) > 0:
+            track.set_keyframes([frame for (frame, _) in shapes], [points for (_, points) in shapes])
+
+    def on_propagation_finished(self, job, stats):
+        if job in self.propagating:
+            track, keyframes = self.propagating.pop(job)
+            # tracked keyframes that interpolation reproduces within a pixel are dropped
+            tracked = len(track)
+            track.simplify(fixed=keyframes)
+            self.put_track(track)
+            if not self.videostream.playing:
+                self.videostream.refresh()
+            self.ui_status_bar.showMessage(f'Propagated {stats["frames"]} frames at '
+                                           f'{stats["fps_per_core"]:.1f} fps/core, {len(track)} keyframes out of '
+                                           f'{tracked}{" (target lost)" if stats["lost"] else ""}', 5000)
+
+    def put_track(self, track):
+        # a track replaces the timeline entry with its id, a shape it was made from or an older version of it
+        i = self.timeline_position(track.id)
+        if i is not None:
+            self.timeline[i] = (track.first, track)
+            self.ui_list_timeline.item(i).setText(self.timeline_item_text(track.first, track))
+        else:
+            self.timeline_positions[track.id] = len(self.timeline)
+            self.timeline.append((track.first, track))
+            self.ui_list_timeline.addItem(self.timeline_item_text(track.first, track))
+        self.videostream.add_shape(track.first, track)
+        self.shape_index.add(track.first, track)
+
+    def ui_btn_keyframe_timeline_clicked(self):
+        selected = self.list_timeline_get_selected()
+        if selected is not None and self.videostream is not None:
+            i, frame, shape = selected
+            if shape.shape not in TRACKABLE or len(shape.points) == 0:
+                self.ui_status_bar.showMessage("Only shapes with points can be tracked", 3000)
+                return
+            self.pause()
+            # the shape at the current frame is edited, creating it adds a keyframe wherever the video is then
+            drawing_shape = shape.shape_at(self.videostream.current_frame) if isinstance(shape, Track) else shape.copy()
+            drawing_shape.id = 'drawing_shape'
+            drawing_shape.color = (0, 0, 255)
+            drawing_shape.last_color = (0, 255, 255)
+            self.reset_shape(refresh=False)
+            self.drawing_shape = drawing_shape
+            self.keyframe_target = shape.id
+            self.update_shape()
+            self.ui_status_bar.showMessage("Move to another frame, adjust the shape and create it as a keyframe", 5000)
+
+    def timeline_position(self, id):
+        i = self.timeline_positions.get(id)
+        if i is None or i >= len(self.timeline) or self.timeline[i][1].id != id:
+            self.timeline_positions = {shape.id: i for i, (_, shape) in enumerate(self.timeline)}
+            i = self.timeline_positions.get(id)
+        return i
+
+    def add_keyframe(self):
+        i = self.timeline_position(self.keyframe_target)
+        if i is None:
+            self.reset_shape()
+            return
+        frame, shape = self.timeline[i]
+        track = shape if isinstance(shape, Track) else Track.from_shape(frame, shape)
+        try:
+            if self.drawing_shape.shape != track.shape:
+                raise ValueError(f'Keyframes of this track are {track.shape}s')
+            track.set_keyframe(self.videostream.current_frame, self.drawing_shape.points)
+        except ValueError as e:
+            self.ui_status_bar.showMessage(str(e), 3000)
+            return
+        self.put_track(track)
+        self.reset_shape()
+        self.ui_status_bar.showMessage(f'{len(track)} keyframes, frames {track.first + 1} to {track.last + 1}', 3000)
+
+    def shape_at(self, x, y):
+        if self.videostream is None:
+            return None
+        return self.shape_index.query(self.videostream.current_frame, x, y)
+
+    def input_received(self, received=None):
+        # the oldest input not shown yet, its latency is measured when the next frame is drawn
+        received = received or time.time()
+        if self.input_time is None or received < self.input_time:
+            self.input_time = received
+
+    def queue_mouse_move(self, x, y):
+        # moves are coalesced: at most one is handled per display refresh, the latest position wins and the
+        # first one is when the input was received
+        if self.pending_mouse_move is None:
+            self.mouse_move_timer.start()
+            self.pending_mouse_move = (x, y, time.time())
+        else:
+            self.pending_mouse_move = (x, y, self.pending_mouse_move[2])
+
+    def flush_mouse_move(self):
+        self.mouse_move_timer.stop()
+        if self.pending_mouse_move is not None:
+            x, y, received = self.pending_mouse_move
+            self.pending_mouse_move = None
+            # a move that changes nothing on screen (e.g. hovering the same shape) draws no frame to measure
+            if self.videostream is not None and not self.videostream.playing and self.mouse_moved(x, y):
+                self.input_received(received)
+
+    def mouse_moved(self, container_x, container_y, released=False):
+        # True when a new frame is drawn for the move
+        start = time.time()
+        if self.pan_position is not None:
+            self.videostream.pan(container_x - self.pan_position[0], container_y - self.pan_position[1])
+            self.pan_position = (container_x, container_y)
+            return self.videostream.zoom > 1
+        x, y = self.videostream.get_video_coord(container_x, container_y)
+        refreshed = True
+
+        if self.video_pressed:
+            if released:
+                logger.debug(f'Release on ({x}, {y})')
+                self.video_pressed = False
+                if self.drawing_shape is not None:
+                    self.drawing_pointer.remove_last()
+                    self.drawing_pointer.add_point(x, y)
+                    self.show_pointer(refresh=False)
+
+            if self.drawing_shape is not None:
+                if len(self.drawing_shape.points) > 1:
+                    self.drawing_shape.remove_last()
+                self.drawing_shape.add_point(x, y)
+                self.update_shape()
+            else:
+                refreshed = False
+        else:
+            if self.drawing_shape is not None:
+                self.drawing_pointer.remove_last()
+                self.drawing_pointer.add_point(x, y)
+                self.update_pointer()
+            else:
+                refreshed = self.hover_shape(self.shape_at(x, y))
+        self.videostream.latency.add('input.handler', time.time() - start)
+        return refreshed
+
+    def zoom_video(self, factor, container_x=None, container_y=None):
+        if self.videostream is not None:
+            if container_x is None:
+                container_x = self.ui_lbl_video.width() / 2
+                container_y = self.ui_lbl_video.height() / 2
+            self.videostream.zoom_at(factor, container_x, container_y)
+            self.ui_status_bar.showMessage(f'Zoom x{self.videostream.zoom:.1f}', 1000)
+
+    def reset_zoom(self):
+        if self.videostream is not None:
+            self.videostream.reset_zoom()
+            self.ui_status_bar.showMessage('Zoom x1.0', 1000)
+
+    def hover_shape(self, shape):
+        # True when the highlighted shape changed
+        id = shape.id if shape is not None else None
+        if id == self.hovered_shape:
+            return False
+        self.hovered_shape = id
+        if id is None:
+            # back to the shape selected in the timeline, if any
+            selected = self.list_timeline_get_selected()
+            id = selected[2].id if selected is not None else None
+        self.videostream.highlight_shape(id)
+        self.videostream.refresh()
+        return True
+
+    def select_shape(self, shape):
+        if shape is not None:
+            i = self.timeline_position(shape.id)
+            if i is not None:
+                self.ui_list_timeline.setCurrentRow(i)
+
     def clear_timeline(self):
+        self.importer.cancel()
         if self.videostream is not None:
             self.videostream.clear_shapes()
         self.timeline.clear()
+        self.shape_index.clear()
+        self.hovered_shape = None
         self.update_list_timeline()
 
     def delete_selected_list_timeline(self):
@@ -373,6 +710,7 @@ class Main:
             index, frame, shape = selected
             self.videostream.remove_shape(shape.id)
             self.videostream.refresh()
+            self.shape_index.remove(shape.id)
             del self.timeline[index]
             self.update_list_timeline()
             return frame, shape
@@ -390,10 +728,15 @@ class Main:
                 return (i.row(),) + self.timeline[i.row()]
         return None
 
+    @staticmethod
+    def timeline_item_text(frame, shape):
+        if isinstance(shape, Track):
+            return f'{shape.first + 1}-{shape.last + 1} - {shape.message} ({shape.shape} track, {len(shape)} keyframes)'
+        return f'{frame + 1} - {shape.message} ({shape.shape})'
+
     def update_list_timeline(self):
         self.ui_list_timeline.clear()
-        for (frame, shape) in self.timeline:
-            self.ui_list_timeline.addItem(f'{frame + 1} - {shape.message} ({shape.shape})')
+        self.ui_list_timeline.addItems([self.timeline_item_text(frame, shape) for (frame, shape) in self.timeline])
 
     def ui_list_timeline_item_changed(self):
         selected = self.list_timeline_get_selected()
@@ -411,7 +754,8 @@ class Main:
     def update_btn_create_event(self):
         self.ui_btn_create_event.setEnabled(self.videostream is not None and
                                             self.drawing_shape is not None and
-                                            self.drawing_shape.valid and len(self.ui_list_messages.selectedItems()) > 0)
+                                            self.drawing_shape.valid and (self.keyframe_target is not None or
+                                                                          len(self.ui_list_messages.selectedItems()) > 0))
 
     def get_selected_message_index(self):
         selected_indexes = self.ui_list_messages.selectedIndexes()
@@ -457,7 +801,11 @@ class Main:
         self.ui_lbl_video.setFocus()
 
     def ui_btn_create_event_clicked(self):
-        if self.videostream is not None and self.drawing_shape is not None and self.drawing_shape.valid and len(
+        if self.videostream is not None and self.keyframe_target is not None and self.drawing_shape is not None and \
+                self.drawing_shape.valid:
+            self.pause()
+            self.add_keyframe()
+        elif self.videostream is not None and self.drawing_shape is not None and self.drawing_shape.valid and len(
                 self.ui_list_messages.selectedItems()) > 0:
             self.pause()
             self.drawing_shape.id = uuid.uuid1().hex
@@ -465,6 +813,7 @@ class Main:
             self.drawing_shape.last_color = (255, 0, 0)
             self.videostream.add_shape(self.videostream.current_frame, self.drawing_shape)
             self.timeline.append((self.videostream.current_frame, self.drawing_shape))
+            self.shape_index.add(self.videostream.current_frame, self.drawing_shape)
             self.update_list_timeline()
             self.reset_shape()
         elif self.drawing_shape is not None and self.drawing_shape.valid:
@@ -537,12 +886,18 @@ class Main:
             if refresh:
                 self.videostream.refresh()
 
+    def update_inspector(self, json):
+        if json != self.inspector_json:
+            self.inspector_json = json
+            self.ui_text_json_shape.setHtml(json_to_html(json) if json else '')
+
     def reset_shape(self, refresh=True):
         if self.videostream:
             self.videostream.remove_drawing_shape('drawing_shape')
             self.drawing_shape = None
+            self.keyframe_target = None
             self.hide_pointer(refresh=False)
-            self.ui_text_json_shape.setHtml('')
+            self.update_inspector('')
             if refresh:
                 self.videostream.refresh()
         self.update_btn_create_event()
@@ -550,7 +905,7 @@ class Main:
     def update_shape(self, refresh=True):
         if self.drawing_shape is not None:
             self.videostream.add_drawing_shape(self.drawing_shape)
-            self.ui_text_json_shape.setHtml(json_to_html(self.drawing_shape.to_json(hide_id=True)))
+            self.update_inspector(self.drawing_shape.to_json(hide_id=True))
             if refresh:
                 self.videostream.refresh()
             self.update_btn_create_event()
@@ -681,6 +1036,26 @@ class Main:
             if self.videostream.playing:
                 self.deselect_list_timeline()
 
+    def next_cut(self):
+        if self.videostream:
+            cut = self.scene_detector.next_cut(self.videostream.current_frame)
+            if cut is not None:
+                self.deselect_list_timeline()
+                self.skip_to(cut)
+
+    def previous_cut(self):
+        if self.videostream:
+            cut = self.scene_detector.previous_cut(self.videostream.current_frame)
+            if cut is not None:
+                self.deselect_list_timeline()
+                self.skip_to(cut)
+
+    def on_scene_progress(self, done, total, cuts):
+        if done < total:
+            self.ui_lbl_scenes.setText(f'Scene cuts: {cuts} ({done * 100 // max(total, 1)}%)')
+        else:
+            self.ui_lbl_scenes.setText(f'Scene cuts: {cuts}')
+
     def ui_slider_speed_valueChanged(self):
         if self.videostream:
             slider_value = self.ui_slider_speed.value()
@@ -698,7 +1073,12 @@ class Main:
         self.ui_grp_time.setTitle(f'Time: {current_timestamp} / {total_timestamp}')
         self.ui_grp_frame.setTitle(f'Frame: {current_frame + 1} / {total_frames}')
 
-        self.ui_lbl_video.setPixmap(frame)
+        self.video_frame = FrameImage(frame)
+        self.ui_lbl_video.update()
+        self.videostream.frame_drawn(current_frame)
+        if self.input_time is not None:
+            self.videostream.latency.add('input', time.time() - self.input_time)
+            self.input_time = None
 
         if self.drawing_shape is not None:
             self.drawing_shape.frame = current_frame + 1
@@ -711,11 +1091,100 @@ class Main:
         if current_frame + 1 == total_frames:
             self.pause()
 
+    def ui_action_disk_cache_toggled(self, checked):
+        if self.videostream:
+            self.videostream.disk_cache(checked)
+
+    def ui_action_latency_stats_toggled(self, checked):
+        if self.videostream:
+            self.videostream.latency.clear()
+            self.videostream.profile(checked)
+        self.ui_lbl_latency.setVisible(checked)
+        if checked:
+            self.latency_timer.start()
+        else:
+            self.latency_timer.stop()
+
+    def update_latency_stats(self):
+        if self.videostream:
+            read_ahead = self.videostream.read_ahead
+            self.ui_lbl_latency.setText(f'{self.videostream.latency.to_status()} | '
+                                        f'dropped {self.videostream.dropped_frames} | '
+                                        f'read-ahead {read_ahead["frames"] if read_ahead else "-"}'
+                                        f'{self.cache_stats_status()}')
+
+    def cache_stats_status(self):
+        stats = self.videostream.cache_stats
+        if stats is None:
+            return ''
+        status = f' | raw hits {stats["raw"]["hits"]}, decoded {stats["decoded"]}'
+        if stats['compressed'] is not None:
+            compressed = stats['compressed']
+            status += (f' | {compressed["codec"]} {compressed["frames"]} frames, '
+                       f'hit {compressed["hit_rate"] * 100:.0f}%, '
+                       f'enc {compressed["encode_ms"]:.1f}ms, dec {compressed["decode_ms"]:.1f}ms')
+        if stats['disk'] is not None:
+            disk = stats['disk']
+            status += f' | disk {disk["frames"]} frames ({disk["bytes"] / 1024 / 1024:.0f}MB), hits {disk["hits"]}'
+        if stats.get('pipeline') is not None:
+            # queued frames and time per frame of each stage, the slowest one sets the throughput
+            status += ' | ' + ', '.join(f'{name} {stage["depth"]}/{stage["capacity"]} {stage["busy_ms"]:.1f}ms'
+                                        for (name, stage) in stats['pipeline'].items())
+        return status
+
+    def ui_action_dump_latency_stats_triggered(self):
+        if self.videostream is not None:
+            filename, file_filter = QFileDialog.getSaveFileName(parent=self.window,
+                                                                caption='Dump latency statistics',
+                                                                dir=QDir.homePath() + '/latency.json',
+                                                                filter='JSON Files (*.json)')
+            if filename:
+                with open(filename, 'w') as f:
+                    json.dump({
+                        'latency': self.videostream.latency.summary(),
+                        'dropped_frames': self.videostream.dropped_frames,
+                        'read_ahead': self.videostream.read_ahead,
+                        'cache': self.videostream.cache_stats,
+                    }, f, indent=2)
+                self.ui_status_bar.showMessage("Latency statistics saved!", 2000)
+
+    def ui_action_record_trace_toggled(self, checked):
+        if self.videostream:
+            self.videostream.trace(checked)
+
+    def ui_action_export_trace_triggered(self):
+        if self.videostream is not None:
+            filename, file_filter = QFileDialog.getSaveFileName(parent=self.window,
+                                                                caption='Export trace',
+                                                                dir=QDir.homePath() + '/trace.json',
+                                                                filter='Chrome Trace Files (*.json)')
+            if filename:
+                self.videostream.export_trace(filename)
+                self.ui_status_bar.showMessage("Trace exported!", 2000)
+
+    def paint_video_frame(self):
+        painter = QPainter(self.ui_lbl_video)
+        painter.fillRect(self.ui_lbl_video.rect(), Qt.black)
+        width, height = self.videostream.resized_size if self.videostream else (1, 1)
+        if width <= 1 or height <= 1:
+            width, height = self.video_frame.width, self.video_frame.height
+        x = (self.ui_lbl_video.width() - width) // 2
+        y = (self.ui_lbl_video.height() - height) // 2
+        if (width, height) == (self.video_frame.width, self.video_frame.height):
+            painter.drawImage(x, y, self.video_frame.image)
+        else:
+            # rendered for another size, e.g. while the window is being resized
+            painter.drawImage(QRect(x, y, width, height), self.video_frame.image)
+        painter.end()
+
     def save_annotations(self, filename):
         if self.videostream is not None and filename:
             self.ui_status_bar.showMessage("Saving annotations...")
             self.last_saved_annotations_path = filename
-            t = [shape.to_save_format(frame) for (frame, shape) in self.timeline]
+            if self.ui_action_save_timestamps.isChecked():
+                t = [shape.to_save_format(frame, self.videostream.index_to_time(frame)) for (frame, shape) in self.timeline]
+            else:
+                t = [shape.to_save_format(frame) for (frame, shape) in self.timeline]
             j = json.dumps(t, indent=2)
             with open(filename, 'w') as f:
                 f.write(j)
@@ -725,33 +1194,62 @@ class Main:
         if filename:
             self.ui_status_bar.showMessage("Loading annotations...")
             self.last_saved_annotations_path = filename
-            self.ui_list_timeline.itemSelectionChanged.disconnect(self.ui_list_timeline_item_changed)
-            self.clear_shapes_and_messages()
             with open(filename) as f:
                 loaded_data = json.load(f)
-                new_messages = []
-                new_timeline = []
-                shapes = []
-
-                for t in loaded_data:
-                    frame = t['frame']
-                    shape = Shape.from_save_format(t)
-
-                    new_timeline.append((frame, shape))
+            self.set_annotations([(t['frame'], from_save_format(t)) for t in loaded_data])
+            self.ui_status_bar.showMessage("Annotations loaded!", 2000)
 
-                    if shape.message not in new_messages:
-                        new_messages.append(shape.message)
+    def set_annotations(self, shapes):
+        self.ui_list_timeline.itemSelectionChanged.disconnect(self.ui_list_timeline_item_changed)
+        self.clear_shapes_and_messages()
+        new_messages = []
+        for (frame, shape) in shapes:
+            self.shape_index.add(frame, shape)
+            if shape.message not in new_messages:
+                new_messages.append(shape.message)
+        self.videostream.set_shapes(shapes)
+        for m in new_messages:
+            self.add_message_to_list(m)
+
+        self.timeline = list(shapes)
+        self.update_list_timeline()
+        self.videostream.refresh()
+        self.ui_list_timeline.itemSelectionChanged.connect(self.ui_list_timeline_item_changed)
 
-                    shapes.append((frame, shape))
-                self.videostream.set_shapes(shapes)
-                for m in new_messages:
-                    self.add_message_to_list(m)
+    def ui_action_open_project_triggered(self):
+        filename, file_filter = QFileDialog.getSaveFileName(parent=self.window,
+                                                            caption='Open or create project',
+                                                            dir=QDir.homePath() + '/annotations.sqlite',
+                                                            filter='Project Files (*.sqlite *.db)',
+                                                            options=QFileDialog.DontConfirmOverwrite)
+        if filename:
+            if self.project is not None:
+                self.project.close()
+            self.project = ProjectStore(filename)
+            self.ui_action_save_to_project.setEnabled(True)
+            self.ui_status_bar.showMessage(f'Project {Path(filename).name} opened', 2000)
+            if self.videostream is not None and self.videostream.filename is not None:
+                self.load_project_annotations()
+
+    def load_project_annotations(self):
+        # only the rows of the open video are read
+        self.project_video_id = self.project.video(self.videostream.filename, fps=self.videostream.fps,
+                                                   width=self.videostream.width, height=self.videostream.height,
+                                                   total_frames=self.videostream.total_frames)
+        shapes = list(self.project.load(self.project_video_id))
+        if len(shapes) > 0:
+            self.last_saved_annotations_path = None
+            self.set_annotations(shapes)
+            self.ui_status_bar.showMessage(f'{len(shapes)} annotations loaded from the project', 2000)
 
-                self.timeline = new_timeline
-                self.update_list_timeline()
-                self.videostream.refresh()
-            self.ui_list_timeline.itemSelectionChanged.connect(self.ui_list_timeline_item_changed)
-            self.ui_status_bar.showMessage("Annotations loaded!", 2000)
+    def ui_action_save_to_project_triggered(self):
+        if self.videostream is not None and self.project is not None and self.project_video_id is not None:
+            self.pause()
+            save_timestamps = self.ui_action_save_timestamps.isChecked()
+            saved = self.project.replace(self.project_video_id, (
+                dict(shape.to_save_format(frame, self.videostream.index_to_time(frame) if save_timestamps else None),
+                     id=shape.id) for (frame, shape) in self.timeline))
+            self.ui_status_bar.showMessage(f'{saved} annotations saved to the project', 2000)
 
     def ui_action_save_annotations_triggered(self):
         if self.videostream is not None:
@@ -770,6 +1268,62 @@ class Main:
                                                                 filter='JSON Files (*.json)')
             self.save_annotations(filename)
 
+    def ui_action_export_annotations_triggered(self):
+        if self.videostream is not None:
+            self.pause()
+            filename, file_filter = QFileDialog.getSaveFileName(parent=self.window,
+                                                                caption='Export annotations',
+                                                                dir=QDir.homePath() + '/' + self.video_filename,
+                                                                filter=';;'.join(EXPORT_FILTERS))
+            if filename:
+                self.ui_status_bar.showMessage("Exporting annotations...")
+                result = export(timeline_annotations(list(self.timeline)), filename, EXPORT_FILTERS[file_filter],
+                                width=self.videostream.width, height=self.videostream.height,
+                                name=self.video_filename or 'frame', total_frames=self.videostream.total_frames)
+                self.ui_status_bar.showMessage(f'{result["exported"]} annotations exported'
+                                               f'{" (" + str(result["skipped"]) + " without an area skipped)" if result["skipped"] else ""}',
+                                               3000)
+
+    def ui_action_import_annotations_triggered(self):
+        if self.videostream is not None:
+            self.pause()
+            filename, file_filter = QFileDialog.getOpenFileName(parent=self.window,
+                                                                caption='Import annotations',
+                                                                dir=QDir.homePath(),
+                                                                filter=';;'.join(IMPORT_FILTERS))
+            if filename:
+                self.ui_status_bar.showMessage("Importing annotations...")
+                self.importer.start(filename, IMPORT_FILTERS[file_filter])
+
+    def on_import_chunk(self, generation, shapes):
+        # chunks of a cancelled import may still be queued, e.g. after the timeline was cleared
+        if not self.importer.current(generation):
+            return
+        # shapes arrive a chunk at a time from the importer thread, the lists are only appended to
+        existing = {self.ui_list_messages.item(i).text() for i in range(self.ui_list_messages.count())}
+        for (frame, shape) in shapes:
+            self.shape_index.add(frame, shape)
+            if shape.message not in existing:
+                existing.add(shape.message)
+                self.ui_list_messages.addItem(shape.message)
+        self.timeline.extend(shapes)
+        self.ui_list_timeline.addItems([self.timeline_item_text(frame, shape) for (frame, shape) in shapes])
+        self.videostream.add_shapes(shapes)
+        self.ui_status_bar.showMessage(f'Importing annotations... {len(self.timeline)}')
+        self.importer.consumed(generation)
+
+    def on_import_finished(self, generation, imported, elapsed):
+        if not self.importer.current(generation):
+            return
+        self.videostream.refresh()
+        self.ui_status_bar.showMessage(f'{imported} annotations imported in {elapsed:.1f}s', 3000)
+
+    def on_import_failed(self, generation, error):
+        if not self.importer.current(generation):
+            return
+        self.videostream.refresh()
+        self.ui_status_bar.showMessage(f'Import failed: {error}', 5000)
+
     def ui_action_load_annotations_triggered(self):
         if self.videostream is not None:
             self.pause()
@@ -788,38 +1342,60 @@ class Main:
         if filename:
             self.load_video(filename)
 
+    def ui_action_load_image_sequence_triggered(self):
+        directory = QFileDialog.getExistingDirectory(parent=self.window,
+                                                     caption='Open image sequence',
+                                                     dir=QDir.homePath())
+        if directory:
+            self.load_video(directory)
+
     def clear_shapes_and_messages(self):
         self.reset_shape(refresh=False)
         self.clear_messages()
         self.clear_timeline()
 
     def load_video(self, filename):
-        if self.videostream is not None and not self.videostream.is_destroyed:
+        if VideoStream.check_valid_video_file(filename):
+            self.tracker.cancel()
+            self.propagating.clear()
             self.clear_shapes_and_messages()
-
-            def after_destroying():
-                self.videostream.destroyed.disconnect(after_destroying)
-                self.load_video(filename)
-            self.videostream.destroyed.connect(after_destroying)
-            self.videostream.destroy()
-        else:
             self.last_saved_annotations_path = None
+            self.project_video_id = None
             self.video_filename = Path(filename).stem
-            if VideoStream.check_valid_video_file(filename):
+
+            if self.videostream is None:
                 self.videostream = VideoStream()
-                self.videostream.start(filename,
-                                       self.ui_lbl_video.frameGeometry().width(), self.ui_lbl_video.frameGeometry().height())
+                self.videostream.start()
                 self.videostream.draw_frame_signal.connect(self.on_frame_drawn)
+                self.videostream.opened.connect(self.on_video_opened)
+                if self.ui_action_disk_cache.isChecked():
+                    self.videostream.disk_cache(True)
+                if self.ui_action_latency_stats.isChecked():
+                    self.videostream.profile(True)
+                if self.ui_action_record_trace.isChecked():
+                    self.videostream.trace(True)
+            self.videostream.open(filename,
+                                  self.ui_lbl_video.frameGeometry().width(), self.ui_lbl_video.frameGeometry().height())
+
+            self.ui_slider_speed.setValue(4)
+            self.ui_slider_speed.setEnabled(True)
+
+            self.play()
+        else:
+            self.ui_status_bar.showMessage("Invalid file", 3000)
 
-                self.ui_slider_speed.setValue(4)
-                self.ui_slider_speed.setEnabled(True)
-
-                self.play()
-            else:
-                self.ui_status_bar.showMessage("Invalid file", 3000)
-
+    def on_video_opened(self, filename, latency):
+        self.ui_status_bar.showMessage(f'Video loaded in {latency * 1000:.0f}ms', 2000)
+        # picks up where a previous session left the analysis
+        self.scene_detector.analyze(filename, self.videostream.total_frames)
+        if self.project is not None:
+            self.load_project_annotations()
 
     def about_to_quit(self):
+        if self.project is not None:
+            self.project.close()
+        self.tracker.destroy()
+        self.scene_detector.destroy()
         if self.videostream:
             self.videostream.destroy()
 
@@ -0,0 +1,54 @@
+import argparse
+import json
+import time
+
+from classes.ProjectStore import ProjectStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query and fill a project store holding the annotations of many '
+                                                 'videos.')
+    parser.add_argument('project', help='project file (SQLite), created if missing')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    migrate = commands.add_parser('migrate', help='import annotation files saved by the application')
+    migrate.add_argument('annotations', nargs='+')
+    migrate.add_argument('--video', nargs='+', help='annotated videos, in the same order as the annotation files')
+
+    commands.add_parser('videos', help='list videos and their number of shapes')
+
+    query = commands.add_parser('query', help='search shapes across videos')
+    query.add_argument('--message', help='exact message, or a LIKE pattern with %%')
+    query.add_argument('--video', help='exact video name, or a LIKE pattern with %%')
+    query.add_argument('--shape')
+    query.add_argument('--start', type=int, help='first frame')
+    query.add_argument('--end', type=int, help='frame after the last one')
+    query.add_argument('--limit', type=int)
+    query.add_argument('--count', action='store_true', help='only count shapes per message and video')
+    args = parser.parse_args()
+
+    with ProjectStore(args.project) as store:
+        start = time.time()
+        if args.command == 'migrate':
+            videos = args.video or [None] * len(args.annotations)
+            if len(videos) != len(args.annotations):
+                parser.error('give one video per annotation file')
+            for annotations, video in zip(args.annotations, videos):
+                video_id, inserted = store.migrate(annotations, video)
+                print(json.dumps({'annotations': annotations, 'video_id': video_id, 'inserted': inserted}))
+            store.analyze()
+        elif args.command == 'videos':
+            for video in store.videos():
+                print(json.dumps(video))
+        elif args.count:
+            for row in store.count(args.message):
+                print(json.dumps(row))
+        else:
+            for entry in store.query(args.message, args.video, args.shape, args.start, args.end, args.limit):
+                print(json.dumps(entry))
+        print(f'# {(time.time() - start) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import sys
+import time
+from threading import Thread
+
+from classes.FrameServer import FrameClient, FrameServer
+from classes.Tiles import configure
+
+
+def harness(server: FrameServer, clients, frames, batch):
+    # several clients against one server on localhost: each one prefetches frames in batches while creating,
+    # updating and deleting annotations, and every client has to see the events of all the others
+    host, port = server.address
+    total_frames = FrameClient(host, port).info()['total_frames']
+    frames = min(frames, total_frames)
+    results = [None] * clients
+    sockets = [FrameClient(host, port).events() for _ in range(clients)]
+    received = [[] for _ in range(clients)]
+
+    def listen(i):
+        while True:
+            event = sockets[i].receive()
+            if event is None:
+                return
+            received[i].append(event)
+
+    def work(i):
+        client = FrameClient(host, port)
+        latencies = []
+        fetched = 0
+        created = []
+        # clients start on different parts of the video and overlap with their neighbours
+        start = i * frames // (clients * 2)
+        for first in range(start, start + frames, batch):
+            indexes = [index % total_frames for index in range(first, first + batch)]
+            begin = time.time()
+            fetched += len(client.frames(indexes, width=640, decode=False))
+            latencies.append(time.time() - begin)
+            annotation = client.create({'shape': 'rectangle', 'frame': indexes[0], 'points': [[10, 10], [50 + i, 50]],
+                                        'message': f'client {i}'})
+            created.append(annotation['id'])
+            client.update(annotation['id'], dict(annotation, message=f'client {i} updated'))
+        for id in created[::2]:
+            client.delete(id)
+        client.close()
+        latencies.sort()
+        results[i] = {'fetched': fetched, 'changes': len(created) * 2 + len(created[::2]),
+                      'batch_ms_p50': latencies[len(latencies) // 2] * 1000,
+                      'batch_ms_max': latencies[-1] * 1000}
+
+    listeners = [Thread(target=listen, args=(i,), daemon=True) for i in range(clients)]
+    workers = [Thread(target=work, args=(i,)) for i in range(clients)]
+    for thread in listeners:
+        thread.start()
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    expected = sum(result['changes'] for result in results if result is not None)
+    deadline = time.time() + 5
+    while time.time() < deadline and any(len(r) < expected for r in received):
+        time.sleep(0.05)
+    for ws in sockets:
+        ws.close()
+
+    remaining = FrameClient(host, port).annotations()
+    report = {
+        'clients': clients,
+        'seconds': round(elapsed, 2),
+        'frames_per_second': round(sum(r['fetched'] for r in results if r is not None) / elapsed, 1),
+        'events_expected': expected,
+        'events_received': [len(r) for r in received],
+        'annotations': len(remaining),
+        'per_client': results,
+        'server': server.stats(),
+    }
+    report['ok'] = None not in results and all(len(r) == expected for r in received)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve rendered frames and annotations of a video to several '
+                                                 'annotation clients.')
+    parser.add_argument('video')
+    parser.add_argument('--annotations', help='annotation file, loaded on start and saved as it changes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--decoders', type=int, default=2, help='captures of the video decoding in parallel')
+    parser.add_argument('--cache-mb', type=int, default=256, help='budget of the rendered frames cache')
+    parser.add_argument('--harness', type=int, metavar='CLIENTS',
+                        help='run the given number of clients against a server on localhost and report')
+    parser.add_argument('--harness-frames', type=int, default=300)
+    parser.add_argument('--harness-batch', type=int, default=16)
+    parser.add_argument('--tile-workers', type=int, default=1,
+                        help='threads sharing the resize of a large frame, requests are already served in parallel')
+    args = parser.parse_args()
+    configure(args.tile_workers)
+
+    if args.harness is not None:
+        server = FrameServer(args.video, host='127.0.0.1', port=0, decoders=args.decoders,
+                             rendered_budget_bytes=args.cache_mb * 1024 * 1024)
+        server.start()
+        report = harness(server, args.harness, args.harness_frames, args.harness_batch)
+        server.shutdown()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['ok'] else 1)
+
+    server = FrameServer(args.video, args.annotations, args.host, args.port, args.decoders,
+                         args.cache_mb * 1024 * 1024)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the application modules are imported the way the application does, from src/main/python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'python'))
@@ -0,0 +1,155 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from classes import Exporters, Importers
+from classes.Exporters import export, geometry, sorted_by_frame
+from classes.Shape import ShapeType
+
+ANNOTATIONS = [
+    {'shape': ShapeType.rectangle, 'points': [[10, 20], [50, 80]], 'message': 'car', 'frame': 3},
+    {'shape': ShapeType.polygon, 'points': [[0, 0], [40, 0], [40, 30], [10, 30]], 'message': 'road', 'frame': 0},
+    {'shape': ShapeType.ellipse, 'points': [[100, 100], [140, 120]], 'message': 'ball', 'frame': 3},
+    {'shape': ShapeType.line, 'points': [[1, 1], [5, 5], [9, 2]], 'message': 'lane', 'frame': 7},
+    {'shape': ShapeType.globals, 'points': [], 'message': 'goal', 'frame': 7},
+    {'shape': ShapeType.rectangle, 'points': [[60, 40], [20, 10]], 'message': 'car', 'frame': 1},
+]
+
+
+def entries(count, seed=0):
+    rng = np.random.RandomState(seed)
+    return [{'shape': ShapeType.rectangle, 'points': [[i, i], [i + 1, i + 1]], 'message': str(i),
+             'frame': int(frame)} for i, frame in enumerate(rng.randint(0, 50, count))]
+
+
+def test_sorted_in_memory():
+    annotations = entries(100)
+    assert list(sorted_by_frame(annotations)) == sorted(annotations, key=lambda e: e['frame'])
+
+
+def test_sorted_with_spills(monkeypatch):
+    spills = []
+    temporary_file = Exporters.tempfile.TemporaryFile
+
+    def counted(*args, **kwargs):
+        spills.append(None)
+        return temporary_file(*args, **kwargs)
+
+    monkeypatch.setattr(Exporters, 'SORT_BATCH_SIZE', 16)
+    monkeypatch.setattr(Exporters.tempfile, 'TemporaryFile', counted)
+    annotations = entries(16 * 5 + 7)
+    # stable like sorted(): annotations of the same frame keep their order across the spilled runs
+    assert list(sorted_by_frame(annotations)) == sorted(annotations, key=lambda e: e['frame'])
+    assert len(spills) == 5
+
+
+def test_sorted_exact_multiple_of_batch():
+    annotations = entries(30)
+    assert list(sorted_by_frame(annotations, batch_size=10)) == sorted(annotations, key=lambda e: e['frame'])
+
+
+def test_geometry_padding():
+    batch = [
+        {'shape': ShapeType.polygon, 'points': [[0, 0], [4, 0], [0, 3]], 'frame': 0},
+        {'shape': ShapeType.polygon, 'points': [[0, 0], [10, 0], [10, 10], [5, 15], [0, 10]], 'frame': 0},
+        {'shape': ShapeType.rectangle, 'points': [[30, 40], [10, 20]], 'frame': 0},
+        {'shape': ShapeType.ellipse, 'points': [[0, 0], [20, 10]], 'frame': 0},
+        {'shape': ShapeType.globals, 'points': [], 'frame': 0},
+    ]
+    types, counts, points, bbox, area = geometry(batch)
+    assert counts.tolist() == [3, 5, 2, 2, 0]
+    assert points.shape == (5, 5, 2)
+    # padded with the first point, which changes neither the bounding box nor the area
+    assert points[0, 3:].tolist() == [[0, 0], [0, 0]]
+    assert bbox.tolist() == [[0, 0, 4, 3], [0, 0, 10, 15], [10, 20, 20, 20], [0, 0, 20, 10], [0, 0, 0, 0]]
+    assert area.tolist() == pytest.approx([6, 125, 400, math.pi * 20 * 10 / 4, 0])
+
+
+def shapes(chunks):
+    return sorted((frame, shape.shape, shape.points, shape.message) for chunk in chunks for (frame, shape) in chunk)
+
+
+def exported(format, tmp_path, annotations=ANNOTATIONS):
+    filename = str(tmp_path / f'annotations.{format}')
+    result = export(iter(annotations), filename, format, width=640, height=360, name='video', total_frames=10)
+    return filename, result
+
+
+def test_coco_round_trip(tmp_path):
+    filename, result = exported('coco', tmp_path)
+    # lines and global events have no area
+    assert result == {'exported': 4, 'skipped': 2}
+    imported = shapes(Importers.import_coco(filename))
+    assert [(frame, shape, points, message) for (frame, shape, points, message) in imported
+            if shape != ShapeType.polygon or message != 'ball'] == [
+        (0, ShapeType.polygon, [(0, 0), (40, 0), (40, 30), (10, 30)], 'road'),
+        (1, ShapeType.rectangle, [(20, 10), (60, 40)], 'car'),
+        (3, ShapeType.rectangle, [(10, 20), (50, 80)], 'car'),
+    ]
+    # ellipses are exported as polygons around them
+    ball = [points for (frame, shape, points, message) in imported if message == 'ball']
+    assert len(ball) == 1 and len(ball[0]) == Exporters.ELLIPSE_SEGMENTS
+    xs, ys = zip(*ball[0])
+    assert (min(xs), min(ys), max(xs), max(ys)) == (100, 100, 140, 120)
+
+
+@pytest.mark.parametrize('order', [('images', 'annotations', 'categories'),
+                                   ('annotations', 'images', 'categories'),
+                                   ('categories', 'annotations', 'images')])
+def test_coco_key_order(tmp_path, order):
+    # official COCO files put the categories after the annotations
+    filename, _ = exported('coco', tmp_path)
+    with open(filename) as f:
+        document = json.load(f)
+    with open(filename, 'w') as f:
+        json.dump(dict([('info', {'year': 2020}), ('licenses', [])] + [(key, document[key]) for key in order]), f)
+    imported = shapes(Importers.import_coco(filename))
+    assert sorted((frame, message) for (frame, shape, points, message) in imported) == [
+        (0, 'road'), (1, 'car'), (3, 'ball'), (3, 'car')]
+
+
+def test_mot_round_trip(tmp_path):
+    filename, result = exported('mot', tmp_path)
+    assert result['exported'] == 4 and result['skipped'] == 2
+    tracks = {f'track {i}': message for (i, message) in result['tracks'].items()}
+    imported = [(frame, shape, points, tracks[message])
+                for (frame, shape, points, message) in shapes(Importers.import_mot(filename))]
+    # only bounding boxes, in frame order
+    assert imported == [
+        (0, ShapeType.rectangle, [(0, 0), (40, 30)], 'road'),
+        (1, ShapeType.rectangle, [(20, 10), (60, 40)], 'car'),
+        (3, ShapeType.rectangle, [(10, 20), (50, 80)], 'car'),
+        (3, ShapeType.rectangle, [(100, 100), (140, 120)], 'ball'),
+    ]
+
+
+def test_cvat_round_trip(tmp_path):
+    filename, result = exported('cvat', tmp_path)
+    assert result == {'exported': 6, 'skipped': 0}
+    assert shapes(Importers.import_cvat(filename)) == [
+        (0, ShapeType.polygon, [(0, 0), (40, 0), (40, 30), (10, 30)], 'road'),
+        (1, ShapeType.rectangle, [(20, 10), (60, 40)], 'car'),
+        (3, ShapeType.ellipse, [(100, 100), (140, 120)], 'ball'),
+        (3, ShapeType.rectangle, [(10, 20), (50, 80)], 'car'),
+        (7, ShapeType.globals, [], 'goal'),
+        (7, ShapeType.line, [(1, 1), (5, 5), (9, 2)], 'lane'),
+    ]
+
+
+def test_round_trip_with_spills(tmp_path, monkeypatch):
+    monkeypatch.setattr(Exporters, 'SORT_BATCH_SIZE', 8)
+    annotations = entries(50)
+    filename, result = exported('cvat', tmp_path, annotations)
+    assert result['exported'] == 50
+    assert shapes(Importers.import_cvat(filename)) == sorted(
+        (e['frame'], ShapeType.rectangle, [tuple(p) for p in e['points']], e['message']) for e in annotations)
+
+
+def test_mot_too_few_columns(tmp_path):
+    filename = str(tmp_path / 'short.txt')
+    with open(filename, 'w') as f:
+        f.write('1,1,10,20,30\n')
+    with pytest.raises(ValueError):
+        list(Importers.import_mot(filename))
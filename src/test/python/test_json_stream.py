@@ -0,0 +1,57 @@
+import io
+import json
+
+import pytest
+
+from classes.JsonStream import JsonStream
+
+
+def stream(value, chunk_size):
+    return JsonStream(io.StringIO(json.dumps(value)), chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 64])
+def test_array_across_chunks(chunk_size):
+    value = [123456789, -1.5e-3, 'a "quoted", string', {'points': [[1, 2], [3, 4]]}, [], {}, True, None, 0]
+    assert list(stream(value, chunk_size).iter_array()) == value
+
+
+@pytest.mark.parametrize('offset', range(-3, 4))
+def test_number_straddling_chunk_size(offset):
+    # the number starts a few characters before the end of the first chunk and ends in the next one
+    prefix = '[' + ' ' * 10 + '"x", '
+    chunk_size = len(prefix) + 3 + offset
+    document = prefix + '1234567.25e2, 98765]'
+    assert list(JsonStream(io.StringIO(document), chunk_size).iter_array()) == ['x', 1234567.25e2, 98765]
+
+
+def test_number_at_end_of_document():
+    assert JsonStream(io.StringIO('  4096'), 2).decode() == 4096
+
+
+def test_empty_array():
+    assert list(JsonStream(io.StringIO(' [ ] '), 1).iter_array()) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 1 << 16])
+def test_object_with_streamed_members(chunk_size):
+    value = {'images': [{'id': 1}, {'id': 2}], 'categories': [{'id': 1, 'name': 'a'}], 'annotations': [],
+             'info': {'year': 2020}}
+    members = list(stream(value, chunk_size).iter_object(streamed=('images', 'annotations')))
+    assert members == [
+        ('images', {'id': 1}, True),
+        ('images', {'id': 2}, True),
+        ('categories', [{'id': 1, 'name': 'a'}], False),
+        ('info', {'year': 2020}, False),
+    ]
+
+
+def test_empty_object():
+    assert list(JsonStream(io.StringIO('{}'), 1).iter_object()) == []
+
+
+def test_invalid_document():
+    with pytest.raises(ValueError):
+        list(JsonStream(io.StringIO('[1, 2'), 2).iter_array())
+    with pytest.raises(ValueError):
+        list(JsonStream(io.StringIO('{"a" 1}'), 2).iter_object())
@@ -0,0 +1,16 @@
+import pytest
+
+from classes.Rendering import fit_size
+
+
+@pytest.mark.parametrize('container, size', [
+    ((1280, 720), (1280, 720)),
+    ((1280, 1000), (1280, 720)),
+    ((2000, 720), (1280, 720)),
+    ((640, None), (640, 360)),
+    ((None, 360), (640, 360)),
+    ((None, None), (1920, 1080)),
+    ((0, 0), (1, 1)),
+])
+def test_fit_size(container, size):
+    assert fit_size(1920, 1080, *container) == size